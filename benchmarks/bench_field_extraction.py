@@ -0,0 +1,111 @@
+# Benchmark: field extraction cost per receipt, new engine vs. the original inline code.
+#
+#   python benchmarks/bench_field_extraction.py [--receipts 2000]
+#
+# Works on synthetic readtext output (boxes + text), so neither EasyOCR nor any model is needed.
+# For scale: EasyOCR itself takes on the order of seconds per receipt on CPU.
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from field_extraction import FieldExtractor, parse_date_fallback
+
+MERCHANTS = ["WALMART", "STARBUCKS", "SHELL", "Trader Joe's", "CVS Pharmacy", "Le Petit Bistro", "IKEA"]
+DATE_FORMATS = ["%Y-%m-%d", "%m/%d/%Y", "%d.%m.%Y", "%b %d, %Y", "%m-%d-%y", "%d %B %Y"]
+
+
+# One synthetic readtext result (header, items with prices, subtotal/tax/total, footer)
+# and the fields a correct extractor should return
+def synthetic_results(rng: random.Random):
+    rows = [[rng.choice(MERCHANTS)], ["123 Main Street"], ["Tel 555-201-3344"]]
+    day = f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"
+    rows.append([time.strftime(rng.choice(DATE_FORMATS), time.strptime(day, "%Y-%m-%d")), "14:32"])
+    subtotal = 0.0
+    for i in range(rng.randint(3, 15)):
+        price = rng.uniform(0.5, 60)
+        subtotal += price
+        rows.append([f"ITEM {i}", f"{price:.2f}"])
+    tax = subtotal * 0.08
+    rows += [["SUBTOTAL", f"{subtotal:.2f}"], ["TAX", f"{tax:.2f}"], ["TOTAL", f"{subtotal + tax:.2f}"],
+             ["CASH", f"{subtotal + tax + 5:.2f}"], ["THANK YOU"]]
+
+    expected = {"Date": day, "Place": rows[0][0], "Total": f"{subtotal + tax:.2f}"}
+    results = []
+    for line_no, row in enumerate(rows):
+        y = 20 + line_no * 30
+        for col, text in enumerate(row):
+            x = 10 + col * 200
+            box = [[x, y], [x + 150, y], [x + 150, y + 20], [x, y + 20]]
+            results.append((box, text, rng.uniform(0.6, 0.99)))
+    return results, expected
+
+
+# The extraction code as it was inlined in ReceiptOCR.process_receipt (minus the prints)
+def legacy_extract(results, dateparser) -> dict:
+    extracted_text = " ".join([res[1] for res in results])
+    date_patterns = [
+        r"\b\d{4}[-/]\d{2}[-/]\d{2}\b",
+        r"\b\d{2}[-/]\d{2}[-/]\d{4}\b",
+        r"\b\d{2}[-/]\d{2}[-/]\d{2}\b",
+        r"\b\d{1,2}[-/]\d{1,2}\s\d{4}\b",
+        r"\b\w+\s\d{1,2},\s\d{4}\b"
+    ]
+    date_found = None
+    for pattern in date_patterns:
+        match = re.search(pattern, extracted_text)
+        if match:
+            date_found = match.group()
+            break
+    date = "Unknown"
+    if date_found:
+        parsed = dateparser.parse(date_found)
+        date = parsed.strftime("%Y-%m-%d") if parsed else date_found
+    total_match = re.findall(r"\d{1,3}(?:[ ,]?\d{3})*(?:[.,]\d{2})", extracted_text)
+    total_normalized = [val.replace(" ", "").replace(",", ".") for val in total_match]
+    total = total_normalized[-1] if total_normalized else "Unknown"
+    place = results[0][1] if results else "Unknown"
+    return {"Date": date, "Place": place, "Total": total}
+
+
+# Seconds per receipt and share of receipts whose Date/Place/Total all match
+def measure(func, receipts):
+    start = time.perf_counter()
+    outputs = [func(results) for results, _ in receipts]
+    elapsed = (time.perf_counter() - start) / len(receipts)
+    correct = sum(all(out[k] == exp[k] for k in exp) for out, (_, exp) in zip(outputs, receipts))
+    return elapsed, correct / len(receipts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark receipt field extraction")
+    parser.add_argument("--receipts", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    receipts = [synthetic_results(rng) for _ in range(args.receipts)]
+    extractor = FieldExtractor()
+
+    print(f"{args.receipts} synthetic receipts")
+    new, accuracy = measure(extractor.extract, receipts)
+    print(f"FieldExtractor:        {new * 1e6:9.1f} us/receipt  accuracy {accuracy:.1%}")
+
+    start = time.perf_counter()
+    try:
+        import dateparser
+    except ImportError:
+        print("dateparser not installed: skipping the legacy comparison")
+        return
+    print(f"import dateparser:     {(time.perf_counter() - start) * 1e3:9.1f} ms (paid once by the legacy path)")
+    parse_date_fallback.cache_clear()
+    old, accuracy = measure(lambda r: legacy_extract(r, dateparser), receipts)
+    print(f"legacy inline code:    {old * 1e6:9.1f} us/receipt  accuracy {accuracy:.1%}  ({old / new:.1f}x slower)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,347 @@
+# Benchmark suite: receipt pipeline stages and ExpenseTracker operations on synthetic data.
+#
+#   python benchmarks/bench_suite.py                               # offline: no OCR model needed
+#   python benchmarks/bench_suite.py --ocr                         # also EasyOCR + classifier (loads models)
+#                                                                  # and the OCR time each preprocessing step saves
+#   python benchmarks/bench_suite.py --ledger-sizes 1000 1000000 --output results.json
+#   python benchmarks/bench_suite.py --save-baseline               # store results as the baseline
+#   python benchmarks/bench_suite.py --baseline benchmarks/baseline.json --tolerance 0.25
+#
+# Receipts are rendered with PIL (merchants, US/EU amounts, several date formats, noise and a
+# small rotation); ledgers of 1k to 1M rows are generated from a seed, so runs are reproducible.
+# Results are written as JSON ({"meta": ..., "results": {name: {median_ms, min_ms, runs}}}); with a
+# baseline every timing is compared against it and the exit status is 1 when any of them is
+# slower than the baseline by more than the tolerance, so the suite can gate a deploy.
+import argparse
+import io
+import itertools
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from bench_field_extraction import MERCHANTS, DATE_FORMATS
+from category_classifier import KeywordClassifier, TieredClassifier
+from expense_tracker import ExpenseTracker, DEFAULT_CATEGORIES
+from field_extraction import FieldExtractor
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+DEFAULT_LEDGER_SIZES = [1_000, 10_000, 100_000, 1_000_000]
+
+# Slowdowns smaller than this (in ms) are timer noise, not regressions
+NOISE_FLOOR_MS = 0.05
+
+VENDORS = MERCHANTS + ["Amazon", "Uber", "Netflix", "City Power", "Kroger", "Chevron", "Walgreens",
+                       "Delta Air Lines", "Coursera", "AMC Theatres"]
+
+
+# ---------------- TIMING ----------------
+# Run func `repeat` times (setup, if given, runs untimed before each call) and summarize in ms
+def timed(func, repeat: int = 5, setup=None) -> dict:
+    runs = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        runs.append((time.perf_counter() - start) * 1e3)
+    return {"median_ms": statistics.median(runs), "min_ms": min(runs), "runs": repeat}
+
+
+# Collects named timings and prints them as they come in
+class Report:
+
+    def __init__(self):
+        self.results = {}
+
+
+    def add(self, name: str, timing: dict):
+        self.results[name] = timing
+        print(f"  {name:<44} {timing['median_ms']:11.3f} ms  (min {timing['min_ms']:.3f}, n={timing['runs']})")
+
+
+# ---------------- SYNTHETIC RECEIPTS ----------------
+# Lines of one receipt and the fields a correct pipeline should return.
+# EU receipts use a decimal comma and day-first dates.
+def synthetic_receipt(rng: random.Random):
+    eu = rng.random() < 0.3
+    merchant = rng.choice(MERCHANTS)
+    day = datetime(2024, rng.randint(1, 12), rng.randint(1, 28))
+    date_format = rng.choice(["%d.%m.%Y", "%d/%m/%Y"]) if eu else rng.choice(DATE_FORMATS)
+
+    def money(value: float) -> str:
+        return f"{value:.2f}".replace(".", ",") if eu else f"{value:.2f}"
+
+    lines = [merchant, "123 Main Street", day.strftime(date_format) + "  14:32"]
+    subtotal = 0.0
+    for i in range(rng.randint(3, 12)):
+        price = rng.uniform(0.5, 60)
+        subtotal += price
+        lines.append(f"ITEM {i:<12} {money(price):>8}")
+    tax = subtotal * 0.08
+    lines += [f"SUBTOTAL {money(subtotal):>16}", f"TAX {money(tax):>21}",
+              f"TOTAL {money(subtotal + tax):>19}", "THANK YOU"]
+    expected = {"Date": day.strftime("%Y-%m-%d"), "Place": merchant, "Total": f"{subtotal + tax:.2f}"}
+    return lines, expected
+
+
+# Render receipt lines to PNG bytes with gaussian noise and a small rotation.
+# Also returns readtext-style (box, text, confidence) results of the unrotated layout, so the
+# extraction stages can be timed without running OCR.
+def render_receipt(lines, rng: random.Random, noise: float = 12.0, max_angle: float = 3.0):
+    from PIL import Image, ImageDraw, ImageFont
+
+    font = ImageFont.load_default()
+    line_height, width = 22, 360
+    image = Image.new("L", (width, 40 + line_height * len(lines)), color=255)
+    draw = ImageDraw.Draw(image)
+    results = []
+    for i, text in enumerate(lines):
+        x, y = 20, 20 + i * line_height
+        draw.text((x, y), text, fill=0, font=font)
+        right = x + draw.textlength(text, font=font)
+        results.append(([[x, y], [right, y], [right, y + 14], [x, y + 14]], text, rng.uniform(0.6, 0.99)))
+
+    pixels = np.asarray(image, dtype=np.float64)
+    pixels += np.random.default_rng(rng.randrange(2 ** 32)).normal(0, noise, pixels.shape)
+    image = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+    image = image.rotate(rng.uniform(-max_angle, max_angle), expand=True, fillcolor=255)
+
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue(), results
+
+
+# ---------------- RECEIPT PIPELINE ----------------
+# Time each stage of ReceiptOCR.process_receipt per receipt: preprocessing, OCR (only with
+# --ocr), line grouping, date, total, place and classification; plus, with --ocr, the whole
+# call and the OCR time on the first receipt as preprocessing steps are switched on one by one
+def bench_receipts(report: Report, count: int, seed: int, use_ocr: bool, save_dir: str = None):
+    rng = random.Random(seed)
+    receipts = []
+    for i in range(count):
+        lines, expected = synthetic_receipt(rng)
+        image_bytes, results = render_receipt(lines, rng)
+        receipts.append((image_bytes, results, expected))
+        if save_dir:
+            os.makedirs(save_dir, exist_ok=True)
+            with open(os.path.join(save_dir, f"receipt_{i:04d}.png"), "wb") as f:
+                f.write(image_bytes)
+    print(f"{count} synthetic receipts")
+
+    ocr = None
+    from image_preprocessing import ImagePreprocessor, measure_ocr_gains
+    if use_ocr:
+        from reciept_ocr import ReceiptOCR, _plain_results
+        start = time.perf_counter()
+        ocr = ReceiptOCR(preprocessor=ImagePreprocessor())
+        load_ms = (time.perf_counter() - start) * 1e3
+        report.add("receipt.model_load", {"median_ms": load_ms, "min_ms": load_ms, "runs": 1})
+        extractor, classifier, preprocessor = ocr.field_extractor, ocr.category_classifier, ocr.preprocessor
+    else:
+        extractor, classifier = FieldExtractor(), TieredClassifier(KeywordClassifier())
+        preprocessor = ImagePreprocessor()
+
+    stages = {name: [] for name in ["preprocess", "ocr", "lines", "date", "total", "place", "classify"]}
+    correct = 0
+    for image_bytes, results, expected in receipts:
+        start = time.perf_counter()
+        image = preprocessor(image_bytes)
+        stages["preprocess"].append(time.perf_counter() - start)
+
+        if ocr is not None:
+            start = time.perf_counter()
+            results = _plain_results(ocr.reader.readtext(image))
+            stages["ocr"].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        text = " ".join(res[1] for res in results)
+        lines = extractor.group_lines(results)
+        stages["lines"].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        found_date = extractor.find_date(text)
+        stages["date"].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        total = extractor.find_total(lines, text)
+        stages["total"].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        place = extractor.find_merchant(lines, results)
+        stages["place"].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        classifier.classify([text])
+        stages["classify"].append(time.perf_counter() - start)
+
+        correct += (found_date, place, total) == (expected["Date"], expected["Place"], expected["Total"])
+
+    for name, seconds in stages.items():
+        if seconds:
+            runs = [s * 1e3 for s in seconds]
+            report.add(f"receipt.{name}", {"median_ms": statistics.median(runs), "min_ms": min(runs),
+                                           "runs": len(runs)})
+    source = "OCR output" if ocr is not None else "layout ground truth"
+    print(f"  field accuracy on {source}: {correct / count:.1%}")
+
+    if ocr is not None:
+        images = iter([r[0] for r in receipts] * 2)
+        report.add("receipt.process_receipt", timed(lambda: ocr.process_receipt(next(images)),
+                                                    repeat=min(count, 20)))
+
+        gains = measure_ocr_gains(ocr.reader.readtext, receipts[0][0], preprocessor, repeats=3)
+        for stage in gains:
+            ocr_ms = stage["ocr_seconds"] * 1e3
+            report.add(f"receipt.ocr_after.{stage['step']}", {"median_ms": ocr_ms, "min_ms": ocr_ms, "runs": 3})
+        saved_ms = (gains[0]["ocr_seconds"] - gains[-1]["ocr_seconds"]) * 1e3
+        print(f"  preprocessing saves {saved_ms:.1f} ms of OCR ({gains[0]['shape']} -> {gains[-1]['shape']})")
+
+
+# ---------------- SYNTHETIC LEDGERS ----------------
+# A ledger in the CSV layout with `size` rows over ~3 years, skewed toward a few vendors
+def synthetic_ledger(size: int, seed: int) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    vendor_weights = rng.pareto(1.2, len(VENDORS)) + 1
+    days = pd.Timestamp("2022-01-01") + pd.to_timedelta(rng.integers(0, 3 * 365, size), unit="D")
+    return pd.DataFrame({
+        "id": np.arange(1, size + 1),
+        "amount": np.round(rng.lognormal(3, 1, size), 2).clip(0.01, None),
+        "date": days.strftime("%Y-%m-%d"),
+        "vendor": rng.choice(VENDORS, size, p=vendor_weights / vendor_weights.sum()),
+        "category": rng.choice(DEFAULT_CATEGORIES, size)
+    })
+
+
+# Time the ExpenseTracker operations the app uses on a CSV ledger of the given size
+def bench_ledger(report: Report, size: int, seed: int, workdir: str, journal: bool):
+    path = os.path.join(workdir, f"ledger_{size}.csv")
+    synthetic_ledger(size, seed).to_csv(path, index=False)
+    print(f"ledger of {size:,} rows" + (" (journal)" if journal else ""))
+    prefix = f"ledger.{size}."
+    heavy = 3 if size >= 100_000 else 5
+
+    report.add(prefix + "load_expenses", timed(lambda: ExpenseTracker(path, journal=journal), repeat=heavy))
+    tracker = ExpenseTracker(path, journal=journal)
+
+    # Every added expense gets its own amount: repeating vendor, date and amount would make
+    # each add log a probable-duplicate warning and time the logging too
+    amounts = (cents / 100 for cents in itertools.count(1))
+
+    def add_and_save():
+        tracker.add_expense(next(amounts), "2024-06-01", "Benchmark Cafe", "Food & Dining")
+        tracker.save_expenses()
+    report.add(prefix + "add_expense+save", timed(add_and_save, repeat=heavy))
+    report.add(prefix + "add_expense", timed(
+        lambda: tracker.add_expense(next(amounts), "2024-06-02", "Benchmark Cafe", "Food & Dining"), repeat=50))
+
+    # Cold calls follow a write (which invalidates the caches), warm calls hit them
+    def invalidate():
+        tracker.add_expense(next(amounts), "2024-06-03", "Benchmark Cafe", "Food & Dining")
+    report.add(prefix + "get_expenses_df.cold", timed(tracker.get_expenses_df, repeat=heavy, setup=invalidate))
+    report.add(prefix + "get_expenses_df.warm", timed(tracker.get_expenses_df, repeat=20))
+    report.add(prefix + "get_recent_expenses", timed(lambda: tracker.get_recent_expenses(10), repeat=50))
+    report.add(prefix + "query_page", timed(
+        lambda: tracker.query_page("2023-01-01", "2023-12-31", sort_by="amount", limit=50), repeat=20))
+
+    report.add(prefix + "get_total_spending", timed(tracker.get_total_spending, repeat=50))
+    report.add(prefix + "get_total_by_category", timed(tracker.get_total_by_category, repeat=50))
+    report.add(prefix + "get_total_by_month", timed(tracker.get_total_by_month, repeat=50))
+    report.add(prefix + "get_total_by_vendor", timed(tracker.get_total_by_vendor, repeat=50))
+    report.add(prefix + "get_rollup.cold", timed(tracker.get_rollup, repeat=heavy, setup=invalidate))
+    cube = tracker.get_rollup()
+    report.add(prefix + "rollup_slice.summary", timed(
+        lambda: cube.slice("2023-01-01", "2023-12-31").summary(), repeat=20))
+    tracker.save_expenses()
+
+
+# ---------------- BASELINE COMPARISON ----------------
+# Compare medians with the baseline; returns the names that got slower than the tolerance
+# allows (and by more than the noise floor)
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    regressions = []
+    print(f"\nComparison with baseline (tolerance {tolerance:.0%}):")
+    for name, timing in results.items():
+        base = baseline.get(name)
+        if not base or not base.get("median_ms"):
+            print(f"  {name:<44} new")
+            continue
+        ratio = timing["median_ms"] / base["median_ms"]
+        timing["baseline_ms"] = base["median_ms"]
+        timing["ratio"] = ratio
+        flag = ""
+        if ratio > 1 + tolerance and timing["median_ms"] - base["median_ms"] > NOISE_FLOOR_MS:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        elif ratio < 1 / (1 + tolerance):
+            flag = "  faster"
+        print(f"  {name:<44} {base['median_ms']:11.3f} -> {timing['median_ms']:11.3f} ms  ({ratio:.2f}x){flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the receipt pipeline and the expense ledger")
+    parser.add_argument("--receipts", type=int, default=50, help="number of synthetic receipts")
+    parser.add_argument("--ledger-sizes", type=int, nargs="*", default=DEFAULT_LEDGER_SIZES)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--ocr", action="store_true", help="run EasyOCR and the classifier model (loads models)")
+    parser.add_argument("--journal", action="store_true", help="use the journaled CSV backend")
+    parser.add_argument("--save-receipts", metavar="DIR", help="also write the synthetic receipt images here")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline JSON to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed slowdown against the baseline (0.25 = 25%%)")
+    args = parser.parse_args()
+
+    report = Report()
+    if args.receipts:
+        bench_receipts(report, args.receipts, args.seed, args.ocr, args.save_receipts)
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in args.ledger_sizes:
+            bench_ledger(report, size, args.seed, workdir, args.journal)
+
+    output = {
+        "meta": {
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "pandas": pd.__version__,
+            "numpy": np.__version__,
+            "args": vars(args),
+        },
+        "results": report.results,
+    }
+
+    regressions = []
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            regressions = compare(report.results, json.load(f)["results"], args.tolerance)
+        output["regressions"] = regressions
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(output, f, indent=2)
+        print(f"\nResults written to {args.output}")
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(output, f, indent=2)
+        print(f"\nBaseline saved to {args.baseline}")
+
+    if regressions:
+        print(f"\n{len(regressions)} regression(s): " + ", ".join(regressions))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
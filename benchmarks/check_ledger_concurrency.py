@@ -0,0 +1,94 @@
+# Concurrency check: several processes add expenses to one ledger at the same time, then the
+# ledger is reloaded and every added row must be there exactly once.
+#
+#   python benchmarks/check_ledger_concurrency.py                          # journal, csv and sqlite
+#   python benchmarks/check_ledger_concurrency.py --backend journal --processes 4 --adds 400
+#
+# The journaled CSV backend runs with a small compact_bytes, so background compactions in
+# every process overlap with appends from the others; --backend arrow (needs pyarrow) uses it
+# as the delta size, so month merges do the same. Exits with status 1 when rows are lost or
+# duplicated.
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from expense_tracker import ExpenseTracker
+from storage import ArrowStorage, JournalCSVStorage, open_storage
+
+BACKEND_FILES = {"journal": "expenses.csv", "csv": "expenses.csv", "sqlite": "expenses.db", "arrow": "expenses.arrow"}
+
+
+def open_tracker(path: str, backend: str, compact_bytes: int) -> ExpenseTracker:
+    if backend == "journal":
+        return ExpenseTracker(path, storage=JournalCSVStorage(path, compact_bytes=compact_bytes))
+    if backend == "arrow":
+        return ExpenseTracker(path, storage=ArrowStorage(path, delta_bytes=compact_bytes))
+    return ExpenseTracker(path, storage=open_storage(path))
+
+
+# One writer process: `adds` expenses with vendor "writer-<n>" and amounts 1.00, 2.00, ...
+def writer(path: str, backend: str, number: int, adds: int, compact_bytes: int, failures):
+    tracker = open_tracker(path, backend, compact_bytes)
+    for i in range(adds):
+        ok = tracker.add_expense(i + 1, "2024-06-01", f"writer-{number}", "Other")
+        if ok and not tracker.storage.incremental:
+            ok = tracker.save_expenses()
+        if not ok:
+            failures.put((number, i))
+    tracker.storage.close()     # waits for a running compaction
+
+
+# Returns a list of problems (empty when every row survived exactly once)
+def check(backend: str, processes: int, adds: int, compact_bytes: int) -> list:
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, BACKEND_FILES[backend])
+        open_tracker(path, backend, compact_bytes).storage.close()   # creates the ledger
+        failures = multiprocessing.Queue()
+        workers = [multiprocessing.Process(target=writer, args=(path, backend, n, adds, compact_bytes, failures))
+                   for n in range(processes)]
+        for process in workers:
+            process.start()
+        for process in workers:
+            process.join()
+
+        problems = []
+        if any(process.exitcode for process in workers):
+            problems.append(f"writer exit codes {[process.exitcode for process in workers]}")
+        while not failures.empty():
+            problems.append("add_expense returned False for writer %d, add %d" % failures.get())
+
+        df = open_tracker(path, backend, compact_bytes).get_expenses_df()
+        if df['id'].duplicated().any():
+            problems.append(f"{int(df['id'].duplicated().sum())} duplicate ids")
+        for n in range(processes):
+            amounts = sorted(df.loc[df['vendor'] == f"writer-{n}", 'amount'].round(2))
+            if amounts != [float(i + 1) for i in range(adds)]:
+                problems.append(f"writer-{n}: {len(amounts)} of {adds} rows in the reloaded ledger")
+        return problems
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Check that concurrent writer processes lose no expenses")
+    parser.add_argument("--backend", choices=sorted(BACKEND_FILES), nargs="*", default=["journal", "csv", "sqlite"])
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--adds", type=int, default=400, help="expenses added by each process")
+    parser.add_argument("--compact-bytes", type=int, default=3000, help="journal size that triggers compaction")
+    args = parser.parse_args()
+
+    failed = False
+    for backend in args.backend:
+        problems = check(backend, args.processes, args.adds, args.compact_bytes)
+        print(f"{backend:<8} {'OK' if not problems else 'FAILED'}  "
+              f"({args.processes} processes x {args.adds} adds)")
+        for problem in problems:
+            print(f"  {problem}")
+        failed = failed or bool(problems)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
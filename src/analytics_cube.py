@@ -0,0 +1,186 @@
+from typing import Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from ledger_columns import ExpenseColumns
+
+
+# Materialized day x category x vendor rollup of the ledger, built once per ledger version
+# (see ExpenseTracker.get_rollup). Each cell holds the count, sum, sum of squares, min and
+# max of the amounts (in cents), and cells are sorted by day, so a period is a binary search
+# plus a slice and every metric or chart is a bincount over the cells in that slice.
+class RollupCube:
+
+    def __init__(self, days, category_codes, vendor_codes, counts, cents, squares, min_cents, max_cents,
+                 categories, vendors):
+        self.days = days                    # int64 days since 1970-01-01, ascending
+        self.category_codes = category_codes
+        self.vendor_codes = vendor_codes
+        self.counts = counts
+        self.cents = cents
+        self.squares = squares              # float64 sum of cents**2 (for the std)
+        self.min_cents = min_cents
+        self.max_cents = max_cents
+        self.categories = list(categories)
+        self.vendors = list(vendors)
+
+
+    @classmethod
+    def from_columns(cls, columns: ExpenseColumns) -> "RollupCube":
+        days = columns.view('days').astype(np.int64)
+        categories = columns.view('category_codes')
+        vendors = columns.view('vendor_codes')
+        cents = columns.view('cents')
+        if not len(days):
+            empty = np.zeros(0, dtype=np.int64)
+            return cls(empty, empty, empty, empty, empty, empty.astype(np.float64), empty, empty,
+                       columns.categories, columns.vendors)
+
+        order = np.lexsort((vendors, categories, days))
+        days, categories, vendors, cents = days[order], categories[order], vendors[order], cents[order]
+        new_cell = np.ones(len(days), dtype=bool)
+        new_cell[1:] = (days[1:] != days[:-1]) | (categories[1:] != categories[:-1]) | (vendors[1:] != vendors[:-1])
+        starts = np.flatnonzero(new_cell)
+        return cls(
+            days[starts], categories[starts].astype(np.int64), vendors[starts].astype(np.int64),
+            np.diff(np.append(starts, len(days))),
+            np.add.reduceat(cents, starts),
+            np.add.reduceat(cents.astype(np.float64) ** 2, starts),
+            np.minimum.reduceat(cents, starts),
+            np.maximum.reduceat(cents, starts),
+            columns.categories, columns.vendors
+        )
+
+
+    def __len__(self) -> int:
+        return len(self.days)
+
+
+    # Bytes held by the cell arrays (the name lists share their strings with the ledger)
+    def nbytes(self) -> int:
+        arrays = (self.days, self.category_codes, self.vendor_codes, self.counts, self.cents, self.squares,
+                  self.min_cents, self.max_cents)
+        return sum(a.nbytes for a in arrays) + 8 * (len(self.categories) + len(self.vendors))
+
+
+    # First and last day with expenses (None when empty)
+    def first_day(self) -> Optional[np.datetime64]:
+        return np.datetime64(int(self.days[0]), 'D') if len(self.days) else None
+
+
+    def last_day(self) -> Optional[np.datetime64]:
+        return np.datetime64(int(self.days[-1]), 'D') if len(self.days) else None
+
+
+    # Cells with start <= day <= end (dates, ISO strings or datetime64; either optional)
+    def slice(self, start=None, end=None) -> "CubeSlice":
+        lo = 0 if start is None else int(np.searchsorted(self.days, _day(start), side='left'))
+        hi = len(self.days) if end is None else int(np.searchsorted(self.days, _day(end), side='right'))
+        return CubeSlice(self, lo, max(lo, hi))
+
+
+# A period of the cube; every method aggregates only the cells inside it. Amounts are dollars.
+class CubeSlice:
+
+    def __init__(self, cube: RollupCube, lo: int, hi: int):
+        self.cube = cube
+        self.lo, self.hi = lo, hi
+
+
+    @property
+    def empty(self) -> bool:
+        return self.hi <= self.lo
+
+
+    def count(self) -> int:
+        return int(self._column('counts').sum())
+
+
+    def total(self) -> float:
+        return int(self._column('cents').sum()) / 100
+
+
+    # Spending per category / vendor, largest first, categories/vendors without spending dropped
+    def by_category(self) -> pd.Series:
+        return self._group('category_codes', self.cube.categories, 'cents') / 100
+
+
+    def by_vendor(self, top: Optional[int] = None) -> pd.Series:
+        totals = self._group('vendor_codes', self.cube.vendors, 'cents') / 100
+        return totals.head(top) if top else totals
+
+
+    # Number of expenses per category, most frequent first
+    def category_counts(self) -> pd.Series:
+        return self._group('category_codes', self.cube.categories, 'counts')
+
+
+    # Number of expenses per vendor, most frequent first
+    def vendor_counts(self, top: Optional[int] = None) -> pd.Series:
+        counts = self._group('vendor_codes', self.cube.vendors, 'counts')
+        return counts.head(top) if top else counts
+
+
+    # Spending per day with expenses (DatetimeIndex, ascending)
+    def by_day(self) -> pd.Series:
+        days = self._column('days')
+        starts = np.flatnonzero(np.r_[True, days[1:] != days[:-1]]) if len(days) else np.zeros(0, dtype=np.int64)
+        cents = np.add.reduceat(self._column('cents'), starts) if len(days) else np.zeros(0, dtype=np.int64)
+        index = pd.DatetimeIndex(days[starts].astype('datetime64[D]'), name='date')
+        return pd.Series(cents / 100, index=index, name='amount')
+
+
+    # Spending per calendar month ("YYYY-MM"), ascending
+    def by_month(self) -> pd.Series:
+        months = self._column('days').astype('datetime64[D]').astype('datetime64[M]')
+        unique_months, codes = np.unique(months, return_inverse=True)
+        cents = np.bincount(codes, weights=self._column('cents'), minlength=len(unique_months))
+        return pd.Series(cents / 100, index=pd.Index(unique_months.astype(str), name='month'), name='amount')
+
+
+    # Largest single expense in the period: (amount, vendor), or None when empty
+    def largest(self) -> Optional[Tuple[float, str]]:
+        if self.empty:
+            return None
+        cell = int(np.argmax(self._column('max_cents')))
+        return int(self._column('max_cents')[cell]) / 100, self.cube.vendors[self._column('vendor_codes')[cell]]
+
+
+    # count / mean / std / min / max of the individual amounts
+    def summary(self) -> pd.Series:
+        n = self.count()
+        if not n:
+            return pd.Series({'count': 0}, name='amount', dtype=float)
+        total = float(self._column('cents').sum())
+        squares = float(self._column('squares').sum())
+        mean = total / n
+        variance = (squares - n * mean * mean) / (n - 1) if n > 1 else float('nan')
+        return pd.Series({
+            'count': n,
+            'mean': mean / 100,
+            'std': np.sqrt(max(variance, 0.0)) / 100 if n > 1 else float('nan'),
+            'min': int(self._column('min_cents').min()) / 100,
+            'max': int(self._column('max_cents').max()) / 100,
+            'total': total / 100,
+        }, name='amount')
+
+
+    # ---------------- INTERNAL HELPERS ----------------
+    def _column(self, name: str) -> np.ndarray:
+        return getattr(self.cube, name)[self.lo:self.hi]
+
+
+    def _group(self, code_name: str, names, value_name: str) -> pd.Series:
+        codes = self._column(code_name)
+        sums = np.bincount(codes, weights=self._column(value_name), minlength=len(names))
+        present = np.bincount(codes, minlength=len(names)) > 0
+        values = sums[present]
+        if value_name == 'counts':
+            values = values.astype(np.int64)
+        series = pd.Series(values, index=pd.Index(np.asarray(names, dtype=object)[present]))
+        return series.sort_values(ascending=False, kind='stable')
+
+
+def _day(value) -> int:
+    return int(np.datetime64(value, 'D').astype(np.int64))
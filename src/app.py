@@ -4,13 +4,23 @@ import matplotlib.pyplot as plt
 import plotly.express as px
 import plotly.graph_objects as go
 from datetime import datetime, date, timedelta
-from PIL import Image
-import tempfile
+import uuid
 import os
+import logging
 
 # Import our custom modules
 from expense_tracker import ExpenseTracker, DEFAULT_CATEGORIES
 from reciept_ocr import ReceiptOCR
+from ocr_cache import OCRCache
+from receipt_dedup import DuplicateImageIndex
+from image_preprocessing import ImagePreprocessor
+from job_queue import ReceiptJobQueue
+from statement_import import read_statement
+from ledger_pool import LedgerPool, DEFAULT_USER
+from downsampling import rollup_for_budget, CHART_POINT_BUDGET
+from expense_export import export_expenses
+from metrics import get_metrics, configure_from_env, Counter, Histogram
+from model_registry import get_registry
 
 # Page configuration
 st.set_page_config(
@@ -20,12 +30,66 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-# Initialize session state
-if 'tracker' not in st.session_state:
-    st.session_state.tracker = ExpenseTracker()
+# Ledger location: a .db file selects the SQLite backend (migrate with `python storage.py expenses.csv expenses.db`)
+DATA_FILE = os.environ.get("EXPENSES_FILE", "expenses.csv")
+# EXPENSES_JOURNAL=1 keeps the CSV ledger but appends each new expense to a crash-safe journal
+JOURNAL_MODE = os.environ.get("EXPENSES_JOURNAL", "0") == "1"
+
+# Log level from EXPENSES_LOG_LEVEL (default INFO)
+logging.basicConfig(level=os.environ.get("EXPENSES_LOG_LEVEL", "INFO").upper(),
+                    format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+# Metrics are off unless EXPENSES_METRICS=1 (or a metrics port/file is set, see metrics.py);
+# configured once per server process so the exporter thread starts only once
+@st.cache_resource
+def setup_metrics() -> bool:
+    return configure_from_env()
+
+setup_metrics()
+
+# Per-user ledgers (ledgers/<user>.csv), shared by all sessions of the same user: a session
+# sees the others' expenses immediately and writes are serialized by the tracker's locks.
+# The default user keeps DATA_FILE. Ledgers are loaded on first use and dropped from memory
+# when idle or when the pool exceeds its memory budget.
+LEDGER_DIR = os.environ.get("EXPENSES_LEDGER_DIR", "ledgers")
+
+@st.cache_resource
+def get_ledger_pool() -> LedgerPool:
+    return LedgerPool(LEDGER_DIR, journal=JOURNAL_MODE, default_file=DATA_FILE)
+
+# The session's ledger. Only the user id lives in session state: the pool may evict the
+# tracker between reruns, and a session holding on to it would keep it in memory.
+def current_tracker() -> ExpenseTracker:
+    return get_ledger_pool().get(st.session_state.get('user_id', DEFAULT_USER))
+
+# One ReceiptOCR per server process: all sessions share its models and result cache
+@st.cache_resource
+def get_receipt_ocr() -> ReceiptOCR:
+    # Results are cached on disk by image content, so re-uploads and new sessions skip OCR
+    # Uploads are downscaled/cleaned in memory before OCR, which cuts EasyOCR time
+    # Another photo of an already processed receipt reuses its extraction (perceptual hash)
+    return ReceiptOCR(cache=OCRCache(), preprocessor=ImagePreprocessor(),
+                      dedup=DuplicateImageIndex(os.path.join(".ocr_cache", "image_hashes.jsonl")))
+
+# Adapt the shared category model (embedding mode) to the categories the session's ledger
+# files its vendors under; repeated only after the ledger changed, e.g. an expense was saved
+def refine_receipt_categories():
+    tracker = current_tracker()
+    refined = (tracker.data_file, tracker.version)
+    if st.session_state.get('refined_categories') != refined:
+        get_receipt_ocr().refine_categories(tracker)
+        st.session_state.refined_categories = refined
+
+# Background OCR workers shared by all sessions (see upload_receipt_page)
+@st.cache_resource
+def get_job_queue() -> ReceiptJobQueue:
+    return ReceiptJobQueue(get_receipt_ocr())
 
 if 'ocr' not in st.session_state:
-    st.session_state.ocr = ReceiptOCR()
+    st.session_state.ocr = get_receipt_ocr()
+
+if 'session_id' not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
 
 # Custom CSS
 st.markdown("""
@@ -75,6 +139,7 @@ def main():
         "📊 Dashboard": "Dashboard",
         "➕ Add Expense": "Add Expense", 
         "📷 Upload Receipt": "Upload Receipt",
+        "🏦 Import Statement": "Import Statement",
         "📋 View Expenses": "View Expenses",
         "📈 Analytics": "Analytics"
     }
@@ -90,11 +155,23 @@ def main():
     # Get the actual page name
     page = nav_options[selected_option]
     
+    # Ledger selection (identifies whose ledger to show; not an authentication mechanism)
+    st.sidebar.markdown("---")
+    user_id = st.sidebar.text_input("👤 Ledger", value=st.session_state.get('user_id', DEFAULT_USER))
+    st.session_state.user_id = user_id.strip() or DEFAULT_USER
+    # Pick up expenses written by other server processes since the last rerun
+    current_tracker().refresh()
+    
     # Add some space and info
     st.sidebar.markdown("---")
     st.sidebar.markdown("### 💡 Quick Tips")
     st.sidebar.info("💰 Track expenses manually or upload receipt photos for automatic processing!")
     
+    # Hidden diagnostics page: open the app with ?diagnostics=1
+    if st.query_params.get("diagnostics") == "1":
+        diagnostics_page()
+        return
+    
     # Page routing
     if page == "Dashboard":
         dashboard_page()
@@ -102,6 +179,8 @@ def main():
         add_expense_page()
     elif page == "Upload Receipt":
         upload_receipt_page()
+    elif page == "Import Statement":
+        import_statement_page()
     elif page == "View Expenses":
         view_expenses_page()
     elif page == "Analytics":
@@ -112,11 +191,9 @@ def dashboard_page():
     
     st.header("📊 Dashboard Overview")
     
-    # Load current expenses
-    tracker = st.session_state.tracker
-    df = tracker.get_expenses_df()
-    
-    if df.empty:
+    # Load current expenses (the metrics below come from the tracker's running aggregates)
+    tracker = current_tracker()
+    if tracker.count() == 0:
         st.info("No expenses found. Start by adding an expense or uploading a receipt!")
         return
     
@@ -128,7 +205,7 @@ def dashboard_page():
         st.metric("Total Spending", f"${total_spending:.2f}")
     
     with col2:
-        num_expenses = len(tracker.expenses)
+        num_expenses = tracker.count()
         st.metric("Total Expenses", num_expenses)
     
     with col3:
@@ -157,14 +234,15 @@ def dashboard_page():
     
     with col2:
         st.subheader("Recent Expenses Trend")
-        if len(df) > 1:
-            df_sorted = df.sort_values('date')
+        # Day, week or month totals, whichever fits the chart's point budget
+        spending, resolution = rollup_for_budget(tracker.get_rollup().slice().by_day(), CHART_POINT_BUDGET)
+        if len(spending) > 1:
             fig = px.line(
-                df_sorted,
-                x='date',
-                y='amount',
+                x=spending.index,
+                y=spending.values,
                 title="Spending Over Time",
-                markers=True
+                labels={'x': 'date', 'y': f'{resolution.lower()} amount'},
+                markers=len(spending) <= 60
             )
             st.plotly_chart(fig, use_container_width=True)
         else:
@@ -185,6 +263,7 @@ def add_expense_page():
     """Manual expense entry page."""
     
     st.header("➕ Add New Expense")
+    show_duplicate_warning()
     
     with st.form("add_expense_form"):
         col1, col2 = st.columns(2)
@@ -201,7 +280,9 @@ def add_expense_page():
         
         if submitted:
             if amount > 0 and vendor.strip():
-                success = st.session_state.tracker.add_expense(
+                remember_duplicates(amount, expense_date.strftime('%Y-%m-%d'), vendor.strip())
+                tracker = current_tracker()
+                success = tracker.add_expense(
                     amount=amount,
                     date_str=expense_date.strftime('%Y-%m-%d'),
                     vendor=vendor.strip(),
@@ -209,7 +290,7 @@ def add_expense_page():
                 )
                 
                 if success:
-                    st.session_state.tracker.save_expenses_csv()
+                    tracker.save_expenses()
                     st.success(f"✅ Expense of ${amount:.2f} at {vendor} added successfully!")
                     # Show a balloons animation for successful addition
                     st.balloons()
@@ -222,196 +303,268 @@ def add_expense_page():
             else:
                 st.error("❌ Please enter a valid amount and vendor name.")
 
+# Remember a warning for the next rerun when the ledger already holds an expense with the
+# same vendor, date and amount (checked before adding, shown after the page reloads)
+def remember_duplicates(amount: float, date_str: str, vendor: str):
+    count = current_tracker().count_duplicates(amount, date_str, vendor)
+    if count:
+        st.session_state.duplicate_warning = (
+            f"⚠️ Possible double entry: {vendor} on {date_str} for ${amount:.2f} was already recorded"
+            + (f" {count} times." if count > 1 else ".")
+        )
+
+def show_duplicate_warning():
+    message = st.session_state.pop('duplicate_warning', None)
+    if message:
+        st.warning(message)
+
 def upload_receipt_page():
-    """Receipt upload and OCR processing page."""
+    """Receipt upload page: receipts are processed in the background while the page stays usable."""
     
     st.header("📷 Upload Receipt")
     
-    # Initialize session state for OCR processing
-    if 'ocr_processed' not in st.session_state:
-        st.session_state.ocr_processed = False
-    if 'ocr_result' not in st.session_state:
-        st.session_state.ocr_result = None
-    if 'current_file_name' not in st.session_state:
-        st.session_state.current_file_name = None
-    if 'show_form' not in st.session_state:
-        st.session_state.show_form = False
-    if 'expense_saved' not in st.session_state:
-        st.session_state.expense_saved = False
-    
-    uploaded_file = st.file_uploader(
-        "Choose a receipt image",
+    job_queue = get_job_queue()
+    session_id = st.session_state.session_id
+    refine_receipt_categories()
+    
+    # Uploads already turned into jobs in this session (so reruns don't resubmit them)
+    if 'submitted_uploads' not in st.session_state:
+        st.session_state.submitted_uploads = set()
+    if 'last_saved_message' not in st.session_state:
+        st.session_state.last_saved_message = None
+    
+    uploaded_files = st.file_uploader(
+        "Choose receipt images",
         type=['png', 'jpg', 'jpeg', 'bmp', 'tiff'],
-        help="Upload a clear image of your receipt for automatic processing"
+        accept_multiple_files=True,
+        help="Upload clear images of your receipts; several can be processed at once"
+    )
+    
+    for uploaded_file in uploaded_files or []:
+        upload_key = (uploaded_file.name, uploaded_file.size)
+        if upload_key in st.session_state.submitted_uploads:
+            continue
+        try:
+            # The upload bytes go straight to OCR; no temp file round trip
+            job_queue.submit(session_id, uploaded_file.name, uploaded_file.getvalue())
+            st.session_state.submitted_uploads.add(upload_key)
+        except RuntimeError as e:
+            st.warning(f"⏳ {e}")
+            break
+    
+    show_duplicate_warning()
+    if st.session_state.last_saved_message:
+        st.success(st.session_state.last_saved_message)
+        st.session_state.last_saved_message = None
+    
+    jobs = job_queue.jobs_for(session_id)
+    if not jobs:
+        st.info("Upload one or more receipts to extract their details automatically.")
+        return
+    
+    # Status overview
+    status_icons = {"queued": "⏳ Queued", "running": "⚙️ Processing", "done": "✅ Ready", "failed": "❌ Failed"}
+    st.subheader("Processing Status")
+    st.dataframe(
+        pd.DataFrame([
+            {"Receipt": job.name, "Status": status_icons[job.status], "Time (s)": round(job.elapsed(), 1)}
+            for job in jobs
+        ]),
+        use_container_width=True,
+        hide_index=True
     )
     
-    if uploaded_file is not None:
-        # Check if this is a new file
-        if st.session_state.current_file_name != uploaded_file.name:
-            st.session_state.ocr_processed = False
-            st.session_state.ocr_result = None
-            st.session_state.current_file_name = uploaded_file.name
-            st.session_state.show_form = False
-            st.session_state.expense_saved = False
-        # Display uploaded image
-        col1, col2 = st.columns([1, 2])
+    # Receipts ready for confirmation, one form each
+    for job in jobs:
+        if job.status == "done":
+            with st.expander(f"📄 {job.name}", expanded=True):
+                receipt_confirm_form(job, job_queue)
+        elif job.status == "failed":
+            with st.expander(f"❌ {job.name}", expanded=True):
+                st.error(f"Failed to process receipt: {job.error}. Please try again with a clearer image.")
+                col1, col2 = st.columns(2)
+                with col1:
+                    if st.button("🔄 Retry", key=f"retry_{job.id}"):
+                        job_queue.retry(job.id)
+                        st.rerun()
+                with col2:
+                    if st.button("🗑️ Dismiss", key=f"dismiss_{job.id}"):
+                        job_queue.discard(job.id)
+                        st.rerun()
+    
+    # Poll while receipts are still in flight
+    if any(job.status in ("queued", "running") for job in jobs):
+        st.caption("Receipts are processed in the background - you can keep using the app.")
+        import time
+        time.sleep(1)
+        st.rerun()
+
+def receipt_confirm_form(job, job_queue):
+    """Editable form for the data extracted from one processed receipt."""
+    
+    col1, col2 = st.columns([1, 2])
+    
+    with col1:
+        st.image(job.image_bytes, caption="Receipt Image", use_container_width=True)
+    
+    with col2:
+        # Get the first (and only) row of results
+        row = job.result.iloc[0]
         
-        with col1:
-            st.subheader("Uploaded Receipt")
-            image = Image.open(uploaded_file)
-            st.image(image, caption="Receipt Image", use_container_width=True)
+        # Display extracted data in an editable form
+        with st.form(f"confirm_receipt_data_{job.id}"):
+            st.subheader("Confirm Extracted Data")
             
-            # Add button to reprocess if needed
-            if st.session_state.ocr_processed:
-                if st.button("🔄 Process New Receipt", help="Click to reprocess this receipt"):
-                    st.session_state.ocr_processed = False
-                    st.session_state.ocr_result = None
-                    st.session_state.show_form = False
-                    st.session_state.expense_saved = False
-                    st.rerun()
-        
-        with col2:
-            st.subheader("Processing Results")
+            if row.get('Duplicate'):
+                st.warning(f"⚠️ This looks like a receipt you already scanned ({row.get('DuplicateOf')}). "
+                           "The fields below were copied from it - check the date and total, or discard.")
             
-            # Save uploaded file temporarily
-            with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(uploaded_file.name)[1]) as tmp_file:
-                tmp_file.write(uploaded_file.getvalue())
-                tmp_file_path = tmp_file.name
+            col1, col2 = st.columns(2)
             
-            try:
-                # Only process OCR if not already processed and expense wasn't just saved
-                if not st.session_state.ocr_processed and not st.session_state.expense_saved:
-                    with st.spinner("Processing receipt with OCR..."):
-                        result_df = st.session_state.ocr.process_receipt(tmp_file_path)
-                        st.session_state.ocr_result = result_df
-                        st.session_state.ocr_processed = True
-                        st.session_state.show_form = True
-                        st.rerun()  # Force rerun to show form
-                
-                # Show success message and reset button if expense was saved
-                if st.session_state.expense_saved:
-                    st.success("✅ Expense saved successfully!")
-                    if st.button("📷 Upload Another Receipt", type="primary"):
-                        # Reset all states for next receipt
-                        st.session_state.ocr_processed = False
-                        st.session_state.ocr_result = None
-                        st.session_state.current_file_name = None
-                        st.session_state.show_form = False
-                        st.session_state.expense_saved = False
-                        st.rerun()
+            with col1:
+                # Handle amount parsing
+                try:
+                    amount_value = float(row['Total']) if row['Total'] != 'Unknown' else 0.01
+                    # Ensure amount is at least the minimum value
+                    if amount_value < 0.01:
+                        amount_value = 0.01
+                except:
+                    amount_value = 0.01
                 
-                # Only show the form if we should show it and have results and expense wasn't saved
-                elif st.session_state.show_form and st.session_state.ocr_result is not None and not st.session_state.ocr_result.empty:
-                    result_df = st.session_state.ocr_result
-                    st.success("✅ Receipt processed successfully!")
-                    
-                    # Get the first (and only) row of results
-                    row = result_df.iloc[0]
-                    
-                    # Display extracted data in an editable form
-                    with st.form("confirm_receipt_data"):
-                        st.subheader("Confirm Extracted Data")
-                        
-                        col1, col2 = st.columns(2)
-                        
-                        with col1:
-                            # Handle amount parsing
-                            try:
-                                amount_value = float(row['Total']) if row['Total'] != 'Unknown' else 0.01
-                                # Ensure amount is at least the minimum value
-                                if amount_value < 0.01:
-                                    amount_value = 0.01
-                            except:
-                                amount_value = 0.01
-                            
-                            amount = st.number_input(
-                                "Amount ($)",
-                                value=amount_value,
-                                min_value=0.01,
-                                step=0.01,
-                                format="%.2f"
-                            )
-                            
-                            # Show info if amount wasn't detected
-                            if row['Total'] == 'Unknown':
-                                st.info("💡 Amount not detected - please enter manually")
-                            
-                            vendor = st.text_input("Vendor", value=row['Place'] if row['Place'] != 'Unknown' else "")
-                        
-                        with col2:
-                            # Handle date parsing
-                            try:
-                                if row['Date'] != 'Unknown':
-                                    default_date = datetime.strptime(row['Date'], '%Y-%m-%d').date()
-                                else:
-                                    default_date = date.today()
-                            except:
-                                default_date = date.today()
-                            
-                            expense_date = st.date_input("Date", value=default_date)
-                            
-                            # Handle category
-                            category_value = row['Category'] if row['Category'] in DEFAULT_CATEGORIES else DEFAULT_CATEGORIES[0]
-                            category = st.selectbox(
-                                "Category",
-                                DEFAULT_CATEGORIES,
-                                index=DEFAULT_CATEGORIES.index(category_value)
-                            )
-                        
-                        # Show extracted data for reference
-                        with st.expander("View Extracted Data"):
-                            st.write("**Extracted information:**")
-                            st.write(f"Date: {row['Date']}")
-                            st.write(f"Place: {row['Place']}")
-                            st.write(f"Total: {row['Total']}")
-                            st.write(f"Category: {row['Category']}")
-                        
-                        submitted = st.form_submit_button("Save Expense", type="primary")
-                        
-                        if submitted:
-                            if amount > 0 and vendor.strip():
-                                success = st.session_state.tracker.add_expense(
-                                    amount=amount,
-                                    date_str=expense_date.strftime('%Y-%m-%d'),
-                                    vendor=vendor.strip(),
-                                    category=category
-                                )
-                                
-                                if success:
-                                    st.session_state.tracker.save_expenses_csv()
-                                    st.success(f"✅ Expense saved successfully!")
-                                    st.balloons()
-                                    # Set flag to indicate expense was saved
-                                    st.session_state.expense_saved = True
-                                    st.session_state.show_form = False
-                                    # Don't rerun immediately to avoid OCR loop
-                                else:
-                                    st.error("❌ Failed to save expense.")
-                            else:
-                                st.error("❌ Please enter valid amount and vendor.")
+                amount = st.number_input(
+                    "Amount ($)",
+                    value=amount_value,
+                    min_value=0.01,
+                    step=0.01,
+                    format="%.2f"
+                )
                 
-                else:
-                    st.error("❌ Failed to process receipt. Please try again with a clearer image.")
+                # Show info if amount wasn't detected
+                if row['Total'] == 'Unknown':
+                    st.info("💡 Amount not detected - please enter manually")
                 
-            except Exception as e:
-                st.error(f"❌ Error processing receipt: {str(e)}")
+                vendor = st.text_input("Vendor", value=row['Place'] if row['Place'] != 'Unknown' else "")
             
-            finally:
-                # Clean up temporary file
+            with col2:
+                # Handle date parsing
                 try:
-                    os.unlink(tmp_file_path)
+                    if row['Date'] != 'Unknown':
+                        default_date = datetime.strptime(row['Date'], '%Y-%m-%d').date()
+                    else:
+                        default_date = date.today()
                 except:
-                    pass
+                    default_date = date.today()
+                
+                expense_date = st.date_input("Date", value=default_date)
+                
+                # Handle category
+                category_value = row['Category'] if row['Category'] in DEFAULT_CATEGORIES else DEFAULT_CATEGORIES[0]
+                category = st.selectbox(
+                    "Category",
+                    DEFAULT_CATEGORIES,
+                    index=DEFAULT_CATEGORIES.index(category_value)
+                )
+            
+            # Show extracted data for reference
+            with st.expander("View Extracted Data"):
+                st.write("**Extracted information:**")
+                st.write(f"Date: {row['Date']}")
+                st.write(f"Place: {row['Place']}")
+                st.write(f"Total: {row['Total']}")
+                st.write(f"Category: {row['Category']} ({row['Tier']} tier, confidence {row['Confidence']:.2f})")
+            
+            col1, col2 = st.columns(2)
+            with col1:
+                submitted = st.form_submit_button("Save Expense", type="primary")
+            with col2:
+                dismissed = st.form_submit_button("Discard Receipt")
+            
+            if submitted:
+                if amount > 0 and vendor.strip():
+                    remember_duplicates(amount, expense_date.strftime('%Y-%m-%d'), vendor.strip())
+                    tracker = current_tracker()
+                    success = tracker.add_expense(
+                        amount=amount,
+                        date_str=expense_date.strftime('%Y-%m-%d'),
+                        vendor=vendor.strip(),
+                        category=category
+                    )
+                    
+                    if success:
+                        tracker.save_expenses()
+                        st.balloons()
+                        # Result is no longer needed once the expense is saved
+                        job_queue.discard(job.id)
+                        st.session_state.last_saved_message = f"✅ Expense of ${amount:.2f} at {vendor.strip()} saved successfully!"
+                        st.rerun()
+                    else:
+                        st.error("❌ Failed to save expense.")
+                else:
+                    st.error("❌ Please enter valid amount and vendor.")
+            elif dismissed:
+                job_queue.discard(job.id)
+                st.rerun()
+
+def import_statement_page():
+    """Bulk import of a bank or card statement (CSV or OFX/QFX export)."""
+    
+    st.header("🏦 Import Statement")
+    st.write("Upload a CSV or OFX/QFX export from your bank or card provider. "
+             "Rows without a category are categorized from the merchant name.")
+    
+    statement_file = st.file_uploader("Choose a statement file", type=['csv', 'ofx', 'qfx'])
+    if statement_file is None:
+        return
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        dayfirst = st.checkbox("Dates are day first (31/12/2024)", value=False,
+                               help="Only needed when no day in the file is above 12; "
+                                    "otherwise the order is detected from the file")
+    with col2:
+        expenses_only = st.checkbox("Skip incoming payments", value=True)
+    
+    try:
+        statement = read_statement(statement_file.getvalue(), statement_file.name,
+                                   dayfirst=dayfirst, expenses_only=expenses_only)
+    except Exception as e:
+        st.error(f"❌ Could not read the statement: {e}")
+        return
+    
+    if statement.empty:
+        st.warning("No transactions found in this file.")
+        return
+    
+    st.subheader(f"Preview ({len(statement)} transactions)")
+    st.dataframe(statement.head(100), use_container_width=True, hide_index=True)
+    
+    # Transactions already in the ledger (same vendor, date and amount), e.g. a re-imported statement
+    tracker = current_tracker()
+    repeated = int(tracker.find_duplicates(statement).sum())
+    if repeated:
+        st.warning(f"⚠️ {repeated} of these transactions match existing expenses (same vendor, date and amount) "
+                   "and may have been imported before.")
+    
+    if st.button("Import Transactions", type="primary"):
+        tracker = current_tracker()
+        with st.spinner("Importing..."):
+            added, rejected = tracker.add_expenses_bulk(statement)
+            if added:
+                tracker.save_expenses()
+        if added:
+            st.success(f"✅ Imported {added} expenses.")
+        if not rejected.empty:
+            st.warning(f"⚠️ {len(rejected)} rows were skipped.")
+            st.dataframe(rejected, use_container_width=True, hide_index=True)
 
 def view_expenses_page():
     """View and manage existing expenses."""
     
     st.header("📋 View Expenses")
     
-    tracker = st.session_state.tracker
-    df = tracker.get_expenses_df()
+    tracker = current_tracker()
     
-    if df.empty:
+    if tracker.count() == 0:
         st.info("No expenses found. Add some expenses to see them here!")
         return
     
@@ -429,66 +582,90 @@ def view_expenses_page():
         with col3:
             end_date = st.date_input("End Date", value=date.today())
     
-    # Apply filters
-    filtered_df = df.copy()
+    category_filter = None if selected_category == 'All' else selected_category
     
-    if selected_category != 'All':
-        filtered_df = filtered_df[filtered_df['category'] == selected_category]
-    
-    filtered_df = filtered_df[
-        (filtered_df['date'].dt.date >= start_date) &
-        (filtered_df['date'].dt.date <= end_date)
-    ]
+    # Summary metrics come from the rollup cube, the table from one page of the date index,
+    # so the cost of this page does not grow with the size of the ledger
+    period = tracker.get_rollup(start_date, end_date).slice(start_date, end_date)
+    if category_filter is None:
+        filtered_total, filtered_count = period.total(), period.count()
+    else:
+        filtered_total = float(period.by_category().get(category_filter, 0.0))
+        filtered_count = int(period.category_counts().get(category_filter, 0))
     
     # Display summary
-    if not filtered_df.empty:
+    if filtered_count:
         col1, col2, col3 = st.columns(3)
         
         with col1:
-            st.metric("Filtered Total", f"${filtered_df['amount'].sum():.2f}")
+            st.metric("Filtered Total", f"${filtered_total:.2f}")
         
         with col2:
-            st.metric("Number of Expenses", len(filtered_df))
+            st.metric("Number of Expenses", filtered_count)
         
         with col3:
-            st.metric("Average Amount", f"${filtered_df['amount'].mean():.2f}")
+            st.metric("Average Amount", f"${filtered_total / filtered_count:.2f}")
         
         # Display expenses table
         st.subheader("Expenses")
         
-        # Format the dataframe for display
-        display_df = filtered_df.copy()
-        display_df['date'] = display_df['date'].dt.strftime('%Y-%m-%d')
-        display_df['amount'] = display_df['amount'].apply(lambda x: f"${x:.2f}")
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            sort_by = st.selectbox("Sort by", ["date", "amount", "vendor", "category"])
+        with col2:
+            descending = st.selectbox("Order", ["Descending", "Ascending"]) == "Descending"
+        with col3:
+            page_size = st.selectbox("Rows per page", [25, 50, 100, 250], index=1)
+        with col4:
+            page_count = max(1, -(-filtered_count // page_size))
+            page_number = st.number_input("Page", min_value=1, max_value=page_count, value=1, step=1)
         
+        page_df, _ = tracker.query_page(
+            start_date, end_date, category=category_filter, sort_by=sort_by, descending=descending,
+            offset=(int(page_number) - 1) * page_size, limit=page_size
+        )
+        st.caption(f"Page {int(page_number)} of {page_count}")
+        
+        # Formatting is done by the table widget, the data stays numeric/datetime
         st.dataframe(
-            display_df[['date', 'vendor', 'category', 'amount']],
+            page_df[['date', 'vendor', 'category', 'amount']],
             use_container_width=True,
-            hide_index=True
+            hide_index=True,
+            column_config={
+                "date": st.column_config.DateColumn("date", format="YYYY-MM-DD"),
+                "amount": st.column_config.NumberColumn("amount", format="$%.2f"),
+            }
         )
         
-        # Export options
-        col1, col2 = st.columns(2)
+        # Export options: the matching expenses are written chunk by chunk to a spooled temp
+        # file, so exporting a large ledger never builds the whole result as one string
+        col1, col2, col3 = st.columns(3)
         
         with col1:
-            if st.button("Export to CSV"):
-                csv = filtered_df.to_csv(index=False)
-                st.download_button(
-                    "Download CSV",
-                    csv,
-                    "expenses.csv",
-                    "text/csv"
-                )
+            export_format = st.selectbox("Export format", ["CSV", "JSON Lines", "Parquet"])
         
         with col2:
-            if st.button("Export to JSON"):
-                json_str = filtered_df.to_json(orient='records', date_format='iso')
-                st.download_button(
-                    "Download JSON",
-                    json_str,
-                    "expenses.json",
-                    "application/json"
-                )
+            compress = st.checkbox("Compress (gzip)")
+        
+        with col3:
+            if st.button("Prepare export"):
+                fmt = {"CSV": "csv", "JSON Lines": "jsonl", "Parquet": "parquet"}[export_format]
+                progress_bar = st.progress(0.0)
+                try:
+                    export_file, file_name, mime = export_expenses(
+                        tracker, fmt, compress, start_date, end_date, category=category_filter,
+                        progress=lambda done, total: progress_bar.progress(min(1.0, done / max(total, 1)))
+                    )
+                except ImportError as e:
+                    st.error(f"❌ {e}")
+                else:
+                    with export_file:
+                        st.download_button(
+                            f"Download {export_format}",
+                            export_file,
+                            file_name,
+                            mime
+                        )
     else:
         st.info("No expenses match the selected filters.")
 
@@ -497,10 +674,12 @@ def analytics_page():
     
     st.header("📈 Analytics")
     
-    tracker = st.session_state.tracker
-    df = tracker.get_expenses_df()
+    # Every metric and chart below slices the tracker's rollup cube (rebuilt only when the
+    # ledger changes), so switching periods or tabs never rescans the raw expenses; a
+    # month-partitioned ledger only loads the months of the selected period
+    tracker = current_tracker()
     
-    if df.empty:
+    if tracker.count() == 0:
         st.info("No expenses found. Add some expenses to see analytics!")
         return
     
@@ -522,21 +701,28 @@ def analytics_page():
     elif period == "Last 6 months":
         start_date = today - timedelta(days=180)
     else:
-        start_date = df['date'].min().date()
+        start_date = None
     
-    filtered_df = df[df['date'].dt.date >= start_date]
+    cube = tracker.get_rollup(start_date)
+    if start_date is None:
+        # An empty cube has no first day; the empty period is reported below
+        first_day = cube.first_day()
+        start_date = first_day.astype(date) if first_day is not None else today
+    period_cube = cube.slice(start_date)
     
-    if filtered_df.empty:
+    if period_cube.empty:
         st.warning("No expenses in the selected period.")
         return
     
+    category_totals = period_cube.by_category()
+    
     # Key insights
     st.subheader("📊 Key Insights")
     
     col1, col2, col3, col4 = st.columns(4)
     
     with col1:
-        total_spent = filtered_df['amount'].sum()
+        total_spent = period_cube.total()
         st.metric("Total Spent", f"${total_spent:.2f}")
     
     with col2:
@@ -544,15 +730,13 @@ def analytics_page():
         st.metric("Avg Daily Spending", f"${avg_daily:.2f}")
     
     with col3:
-        top_category = filtered_df.groupby('category')['amount'].sum().idxmax()
-        top_category_amount = filtered_df.groupby('category')['amount'].sum().max()
-        st.metric("Top Category", top_category)
-        st.caption(f"${top_category_amount:.2f}")
+        st.metric("Top Category", category_totals.index[0])
+        st.caption(f"${category_totals.iloc[0]:.2f}")
     
     with col4:
-        most_expensive = filtered_df.loc[filtered_df['amount'].idxmax()]
-        st.metric("Largest Expense", f"${most_expensive['amount']:.2f}")
-        st.caption(most_expensive['vendor'])
+        largest_amount, largest_vendor = period_cube.largest()
+        st.metric("Largest Expense", f"${largest_amount:.2f}")
+        st.caption(largest_vendor)
     
     st.divider()
     
@@ -564,7 +748,6 @@ def analytics_page():
         
         with col1:
             # Category pie chart
-            category_totals = filtered_df.groupby('category')['amount'].sum()
             fig_pie = px.pie(
                 values=category_totals.values,
                 names=category_totals.index,
@@ -584,34 +767,32 @@ def analytics_page():
             st.plotly_chart(fig_bar, use_container_width=True)
     
     with tab2:
-        # Daily spending trend
-        daily_spending = filtered_df.groupby(filtered_df['date'].dt.date)['amount'].sum().reset_index()
-        daily_spending.columns = ['date', 'amount']
+        # Spending trend at the finest resolution (day/week/month) that fits the point budget
+        trend, resolution = rollup_for_budget(period_cube.by_day(), CHART_POINT_BUDGET)
         
         fig_trend = px.line(
-            daily_spending,
+            trend.reset_index(),
             x='date',
             y='amount',
-            title="Daily Spending Trend",
-            markers=True
+            title=f"{resolution} Spending Trend",
+            markers=len(trend) <= 60
         )
         st.plotly_chart(fig_trend, use_container_width=True)
         
         # Monthly comparison
-        if len(filtered_df) > 0:
-            monthly_spending = filtered_df.groupby(filtered_df['date'].dt.to_period('M'))['amount'].sum()
-            if len(monthly_spending) > 1:
-                fig_monthly = px.bar(
-                    x=monthly_spending.index.astype(str),
-                    y=monthly_spending.values,
-                    title="Monthly Spending Comparison",
-                    labels={'x': 'Month', 'y': 'Amount ($)'}
-                )
-                st.plotly_chart(fig_monthly, use_container_width=True)
+        monthly_spending = period_cube.by_month()
+        if len(monthly_spending) > 1:
+            fig_monthly = px.bar(
+                x=monthly_spending.index,
+                y=monthly_spending.values,
+                title="Monthly Spending Comparison",
+                labels={'x': 'Month', 'y': 'Amount ($)'}
+            )
+            st.plotly_chart(fig_monthly, use_container_width=True)
     
     with tab3:
         # Top vendors
-        vendor_totals = filtered_df.groupby('vendor')['amount'].sum().sort_values(ascending=False).head(10)
+        vendor_totals = period_cube.by_vendor(top=10)
         
         if len(vendor_totals) > 0:
             fig_vendors = px.bar(
@@ -624,18 +805,66 @@ def analytics_page():
             st.plotly_chart(fig_vendors, use_container_width=True)
         
         # Vendor frequency
-        vendor_frequency = filtered_df['vendor'].value_counts().head(10)
+        vendor_frequency = period_cube.vendor_counts(top=10)
         
         col1, col2 = st.columns(2)
         
         with col1:
             st.subheader("Most Frequent Vendors")
-            st.dataframe(vendor_frequency.reset_index())
+            st.dataframe(vendor_frequency.rename_axis('vendor').reset_index(name='count'))
         
         with col2:
             st.subheader("Spending Summary")
-            summary_stats = filtered_df['amount'].describe()
-            st.dataframe(summary_stats)
+            st.dataframe(period_cube.summary())
+
+def diagnostics_page():
+    """Operational metrics: stage latencies, counters, caches and loaded ledgers."""
+    
+    st.header("🩺 Diagnostics")
+    
+    metrics = get_metrics()
+    if not metrics.enabled:
+        st.info("Metrics are disabled. Start the app with EXPENSES_METRICS=1 to record them.")
+    
+    # Latency histograms (quantiles are bucket upper bounds)
+    histograms = [m for m in metrics.metrics() if isinstance(m, Histogram)]
+    for histogram in histograms:
+        summary = histogram.summary()
+        if not summary:
+            continue
+        st.subheader(histogram.name)
+        st.caption(histogram.help)
+        rows = [dict(zip(histogram.labels, key), **values) for key, values in summary.items()]
+        st.dataframe(pd.DataFrame(rows), use_container_width=True, hide_index=True)
+    
+    # Counters
+    counter_rows = []
+    for counter in metrics.metrics():
+        if not isinstance(counter, Counter):
+            continue
+        for key, value in counter.values().items():
+            labels = ", ".join(f"{name}={v}" for name, v in zip(counter.labels, key))
+            counter_rows.append({"metric": counter.name, "labels": labels, "value": value})
+    if counter_rows:
+        st.subheader("Counters")
+        st.dataframe(pd.DataFrame(counter_rows), use_container_width=True, hide_index=True)
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        st.subheader("Ledger pool")
+        st.json(get_ledger_pool().stats())
+    with col2:
+        st.subheader("OCR")
+        ocr = get_receipt_ocr()
+        st.json({
+            "loaded_models": get_registry().loaded_models(),
+            "cache": ocr.cache.stats() if ocr.cache is not None else None
+        })
+    
+    with st.expander("Prometheus exposition"):
+        text = metrics.render()
+        st.code(text, language="text")
+        st.download_button("Download metrics", text, "metrics.prom", "text/plain")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,291 @@
+import argparse
+import itertools
+import json
+import logging
+import os
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from expense_tracker import ExpenseTracker
+from statement_import import parse_amounts
+
+logger = logging.getLogger(__name__)
+
+# Image files picked up when walking a receipt directory
+RECEIPT_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff", ".webp")
+
+# Manifest statuses; everything except "failed" counts as done and is skipped on the next run
+STATUS_ADDED = "added"
+STATUS_REVIEW = "review"
+STATUS_FAILED = "failed"
+
+# Columns of the review queue (a CSV to edit by hand; set Approve to "yes" and run --confirm)
+REVIEW_COLUMNS = ["File", "Date", "Place", "Total", "Category", "Confidence", "Tier", "Reason", "Approve"]
+
+APPROVED_VALUES = {"y", "yes", "1", "true", "x"}
+
+
+# Append-only JSON Lines log of finished receipts, so an interrupted run resumes where it
+# stopped. A receipt is identified by its path (relative to the receipt directory), size and
+# modification time, so a file that is replaced by a new scan is processed again.
+class IngestManifest:
+
+    def __init__(self, path: str):
+        self.path = path
+        self.entries: Dict[str, Dict] = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue        # torn last line after a crash
+                    self.entries[entry["key"]] = entry
+
+
+    # True when the receipt finished in an earlier run (failed receipts are retried)
+    def done(self, key: str) -> bool:
+        entry = self.entries.get(key)
+        return entry is not None and entry["status"] != STATUS_FAILED
+
+
+    # Record a batch of finished receipts and fsync, so the checkpoint survives a crash
+    def record(self, entries: List[Dict]):
+        if not entries:
+            return
+        with open(self.path, "a", encoding="utf-8") as f:
+            for entry in entries:
+                f.write(json.dumps(entry) + "\n")
+                self.entries[entry["key"]] = entry
+            f.flush()
+            os.fsync(f.fileno())
+
+
+# Identity of a receipt file for the manifest
+def receipt_key(root: str, path: str) -> str:
+    stat = os.stat(path)
+    return f"{os.path.relpath(path, root)}|{stat.st_size}|{stat.st_mtime_ns}"
+
+
+# Receipt images under root, in a stable (sorted) order
+def find_receipts(root: str) -> List[str]:
+    paths = []
+    for directory, subdirs, files in os.walk(root):
+        subdirs.sort()
+        for name in sorted(files):
+            if name.lower().endswith(RECEIPT_EXTENSIONS):
+                paths.append(os.path.join(directory, name))
+    return paths
+
+
+# Decide whether an OCR result row can go into the ledger unattended.
+# Returns (expense dict or None, reason it needs review or None).
+def route(row: Dict, threshold: float) -> Tuple[Optional[Dict], Optional[str]]:
+    if row.get("Error"):
+        return None, f"error: {row['Error']}"
+    # Fields reused from a near-duplicate image describe the earlier receipt
+    if row.get("Duplicate"):
+        return None, f"near-duplicate of {row.get('DuplicateOf') or 'an earlier receipt'}"
+    amount = parse_amounts(pd.Series([row["Total"]])).iloc[0]
+    if pd.isna(amount) or amount <= 0:
+        return None, "no total"
+    day = pd.to_datetime(row["Date"], format="%Y-%m-%d", errors="coerce")
+    if pd.isna(day):
+        return None, "no date"
+    if not row["Place"] or row["Place"] == "Unknown":
+        return None, "no vendor"
+    if float(row["Confidence"] or 0.0) < threshold:
+        return None, f"low confidence ({float(row['Confidence'] or 0.0):.2f})"
+    return {"amount": float(amount), "date": day.strftime("%Y-%m-%d"),
+            "vendor": row["Place"].strip(), "category": row["Category"]}, None
+
+
+# Walks a receipt directory, OCRs the receipts in parallel and writes the ledger in bulk.
+# Results are committed per checkpoint: accepted rows are bulk-added and saved, review rows
+# appended to the review queue, and only then the manifest is updated. A crash between the
+# ledger write and the manifest update re-processes (at most) that one checkpoint.
+class BatchIngester:
+
+    def __init__(self, ocr, tracker: ExpenseTracker, manifest: IngestManifest, review_path: str,
+                 threshold: float = 0.6, workers: Optional[int] = None, checkpoint_every: int = 64):
+        self.ocr = ocr
+        self.tracker = tracker
+        self.manifest = manifest
+        self.review_path = review_path
+        self.threshold = threshold
+        self.workers = workers
+        self.checkpoint_every = max(1, checkpoint_every)
+        self.counts = {STATUS_ADDED: 0, STATUS_REVIEW: 0, STATUS_FAILED: 0, "skipped": 0}
+
+
+    # Process every receipt under root that is not done yet; returns the counts per status
+    def run(self, root: str) -> Dict[str, int]:
+        pending = []
+        for path in find_receipts(root):
+            key = receipt_key(root, path)
+            if self.manifest.done(key):
+                self.counts["skipped"] += 1
+            else:
+                pending.append((key, path))
+        logger.info("%d receipts to process, %d already done", len(pending), self.counts["skipped"])
+
+        # One OCR pool for the whole run (workers load the models once); results stream back
+        # in input order and are committed every checkpoint_every receipts
+        keys = {path: key for key, path in pending}
+        rows = self.ocr.iter_receipts([path for _, path in pending], max_workers=self.workers)
+        started, done = time.perf_counter(), 0
+        try:
+            while True:
+                chunk = list(itertools.islice(rows, self.checkpoint_every))
+                if not chunk:
+                    break
+                self._commit(self._routed(chunk, keys))
+                done += len(chunk)
+                rate = done / max(time.perf_counter() - started, 1e-9)
+                logger.info("%d/%d receipts (%.1f/s): %s", done, len(pending), rate, self.counts)
+        finally:
+            rows.close()        # stops the OCR pool when interrupted
+        return self.counts
+
+
+    # (manifest entry, expense or None, review row or None) per OCR result
+    def _routed(self, rows: List[Dict], keys: Dict[str, str]):
+        for row in rows:
+            expense, reason = route(row, self.threshold)
+            entry = {"key": keys[row["File"]], "file": row["File"], "at": time.time()}
+            if expense is not None:
+                entry["status"] = STATUS_ADDED
+                yield entry, expense, None
+            elif row.get("Error"):
+                entry.update(status=STATUS_FAILED, error=row["Error"])
+                yield entry, None, None
+            else:
+                entry.update(status=STATUS_REVIEW, reason=reason)
+                review = {column: row.get(column, "") for column in REVIEW_COLUMNS}
+                review.update(Reason=reason, Approve="")
+                yield entry, None, review
+
+
+    def _commit(self, routed):
+        entries, expenses, reviews = [], [], []
+        for entry, expense, review in routed:
+            entries.append(entry)
+            if expense is not None:
+                expenses.append(expense)
+            if review is not None:
+                reviews.append(review)
+
+        # route() already checked dates and amounts, so the bulk add rejects nothing
+        if expenses:
+            self.tracker.add_expenses_bulk(pd.DataFrame(expenses), categorize=False)
+            if not self.tracker.save_expenses():
+                raise RuntimeError("Could not write the ledger; the checkpoint was not recorded")
+        if reviews:
+            append_review_rows(self.review_path, reviews)
+        self.manifest.record(entries)
+        for entry in entries:
+            self.counts[entry["status"]] += 1
+
+
+# Append rows to the review queue CSV (header written when the file is new)
+def append_review_rows(path: str, rows: List[Dict]):
+    header = not os.path.exists(path) or os.path.getsize(path) == 0
+    pd.DataFrame(rows, columns=REVIEW_COLUMNS).to_csv(path, mode="a", header=header, index=False)
+
+
+# Add the review-queue rows marked Approve=yes (with any corrections made to Date / Place /
+# Total / Category) to the ledger in one bulk write, and keep the others in the queue.
+# Returns (number added, rows left in the queue).
+def confirm_reviewed(tracker: ExpenseTracker, review_path: str) -> Tuple[int, int]:
+    queue = pd.read_csv(review_path, dtype=str, keep_default_na=False)
+    approved = queue["Approve"].str.strip().str.lower().isin(APPROVED_VALUES)
+    if not approved.any():
+        return 0, len(queue)
+    rows = queue[approved]
+    expenses = pd.DataFrame({
+        "amount": parse_amounts(rows["Total"]),
+        "date": rows["Date"].str.strip(),
+        "vendor": rows["Place"].str.strip(),
+        "category": rows["Category"].str.strip()
+    })
+    added, rejected = tracker.add_expenses_bulk(expenses, categorize=True)
+    if added and not tracker.save_expenses():
+        raise RuntimeError("Could not write the ledger; the review queue was left unchanged")
+
+    # Rejected approvals (bad date or amount) go back to the queue with the reason
+    keep = queue[~approved].copy()
+    if len(rejected):
+        back = queue[approved].iloc[rejected.index].copy()
+        back["Reason"] = rejected["error"].to_numpy()
+        back["Approve"] = ""
+        keep = pd.concat([keep, back])
+    tmp_path = review_path + ".tmp"
+    keep.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, review_path)
+    return added, len(keep)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Ingest a directory of receipt images into the expense ledger without the web app")
+    parser.add_argument("receipts", nargs="?", help="directory of receipt images")
+    parser.add_argument("--ledger", default=os.environ.get("EXPENSES_FILE", "expenses.csv"),
+                        help="ledger file (.csv, .db or .arrow; default $EXPENSES_FILE or expenses.csv)")
+    parser.add_argument("--journal", action="store_true", help="journaled CSV ledger")
+    parser.add_argument("--threshold", type=float, default=0.6,
+                        help="category confidence needed to add a receipt without review (default 0.6)")
+    parser.add_argument("--workers", type=int, default=None, help="OCR processes (default: CPU count)")
+    parser.add_argument("--checkpoint-every", type=int, default=64, help="receipts per checkpoint")
+    parser.add_argument("--manifest", help="checkpoint manifest (default <receipts>/.ingest_manifest.jsonl)")
+    parser.add_argument("--review-queue", default="review_queue.csv", help="CSV of receipts needing review")
+    parser.add_argument("--confirm", action="store_true",
+                        help="add the review-queue rows marked Approve=yes to the ledger and exit")
+    parser.add_argument("--classifier", default="zero-shot", choices=["zero-shot", "embedding"])
+    parser.add_argument("--no-cache", action="store_true", help="do not use the on-disk OCR cache")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=os.environ.get("EXPENSES_LOG_LEVEL", "INFO").upper(),
+                        format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    tracker = ExpenseTracker(args.ledger, journal=args.journal)
+
+    if args.confirm:
+        if not os.path.exists(args.review_queue):
+            parser.error(f"review queue not found: {args.review_queue}")
+        added, left = confirm_reviewed(tracker, args.review_queue)
+        logger.info("Added %d reviewed receipts, %d left in %s", added, left, args.review_queue)
+        return 0
+
+    if not args.receipts or not os.path.isdir(args.receipts):
+        parser.error("a directory of receipt images is required")
+
+    # Imported here so --confirm does not load the OCR and classification models
+    from reciept_ocr import ReceiptOCR
+    from ocr_cache import OCRCache
+    from image_preprocessing import ImagePreprocessor
+    from receipt_dedup import DuplicateImageIndex
+    ocr = ReceiptOCR(cache=None if args.no_cache else OCRCache(), preprocessor=ImagePreprocessor(),
+                     classifier_mode=args.classifier,
+                     dedup=None if args.no_cache else DuplicateImageIndex(
+                         os.path.join(".ocr_cache", "image_hashes.jsonl")))
+    # Embedding classifier: start from the categories the ledger files its vendors under
+    ocr.refine_categories(tracker)
+
+    manifest = IngestManifest(args.manifest or os.path.join(args.receipts, ".ingest_manifest.jsonl"))
+    ingester = BatchIngester(ocr, tracker, manifest, args.review_queue, threshold=args.threshold,
+                             workers=args.workers, checkpoint_every=args.checkpoint_every)
+    try:
+        counts = ingester.run(args.receipts)
+    except KeyboardInterrupt:
+        logger.warning("Interrupted; finished checkpoints are kept, rerun to resume: %s", ingester.counts)
+        return 130
+    logger.info("Done: %d added, %d for review (%s), %d failed, %d skipped",
+                counts[STATUS_ADDED], counts[STATUS_REVIEW], args.review_queue,
+                counts[STATUS_FAILED], counts["skipped"])
+    return 1 if counts[STATUS_FAILED] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,341 @@
+import hashlib
+import logging
+import os
+from collections import defaultdict, deque
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from metrics import get_metrics
+
+logger = logging.getLogger(__name__)
+
+# Time spent in the model tier alone (the "classify" stage of a receipt includes the keyword tier)
+MODEL_TIER_SECONDS = get_metrics().histogram(
+    "receipt_stage_seconds", "Time spent per receipt processing stage", labels=["stage"])
+
+# Category -> vendor names (strong evidence) and generic keywords (weaker evidence).
+# Entries are matched case-insensitively on word boundaries.
+DEFAULT_LEXICON = {
+    "Food & Dining": {
+        "vendors": ["starbucks", "mcdonald's", "mcdonalds", "burger king", "subway", "kfc", "domino's",
+                    "dominos", "pizza hut", "taco bell", "chipotle", "dunkin", "tim hortons", "wendy's",
+                    "costa coffee", "pret a manger", "five guys", "panera", "nando's"],
+        "keywords": ["restaurant", "cafe", "coffee", "espresso", "latte", "cappuccino", "bistro", "diner",
+                     "pizza", "burger", "sushi", "bar & grill", "gratuity", "tip", "table", "server",
+                     "dine in", "take away", "takeaway", "bakery"]
+    },
+    "Groceries": {
+        "vendors": ["walmart", "kroger", "safeway", "whole foods", "trader joe's", "aldi", "lidl", "tesco",
+                    "sainsbury's", "asda", "carrefour", "costco", "publix", "albertsons", "wegmans",
+                    "food lion", "h-e-b", "spar", "rewe", "edeka", "auchan"],
+        "keywords": ["grocery", "groceries", "supermarket", "produce", "dairy", "bakery dept", "deli",
+                     "organic", "milk", "eggs", "bread", "bananas", "per kg", "/kg", "lb @"]
+    },
+    "Gas": {
+        "vendors": ["shell", "chevron", "exxon", "exxonmobil", "mobil", "bp", "texaco", "esso", "sunoco",
+                    "valero", "citgo", "arco", "marathon", "phillips 66", "circle k", "totalenergies"],
+        "keywords": ["fuel", "gasoline", "petrol", "diesel", "unleaded", "gallons", "litres", "liters",
+                     "pump", "gal", "octane"]
+    },
+    "Transportation": {
+        "vendors": ["uber", "lyft", "bolt", "grab", "amtrak", "greyhound", "mta", "tfl"],
+        "keywords": ["taxi", "cab", "fare", "ride", "metro", "subway pass", "bus", "train ticket",
+                     "parking", "toll", "transit"]
+    },
+    "Shopping": {
+        "vendors": ["amazon", "target", "best buy", "ikea", "h&m", "zara", "uniqlo", "macy's", "nordstrom",
+                    "home depot", "lowe's", "apple store", "primark", "decathlon"],
+        "keywords": ["clothing", "apparel", "electronics", "store", "retail", "return policy",
+                     "exchange within", "size", "shoes", "furniture"]
+    },
+    "Entertainment": {
+        "vendors": ["netflix", "spotify", "amc", "cinemark", "regal", "steam", "playstation", "xbox",
+                    "ticketmaster", "disney+"],
+        "keywords": ["cinema", "movie", "theatre", "theater", "concert", "tickets", "admission",
+                     "museum", "bowling", "arcade", "popcorn"]
+    },
+    "Bills & Utilities": {
+        "vendors": ["at&t", "verizon", "t-mobile", "comcast", "xfinity", "vodafone", "pg&e", "con edison"],
+        "keywords": ["electricity", "electric", "water bill", "utility", "utilities", "internet",
+                     "broadband", "phone bill", "invoice", "account number", "billing period", "kwh"]
+    },
+    "Healthcare": {
+        "vendors": ["cvs", "walgreens", "rite aid", "boots", "duane reade"],
+        "keywords": ["pharmacy", "prescription", "rx", "clinic", "hospital", "doctor", "dental",
+                     "medical", "patient", "copay", "medicine"]
+    },
+    "Education": {
+        "vendors": ["coursera", "udemy", "barnes & noble", "chegg"],
+        "keywords": ["tuition", "school", "university", "college", "course", "textbook", "books",
+                     "stationery", "enrollment", "semester"]
+    },
+    "Travel": {
+        "vendors": ["marriott", "hilton", "hyatt", "airbnb", "booking.com", "expedia", "delta",
+                    "united airlines", "american airlines", "ryanair", "easyjet", "lufthansa", "holiday inn"],
+        "keywords": ["hotel", "flight", "airline", "boarding", "check-in", "check-out", "room rate",
+                     "nights", "resort", "baggage", "itinerary"]
+    }
+}
+
+VENDOR_WEIGHT = 2.0
+KEYWORD_WEIGHT = 1.0
+
+
+# Multi-pattern matcher (Aho-Corasick automaton): finds every lexicon entry in one pass
+# over the text, however many entries there are.
+class AhoCorasick:
+
+    # Build the trie, failure links and output sets from (pattern, payload) pairs
+    def __init__(self, patterns: Sequence[Tuple[str, object]]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[Tuple[int, object]]] = [[]]
+
+        for pattern, payload in patterns:
+            state = 0
+            for char in pattern:
+                if char not in self._goto[state]:
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                    self._goto[state][char] = len(self._goto) - 1
+                state = self._goto[state][char]
+            self._out[state].append((len(pattern), payload))
+
+        # Breadth-first pass to set failure links
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(char, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+
+    # Yield (start, end, payload) for every pattern occurrence in text
+    def finditer(self, text: str):
+        state = 0
+        for i, char in enumerate(text):
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            for length, payload in self._out[state]:
+                yield i - length + 1, i + 1, payload
+
+
+# Fast tier: scores categories by vendor and keyword hits from a compiled lexicon
+class KeywordClassifier:
+
+    def __init__(self, lexicon: Optional[Dict[str, Dict[str, List[str]]]] = None):
+        self.lexicon = lexicon or DEFAULT_LEXICON
+        patterns = []
+        for category, entries in self.lexicon.items():
+            for vendor in entries.get("vendors", []):
+                patterns.append((vendor.lower(), (category, VENDOR_WEIGHT)))
+            for keyword in entries.get("keywords", []):
+                patterns.append((keyword.lower(), (category, KEYWORD_WEIGHT)))
+        self._matcher = AhoCorasick(patterns)
+
+
+    # Return (category, confidence) with confidence in [0, 1]; (None, 0.0) when nothing matched.
+    # Confidence is the winner's share of all evidence, scaled down when evidence is thin
+    # (a single keyword is not enough on its own to skip the model tier).
+    def classify(self, text: str) -> Tuple[Optional[str], float]:
+        text = text.lower()
+        scores = defaultdict(float)
+        seen = set()
+        for start, end, (category, weight) in self._matcher.finditer(text):
+            # Whole words only: "bp" must not match inside "bpm", "tip" inside "multiple"
+            if start > 0 and text[start - 1].isalnum():
+                continue
+            if end < len(text) and text[end].isalnum():
+                continue
+            # Count each distinct entry once so repeated line items don't dominate
+            if (text[start:end], category) in seen:
+                continue
+            seen.add((text[start:end], category))
+            scores[category] += weight
+
+        if not scores:
+            return None, 0.0
+        best = max(scores, key=scores.get)
+        share = scores[best] / sum(scores.values())
+        strength = min(1.0, scores[best] / VENDOR_WEIGHT)
+        return best, share * strength
+
+
+# Adapter exposing the zero-shot transformers pipeline as predict(texts) -> [(label, score)]
+class ZeroShotModel:
+
+    def __init__(self, classifier, categories: List[str]):
+        self.classifier = classifier
+        self.categories = categories
+
+
+    def predict(self, texts: List[str]) -> List[Tuple[str, float]]:
+        outputs = self.classifier(texts, candidate_labels=self.categories)
+        if isinstance(outputs, dict):
+            outputs = [outputs]
+        return [(output["labels"][0], float(output["scores"][0])) for output in outputs]
+
+
+# Cascade: keyword lexicon first, model only for receipts the lexicon is unsure about.
+# Each result records the tier that decided it: "keyword", "model" or "default".
+class TieredClassifier:
+
+    def __init__(self, keyword: Optional[KeywordClassifier] = None, model=None,
+                 threshold: float = 0.6, default: str = "Other"):
+        self.keyword = keyword or KeywordClassifier()
+        self.model = model
+        self.threshold = threshold
+        self.default = default
+
+
+    # Classify texts; returns one (category, confidence, tier) per text
+    def classify(self, texts: List[str]) -> List[Tuple[str, float, str]]:
+        results = []
+        unsure = []
+        for i, text in enumerate(texts):
+            category, confidence = self.keyword.classify(text)
+            if category is not None and confidence >= self.threshold:
+                results.append((category, confidence, "keyword"))
+            else:
+                results.append((category or self.default, confidence,
+                                "keyword" if category else "default"))
+                if text.strip():
+                    unsure.append(i)
+
+        # One batched model call for everything the fast tier could not settle
+        if self.model is not None and unsure:
+            try:
+                with MODEL_TIER_SECONDS.time(stage="classifier_model"):
+                    predictions = self.model.predict([texts[i] for i in unsure])
+                for i, (category, confidence) in zip(unsure, predictions):
+                    results[i] = (category, confidence, "model")
+            except Exception:
+                logger.exception("Error in model classification tier")
+        return results
+
+
+# Short descriptions embedded as the starting prototype of each category
+LABEL_DESCRIPTIONS = {
+    "Food & Dining": "restaurant, cafe, coffee shop or fast food receipt for meals and drinks",
+    "Transportation": "taxi, ride share, bus, train, metro, parking or toll payment",
+    "Shopping": "retail store purchase of clothing, electronics, furniture or household goods",
+    "Entertainment": "cinema, concert, museum, streaming, games or event tickets",
+    "Bills & Utilities": "electricity, water, gas utility, internet or phone bill",
+    "Healthcare": "pharmacy, prescription, doctor, dentist, clinic or hospital payment",
+    "Education": "tuition, course fees, textbooks, school or university supplies",
+    "Travel": "hotel stay, flight, airline, holiday or accommodation booking",
+    "Groceries": "supermarket or grocery store receipt for food items like milk, bread and produce",
+    "Gas": "fuel station receipt for gasoline, petrol or diesel",
+    "Other": "miscellaneous purchase or service"
+}
+
+
+# Turns a transformers feature-extraction pipeline into sentence embeddings
+# (mean of the token vectors, L2-normalized)
+class TextEmbedder:
+
+    def __init__(self, feature_extractor):
+        self.feature_extractor = feature_extractor
+
+
+    def __call__(self, texts: List[str]) -> np.ndarray:
+        # One output per text, each shaped (1, tokens, dim)
+        outputs = self.feature_extractor(list(texts), truncation=True)
+        vectors = np.stack([np.asarray(output, dtype=np.float32).reshape(-1, np.shape(output)[-1]).mean(axis=0)
+                            for output in outputs])
+        return _normalize(vectors)
+
+
+# Embedding tier: embeds each receipt once and compares it with one prototype vector per
+# category, instead of one NLI forward pass per candidate label.
+# Prototypes start from LABEL_DESCRIPTIONS (cached on disk) and can be refined with
+# expenses whose category the user confirmed.
+class EmbeddingModel:
+
+    def __init__(self, embedder, categories: List[str], model_name: str = "",
+                 descriptions: Optional[Dict[str, str]] = None, cache_dir: Optional[str] = ".model_cache",
+                 temperature: float = 0.05):
+        self.embedder = embedder
+        self.categories = list(categories)
+        self.model_name = model_name
+        self.descriptions = descriptions or LABEL_DESCRIPTIONS
+        self.cache_dir = cache_dir
+        self.temperature = temperature
+        self.label_vectors = self._label_embeddings()
+        self.prototypes = self.label_vectors.copy()
+
+
+    # Short hash of the current prototypes (changes when they are refined)
+    @property
+    def fingerprint(self) -> str:
+        return hashlib.sha256(self.prototypes.tobytes()).hexdigest()[:12]
+
+
+    # Return (category, score) per text; score is a softmax over prototype similarities
+    def predict(self, texts: List[str]) -> List[Tuple[str, float]]:
+        vectors = self.embedder(list(texts))
+        similarities = vectors @ self.prototypes.T
+        logits = similarities / self.temperature
+        logits -= logits.max(axis=1, keepdims=True)
+        probabilities = np.exp(logits)
+        probabilities /= probabilities.sum(axis=1, keepdims=True)
+        best = probabilities.argmax(axis=1)
+        return [(self.categories[i], float(probabilities[row, i])) for row, i in enumerate(best)]
+
+
+    # Move each prototype towards the mean embedding of confirmed examples of its category.
+    # examples maps category -> texts (e.g. vendor names); weight is the share given to examples.
+    def refine(self, examples: Dict[str, List[str]], weight: float = 0.5):
+        prototypes = self.label_vectors.copy()
+        for i, category in enumerate(self.categories):
+            texts = [text for text in examples.get(category, []) if text and text.strip()]
+            if not texts:
+                continue
+            centroid = self.embedder(texts).mean(axis=0)
+            prototypes[i] = (1 - weight) * prototypes[i] + weight * centroid
+        self.prototypes = _normalize(prototypes)
+
+
+    # Refine prototypes from the vendors of expenses saved in an ExpenseTracker
+    def refine_from_tracker(self, tracker, weight: float = 0.5, max_per_category: int = 200):
+        df = tracker.get_expenses_df()
+        if df.empty:
+            return
+        examples = {}
+        for category, vendors in df.groupby("category", observed=True)["vendor"]:
+            examples[str(category)] = [str(v) for v in vendors.dropna().unique()[:max_per_category]]
+        self.refine(examples, weight=weight)
+
+
+    # Embed the category descriptions, reusing the on-disk copy computed at a previous startup
+    def _label_embeddings(self) -> np.ndarray:
+        texts = [f"{category}: {self.descriptions.get(category, category)}" for category in self.categories]
+        path = None
+        if self.cache_dir:
+            key = hashlib.sha256("\n".join([self.model_name] + texts).encode("utf-8")).hexdigest()[:16]
+            path = os.path.join(self.cache_dir, f"label_embeddings_{key}.npy")
+            if os.path.exists(path):
+                try:
+                    return np.load(path)
+                except (OSError, ValueError):
+                    pass
+        vectors = self.embedder(texts)
+        if path:
+            try:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                np.save(path, vectors)
+            except OSError as e:
+                logger.warning("Could not cache label embeddings: %s", e)
+        return vectors
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
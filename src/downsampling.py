@@ -0,0 +1,82 @@
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+
+# Most points a single chart trace is allowed to send to the browser
+CHART_POINT_BUDGET = 400
+
+# Coarser time resolutions tried in order when a series has too many points:
+# (resample rule, label); the rule is None for the daily input itself
+ROLLUPS = [(None, "Daily"), ("W", "Weekly"), ("MS", "Monthly")]
+
+
+# Fit a daily spending series (DatetimeIndex -> amount, days without expenses may be missing)
+# into max_points: the finest of day / week / month sums that fits is used, and if even the
+# monthly series is too long it is thinned with LTTB. Returns (series, resolution label).
+def rollup_for_budget(daily: pd.Series, max_points: int = CHART_POINT_BUDGET) -> Tuple[pd.Series, str]:
+    series, label = daily, ROLLUPS[0][1]
+    for rule, label in ROLLUPS:
+        series = daily if rule is None else daily.resample(rule).sum()
+        if len(series) <= max_points:
+            return series, label
+    return downsample(series, max_points), label
+
+
+# Thin any numeric series to at most max_points, keeping its visual shape:
+# "lttb" (Largest-Triangle-Three-Buckets) for lines, "minmax" to keep each bucket's extremes
+def downsample(series: pd.Series, max_points: int = CHART_POINT_BUDGET, method: str = "lttb") -> pd.Series:
+    if len(series) <= max_points:
+        return series
+    y = series.to_numpy(dtype=np.float64)
+    if isinstance(series.index, pd.DatetimeIndex):
+        x = series.index.asi8.astype(np.float64)
+    else:
+        x = np.arange(len(series), dtype=np.float64)
+    if method == "lttb":
+        keep = lttb_indices(x, y, max_points)
+    elif method == "minmax":
+        keep = minmax_indices(y, max_points)
+    else:
+        raise ValueError(f"Unknown downsampling method: {method}")
+    return series.iloc[keep]
+
+
+# Indices of the points chosen by Largest-Triangle-Three-Buckets (Steinarsson, 2013): the
+# first and last points plus, for each of threshold - 2 buckets, the point forming the
+# largest triangle with the previously chosen point and the average of the next bucket
+def lttb_indices(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    every = (n - 2) / (threshold - 2)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        avg_start = int((i + 1) * every) + 1
+        avg_end = min(int((i + 2) * every) + 1, n)
+        avg_x = x[avg_start:avg_end].mean()
+        avg_y = y[avg_start:avg_end].mean()
+
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        areas = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(areas))
+        selected[i + 1] = a
+    return selected
+
+
+# Indices of the minimum and maximum of each of max_points // 2 equal buckets (in order)
+def minmax_indices(y: np.ndarray, max_points: int) -> np.ndarray:
+    n = len(y)
+    buckets = max(1, max_points // 2)
+    if n <= max_points:
+        return np.arange(n)
+    bounds = np.linspace(0, n, buckets + 1).astype(np.int64)
+    keep = []
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        if end > start:
+            chunk = y[start:end]
+            keep.extend((start + int(np.argmin(chunk)), start + int(np.argmax(chunk))))
+    return np.unique(keep)
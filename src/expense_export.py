@@ -0,0 +1,102 @@
+import gzip
+import io
+import tempfile
+from typing import Callable, Iterable, Optional, Tuple
+
+import pandas as pd
+
+# format -> (MIME type, file extension)
+EXPORT_FORMATS = {
+    "csv": ("text/csv", ".csv"),
+    "jsonl": ("application/x-ndjson", ".jsonl"),
+    "parquet": ("application/vnd.apache.parquet", ".parquet"),
+}
+
+# Exports up to this size stay in memory, larger ones spill to a temporary file
+SPOOL_MAX_BYTES = 8 * 1024 * 1024
+
+
+# Write matching expenses from the tracker in chunks to a spooled temporary file.
+#   fmt       "csv", "jsonl" (one JSON object per line) or "parquet" (needs pyarrow)
+#   compress  gzip the output (Parquet uses its own gzip codec instead, so it stays readable)
+#   progress  called as progress(rows_written, total_rows) after every chunk
+# Returns (file positioned at the start, file name, MIME type); the caller closes the file.
+def export_expenses(tracker, fmt: str = "csv", compress: bool = False, start=None, end=None,
+                    category: Optional[str] = None, vendor: Optional[str] = None,
+                    chunk_size: int = 50_000,
+                    progress: Optional[Callable[[int, int], None]] = None) -> Tuple[tempfile.SpooledTemporaryFile, str, str]:
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    mime, extension = EXPORT_FORMATS[fmt]
+    total = tracker.count_matching(start, end, category, vendor)
+    chunks = tracker.iter_chunks(start, end, category, vendor, chunk_size=chunk_size)
+
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES, mode="w+b")
+    try:
+        if fmt == "parquet":
+            write_parquet(chunks, spool, compression="gzip" if compress else "snappy",
+                          progress=_counter(progress, total))
+        else:
+            sink = gzip.GzipFile(fileobj=spool, mode="wb") if compress else spool
+            write_text(chunks, sink, fmt, progress=_counter(progress, total))
+            if compress:
+                sink.close()        # writes the gzip trailer; the spool stays open
+                mime, extension = "application/gzip", extension + ".gz"
+    except Exception:
+        spool.close()
+        raise
+    spool.seek(0)
+    return spool, "expenses" + extension, mime
+
+
+# CSV (header once) or JSON Lines, one chunk at a time, to a binary file; an empty JSON Lines
+# export is an empty file
+def write_text(chunks: Iterable[pd.DataFrame], sink, fmt: str, progress: Optional[Callable[[int], None]] = None):
+    text = io.TextIOWrapper(sink, encoding="utf-8", newline="")
+    try:
+        for i, chunk in enumerate(chunks):
+            if fmt == "csv":
+                chunk.to_csv(text, header=(i == 0), index=False)
+            elif len(chunk):
+                # Recent pandas ends the last line with a newline too, older versions do not
+                lines = chunk.to_json(orient="records", lines=True)
+                text.write(lines if lines.endswith("\n") else lines + "\n")
+            if progress:
+                progress(len(chunk))
+        text.flush()
+    finally:
+        text.detach()               # leave the underlying file open for the caller
+
+
+# Parquet, one row group per chunk
+def write_parquet(chunks: Iterable[pd.DataFrame], sink, compression: str = "snappy",
+                  progress: Optional[Callable[[int], None]] = None):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("Parquet export needs pyarrow: pip install pyarrow")
+    writer = None
+    try:
+        for chunk in chunks:
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(sink, table.schema, compression=compression)
+            writer.write_table(table)
+            if progress:
+                progress(len(chunk))
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+# progress(rows_in_chunk) -> user_progress(rows_so_far, total)
+def _counter(progress: Optional[Callable[[int, int], None]], total: int) -> Optional[Callable[[int], None]]:
+    if progress is None:
+        return None
+    done = [0]
+
+    def advance(rows: int):
+        done[0] += rows
+        progress(done[0], total)
+    return advance
@@ -1,107 +1,722 @@
 import pandas as pd
+import numpy as np
 from datetime import datetime, date
-from typing import List, Dict, Optional
+from typing import Callable, List, Dict, Optional, Tuple
+from contextlib import contextmanager
+import logging
 import os
+from storage import ExpenseStorage, CSVStorage, JournalCSVStorage, SQLiteStorage, open_storage
+from ledger_columns import ExpenseColumns, EXPENSE_FRAME_COLUMNS, to_cents
+from ledger_aggregates import RunningAggregates
+from ledger_index import LedgerIndex, DateLike, to_day
+from ledger_duplicates import DuplicateKeys, duplicate_key, duplicate_keys_of
+from ledger_lock import RWLock, FileLock, lock_path
+from analytics_cube import RollupCube
+from metrics import get_metrics, timed
+
+logger = logging.getLogger(__name__)
+
+# Bulk adds of at most 1/MERGE_RATIO of the ledger are merged into the aggregates and indexes
+# instead of rebuilding them
+MERGE_RATIO = 8
+
+# Approximate bytes per row of the cached list of dicts (dict, id, amount and date objects)
+RECORD_BYTES = 300
+
+# Instrumentation (recorded only when metrics are enabled, see metrics.py)
+LEDGER_SECONDS = get_metrics().histogram(
+    "ledger_operation_seconds", "Duration of ExpenseTracker operations", labels=["op"])
+LEDGER_ERRORS = get_metrics().counter(
+    "ledger_errors_total", "Failed ExpenseTracker operations", labels=["op"])
+LEDGER_ROWS_ADDED = get_metrics().counter(
+    "ledger_expenses_added_total", "Expenses added to ledgers")
+LEDGER_DUPLICATES = get_metrics().counter(
+    "ledger_probable_duplicates_total", "Added expenses matching an existing vendor, date and amount")
 
 class ExpenseTracker:
     
-    # Initialize ExpenseTracker with data file and load existing expenses
-    def __init__(self, data_file: str = "expenses.csv"):
+    # Initialize ExpenseTracker with data file and load existing expenses.
+    # The storage backend follows the file name (expenses.db -> SQLite) unless one is passed in;
+    # journal=True keeps a CSV ledger but appends new expenses to a crash-safe journal.
+    # One tracker can be shared by all sessions of a server: reads run in parallel under a
+    # reader-writer lock, writes are exclusive and also hold a lock file so several server
+    # processes can write the same ledger. Before each write the tracker catches up with
+    # changes other processes made (see refresh), so IDs stay unique and no rows are lost.
+    def __init__(self, data_file: str = "expenses.csv", storage: Optional[ExpenseStorage] = None,
+                 journal: bool = False):
         self.data_file = data_file
-        self.expenses = []
+        self.storage = storage or open_storage(data_file, journal=journal)
+        # Typed columns (cents, datetime64, categorical codes) hold the ledger in memory;
+        # version increases on every change so derived views can be cached
+        self.columns = ExpenseColumns()
+        # Running totals (overall, per category/month/vendor) updated on every add
+        self.aggregates = RunningAggregates()
+        # Rows sorted by date, overall and per category/vendor, for recent and range queries
+        self.index = LedgerIndex()
+        self.next_id = 1
+        self.version = 0
+        self._frame_cache = None      # (version, DataFrame)
+        self._records_cache = None    # (version, list of dicts)
+        self._rollup_cache = None     # (version, RollupCube)
+        self._duplicate_keys = None   # DuplicateKeys of the ledger, built on first use
+        # Months loaded so far from partitioned storage; None once the whole ledger is loaded
+        self._months = None
+        self._keyword_classifier = None
+        self._lock = RWLock()
+        self._file_lock = FileLock(lock_path(data_file))
+        self._listeners: List[Callable[[int], None]] = []
+        self._token = None            # storage change token as of our last load/write
+        self._unsaved = 0             # trailing rows not yet written (non-incremental backends)
         self.load_expenses()
     
 
     # Add a new expense record with validation
+    @timed(LEDGER_SECONDS, LEDGER_ERRORS, op="add_expense")
     def add_expense(self, amount: float, date_str: str, vendor: str, category: str) -> bool:
         try:
             # Validate date format
             expense_date = datetime.strptime(date_str, "%Y-%m-%d").date()
-            
-            expense = {
-                "id": len(self.expenses) + 1,
-                "amount": float(amount),
-                "date": date_str,
-                "vendor": vendor.strip(),
-                "category": category.strip()
-            }
-            
-            self.expenses.append(expense)
-            return True
+            # strptime also accepts unpadded dates ("2024-1-5"); store the canonical form
+            date_str = expense_date.isoformat()
+            amount = float(amount)
         except ValueError as e:
-            print(f"Error adding expense: {e}")
+            logger.warning("Error adding expense: %s", e)
+            LEDGER_ERRORS.inc(op="add_expense")
+            return False
+
+        try:
+            with self._writing():
+                # A lazily loaded ledger only needs this month: duplicates share the date
+                self._ensure_loaded(expense_date, expense_date)
+                expense = {
+                    "id": self._allocate_ids(1),
+                    "amount": amount,
+                    "date": date_str,
+                    "vendor": vendor.strip(),
+                    "category": category.strip()
+                }
+
+                # Incremental backends (SQLite, CSV journal) persist the row right away
+                if self.storage.incremental:
+                    self.storage.append(expense)
+                else:
+                    self._unsaved += 1
+
+                cents = int(round(expense["amount"] * 100))
+                day = np.datetime64(expense_date, 'D')
+                key = duplicate_key(expense["vendor"], int(day.astype(np.int64)), cents)
+                duplicate_keys = self._duplicate_index()
+                duplicates = duplicate_keys.count(key)
+                if duplicates:
+                    logger.warning("Probable duplicate expense: %s on %s for %.2f already recorded %d time(s)",
+                                   expense["vendor"], date_str, amount, duplicates)
+                    LEDGER_DUPLICATES.inc()
+                duplicate_keys.add(key)
+                row = self.columns.append(expense["id"], cents, day, expense["vendor"], expense["category"])
+                self.index.add(row, int(day.astype(np.int64)), int(self.columns.category_codes[row]),
+                               int(self.columns.vendor_codes[row]))
+                if self._months is None:
+                    self.aggregates.add(cents, expense_date, expense["vendor"], expense["category"])
+                else:
+                    self._months.add(date_str[:7])     # its month now holds this row
+                self._changed()
+            LEDGER_ROWS_ADDED.inc()
+            return True
+        except Exception:
+            logger.exception("Error storing expense")
+            LEDGER_ERRORS.inc(op="add_expense")
+            return False
+
+
+    # Add many expenses at once (DataFrame with amount, date, vendor and optional category).
+    # Dates ("YYYY-MM-DD") and amounts are validated column-wise, IDs are allocated as one
+    # block, rows without a category are categorized by vendor with the keyword classifier
+    # (each distinct vendor once), and incremental backends get a single write.
+    # Returns (number added, rejected rows with an "error" column).
+    @timed(LEDGER_SECONDS, LEDGER_ERRORS, op="add_expenses_bulk")
+    def add_expenses_bulk(self, expenses: pd.DataFrame, categorize: bool = True) -> Tuple[int, pd.DataFrame]:
+        with self._writing():
+            return self._add_rows(expenses, categorize)
+
+
+    # ---------------- SHARED ACCESS ----------------
+    # Catch up with changes other processes wrote to the storage (cheap when there are none).
+    # Returns the ledger version.
+    def refresh(self) -> int:
+        if self.storage.change_token() != self._token:
+            with self._lock.write():
+                self._sync()
+        return self.version
+
+
+    # Call callback(version) after every change to the ledger; returns a function that
+    # unsubscribes. Callbacks run on the writing thread and must be quick.
+    def subscribe(self, callback: Callable[[int], None]) -> Callable[[], None]:
+        with self._lock.write():
+            self._listeners.append(callback)
+
+        def unsubscribe():
+            with self._lock.write():
+                if callback in self._listeners:
+                    self._listeners.remove(callback)
+        return unsubscribe
+
+
+    # Exclusive section for a change: write lock, cross-process file lock, and catch-up first.
+    # A partitioned ledger stays partially loaded; the change loads the months it touches.
+    @contextmanager
+    def _writing(self):
+        with self._lock.write(), self._file_lock:
+            self._sync()
+            yield
+            self._token = self.storage.change_token()
+
+
+    # Reload if another process changed the storage, keeping rows we have not saved yet
+    # (they are re-added after the reloaded ones with new IDs); caller holds the write lock
+    def _sync(self):
+        token = self.storage.change_token()
+        if token is None or token == self._token:
+            return
+        unsaved = self.columns.to_records_frame().tail(self._unsaved) if self._unsaved else None
+        self._load()
+        if unsaved is not None:
+            self._add_rows(unsaved.drop(columns='id'), categorize=False)
+
+
+    def _changed(self):
+        self.version += 1
+        for callback in list(self._listeners):
+            try:
+                callback(self.version)
+            except Exception:
+                logger.exception("Error in ledger change listener")
+
+
+    # Body of add_expenses_bulk; caller holds the write lock
+    def _add_rows(self, expenses: pd.DataFrame, categorize: bool) -> Tuple[int, pd.DataFrame]:
+        df = expenses.reset_index(drop=True)
+        days = pd.to_datetime(df['date'].astype(str).str.strip(), format="%Y-%m-%d", errors='coerce')
+        amounts = pd.to_numeric(df['amount'], errors='coerce')
+        errors = pd.Series(None, index=df.index, dtype=object)
+        errors[~np.isfinite(amounts.to_numpy(dtype=np.float64, na_value=np.nan))] = "invalid amount"
+        errors[days.isna()] = "invalid date (expected YYYY-MM-DD)"
+        valid = errors.isna().to_numpy()
+        rejected = df[~valid].assign(error=errors[~valid])
+        if not valid.any():
+            return 0, rejected
+        # A lazily loaded ledger only needs the months being added to (for the duplicate check)
+        self._ensure_loaded(days[valid].min(), days[valid].max())
+
+        vendors = df['vendor'].fillna('').astype(str).str.strip()[valid]
+        if 'category' in df.columns:
+            categories = df['category'].fillna('').astype(str).str.strip()[valid]
+        else:
+            categories = pd.Series('', index=vendors.index)
+        if categorize:
+            categories = self._categorize_vendors(vendors, categories)
+        categories = categories.replace('', 'Other')
+
+        count = int(valid.sum())
+        first_id = self._allocate_ids(count)
+        rows = pd.DataFrame({
+            'id': np.arange(first_id, first_id + count, dtype=np.int64),
+            'amount': amounts[valid].to_numpy(dtype=np.float64),
+            'date': days[valid].dt.strftime('%Y-%m-%d').to_numpy(),
+            'vendor': vendors.to_numpy(),
+            'category': categories.to_numpy()
+        })
+        try:
+            if self.storage.incremental:
+                self.storage.append_many(rows)
+            else:
+                self._unsaved += count
+        except Exception as e:
+            logger.exception("Error storing expenses")
+            LEDGER_ERRORS.inc(op="add_expenses_bulk")
+            return 0, pd.concat([rejected, df[valid].assign(error=f"storage error: {e}")])
+
+        cents = to_cents(rows['amount'].to_numpy())
+        day_values = days[valid].to_numpy().astype('datetime64[D]')
+        # Probable duplicates: same vendor, day and amount as an earlier expense or another new row
+        # (vectorized, so a large import does not pay a Python loop per row)
+        vendor_codes, vendor_names = pd.factorize(rows['vendor'])
+        new_keys = duplicate_keys_of(vendor_names, day_values.astype(np.int64), cents, codes=vendor_codes)
+        duplicate_keys = self._duplicate_index()
+        repeated = (duplicate_keys.count_many(new_keys) > 0) | pd.Series(new_keys).duplicated().to_numpy()
+        duplicates = int(repeated.sum())
+        if duplicates:
+            logger.warning("%d of %d added expenses match an existing vendor, date and amount", duplicates, count)
+            LEDGER_DUPLICATES.inc(duplicates)
+        duplicate_keys.add_many(new_keys)
+
+        first_row = len(self.columns)
+        self.columns.extend(
+            ids=rows['id'].to_numpy(),
+            cents=cents,
+            days=day_values,
+            vendors=rows['vendor'],
+            categories=rows['category']
+        )
+        # A batch much smaller than the ledger is merged into the aggregates and indexes;
+        # for a large one (or the initial import) one vectorized rebuild is cheaper. The
+        # aggregates of a partially loaded ledger are built by the full load.
+        partial = self._months is not None
+        if count * MERGE_RATIO <= first_row:
+            if not partial:
+                self.aggregates.add_rows(self.columns, first_row)
+            self.index.add_rows(self.columns, first_row)
+        else:
+            if not partial:
+                self.aggregates = RunningAggregates.from_columns(self.columns)
+            self.index = LedgerIndex.from_columns(self.columns)
+        if partial:
+            self._months.update(rows['date'].str[:7])
+        self._changed()
+        LEDGER_ROWS_ADDED.inc(count)
+        return count, rejected
+
+
+    # All expenses as a list of dicts (built once per ledger version)
+    @property
+    def expenses(self) -> List[Dict]:
+        self._ensure_loaded()
+        with self._lock.read():
+            cache = self._records_cache
+            if cache is None or cache[0] != self.version:
+                cache = (self.version, [self.columns.row(i) for i in range(len(self.columns))])
+                self._records_cache = cache
+            return cache[1]
+
+
+    # Number of expenses in the ledger
+    def count(self) -> int:
+        if self._months is not None:
+            return self.storage.count()
+        return len(self.columns)
+
+
+    # Approximate memory held by the ledger: columns, date indexes, duplicate keys and the
+    # cached frame, records and rollup (stale caches count until they are rebuilt or dropped)
+    def nbytes(self) -> int:
+        with self._lock.read():
+            size = self.columns.nbytes() + self.index.nbytes()
+            if self._duplicate_keys is not None:
+                size += self._duplicate_keys.nbytes()
+            if self._frame_cache is not None:
+                size += int(self._frame_cache[1].memory_usage(deep=False).sum())
+            if self._records_cache is not None:
+                size += len(self._records_cache[1]) * RECORD_BYTES
+            if self._rollup_cache is not None:
+                size += self._rollup_cache[1].nbytes()
+            return size
+
+
+    # Release the cached views and duplicate keys (rebuilt on next use), e.g. when the
+    # ledger is idle or evicted from a pool while a session still holds it
+    def drop_caches(self):
+        with self._lock.write():
+            self._frame_cache = None
+            self._records_cache = None
+            self._rollup_cache = None
+            self._duplicate_keys = None
+
+
+    # Persist the ledger through the storage backend.
+    # Incremental backends already stored every row in add_expense, so there is nothing to do.
+    @timed(LEDGER_SECONDS, LEDGER_ERRORS, op="save_expenses")
+    def save_expenses(self) -> bool:
+        if self.storage.incremental:
+            return True
+        try:
+            with self._writing():
+                self._ensure_loaded()
+                self.storage.save_all(self.columns.to_records_frame())
+                self._unsaved = 0
+            return True
+        except Exception:
+            logger.exception("Error saving expenses")
+            LEDGER_ERRORS.inc(op="save_expenses")
             return False
     
 
-    # Save all expenses to a CSV file
+    # Save all expenses to a CSV file (the data file itself when the ledger is kept as CSV)
     def save_expenses_csv(self, filename: Optional[str] = None) -> bool:
         try:
-            filename = filename or self.data_file
-            df = pd.DataFrame(self.expenses)
+            if filename is None:
+                filename = self.data_file if isinstance(self.storage, (CSVStorage, JournalCSVStorage)) \
+                    else os.path.splitext(self.data_file)[0] + ".csv"
+            self._ensure_loaded()
+            with self._lock.read():
+                df = self.columns.to_records_frame()
             df.to_csv(filename, index=False)
             return True
-        except Exception as e:
-            print(f"Error saving to CSV: {e}")
+        except Exception:
+            logger.exception("Error saving to CSV")
+            LEDGER_ERRORS.inc(op="save_expenses_csv")
             return False
     
 
-    # Load expenses from CSV file
+    # Load expenses from the storage backend, or from the given CSV file
     def load_expenses(self, filename: Optional[str] = None) -> bool:
+        with self._lock.write():
+            return self._load(filename)
+
+
+    # Body of load_expenses; caller holds the write lock. A partitioned ledger (Arrow) is
+    # only opened here, its rows are loaded on demand by _ensure_loaded; full=True loads it all.
+    @timed(LEDGER_SECONDS, LEDGER_ERRORS, op="load")
+    def _load(self, filename: Optional[str] = None, full: bool = False) -> bool:
         try:
-            filename = filename or self.data_file
-            if os.path.exists(filename):
-                df = pd.read_csv(filename)
-                self.expenses = df.to_dict('records')
-                return True
+            storage = CSVStorage(filename) if filename else self.storage
+            if not filename:
+                # Taken before reading: a change that lands during the load triggers another sync
+                self._token = self.storage.change_token()
+            lazy = not filename and not full and self.storage.partitioned
+            df = pd.DataFrame(columns=EXPENSE_FRAME_COLUMNS) if lazy else storage.load()
+            self.columns = ExpenseColumns.from_frame(df)
+            self.aggregates = RunningAggregates.from_columns(self.columns)
+            self.index = LedgerIndex.from_columns(self.columns)
+            if lazy:
+                self.next_id = self.storage.max_id() + 1
             else:
-                # Create empty file if it doesn't exist
-                self.expenses = []
-                return True
-        except Exception as e:
-            print(f"Error loading expenses: {e}")
-            self.expenses = []
+                self.next_id = int(self.columns.view('ids').max()) + 1 if len(self.columns) else 1
+            self._months = set() if lazy else None
+            self._duplicate_keys = None
+            self._unsaved = 0
+            self._changed()
+            return True
+        except Exception:
+            logger.exception("Error loading expenses")
+            LEDGER_ERRORS.inc(op="load")
+            self.columns = ExpenseColumns()
+            self.aggregates = RunningAggregates()
+            self.index = LedgerIndex()
+            self.next_id = 1
+            self._months = None
+            self._duplicate_keys = None
+            self._unsaved = 0
+            self._changed()
             return False
+
+
+    # Load the months of a partitioned ledger that overlap start..end and are not loaded yet
+    # (the whole ledger when both are None); a no-op once everything is loaded. Partial loads
+    # extend the columns, date indexes and duplicate keys (a key includes the day, so the
+    # keys of the loaded months are complete for those months); the aggregates cover the
+    # whole ledger and are built by the full load. Needs the write lock, so it is called
+    # before a method takes the read lock (or inside a write section).
+    def _ensure_loaded(self, start: DateLike = None, end: DateLike = None):
+        if self._months is None:
+            return
+        if start is None and end is None:
+            with self._lock.write():
+                if self._months is not None:
+                    self._load(full=True)
+            return
+        first, last = (None if day is None else str(np.datetime64(day, 'D').astype('datetime64[M]'))
+                       for day in (to_day(start), to_day(end)))
+        wanted = [month for month in self.storage.months()
+                  if (first is None or month >= first) and (last is None or month <= last)]
+        if self._months.issuperset(wanted):
+            return
+        with self._lock.write():
+            if self._months is None:
+                return
+            missing = [month for month in wanted if month not in self._months]
+            df = self.storage.load_months(missing)
+            first_row = len(self.columns)
+            self.columns.extend_frame(df)
+            self.index.add_rows(self.columns, first_row)
+            if self._duplicate_keys is not None:
+                self._duplicate_keys.add_rows(self.columns, first_row)
+            self._months.update(missing)
+            self._changed()
     
 
-    # Return all expenses as a pandas DataFrame
+    # Return all expenses as a pandas DataFrame.
+    # The frame is built from the typed columns once per ledger version and then reused, so
+    # repeated calls (every Streamlit rerun) cost microseconds. Callers get a shallow copy
+    # and must treat it as read-only.
+    @timed(LEDGER_SECONDS, LEDGER_ERRORS, op="get_expenses_df")
     def get_expenses_df(self) -> pd.DataFrame:
-        if not self.expenses:
-            return pd.DataFrame(columns=['id', 'amount', 'date', 'vendor', 'category'])
+        self._ensure_loaded()
+        return self._frame()
+
+
+    # Body of get_expenses_df over the rows loaded so far
+    def _frame(self) -> pd.DataFrame:
+        if not len(self.columns):
+            return pd.DataFrame(columns=EXPENSE_FRAME_COLUMNS)
         
-        df = pd.DataFrame(self.expenses)
-        df['date'] = pd.to_datetime(df['date'])
-        return df
+        with self._lock.read():
+            cache = self._frame_cache
+            if cache is None or cache[0] != self.version:
+                cache = (self.version, self.columns.to_frame())
+                self._frame_cache = cache
+            return cache[1].copy(deep=False)
     
 
-    # Calculate total spending grouped by category
+    # Day x category x vendor rollup of the ledger for analytics (built once per version).
+    # With start/end it only has to cover that period, so a partitioned ledger loads just
+    # those months; slice the cube to the same period.
+    @timed(LEDGER_SECONDS, LEDGER_ERRORS, op="get_rollup")
+    def get_rollup(self, start: DateLike = None, end: DateLike = None) -> RollupCube:
+        self._ensure_loaded(start, end)
+        with self._lock.read():
+            cache = self._rollup_cache
+            if cache is None or cache[0] != self.version:
+                cache = (self.version, RollupCube.from_columns(self.columns))
+                self._rollup_cache = cache
+            return cache[1]
+    
+
+    # One-shot migration of an existing CSV ledger into a SQLite or Arrow backend
+    def migrate_from_csv(self, csv_path: str) -> int:
+        if not hasattr(self.storage, 'migrate_from_csv'):
+            raise ValueError("CSV migration needs a SQLite or Arrow data file (e.g. expenses.db, expenses.arrow)")
+        with self._lock.write(), self._file_lock:
+            migrated = self.storage.migrate_from_csv(csv_path)
+            if migrated:
+                self._load()
+        return migrated
+
+
+    # Calculate total spending grouped by category (from the running aggregates)
     def get_total_by_category(self) -> Dict[str, float]:
-        if not self.expenses:
-            return {}
-        
-        df = self.get_expenses_df()
-        return df.groupby('category')['amount'].sum().to_dict()
+        self._ensure_loaded()
+        with self._lock.read():
+            return {category: cents / 100 for category, (cents, _) in self.aggregates.by_category.items()}
+
+
+    # Total spending per month ("YYYY-MM"), oldest month first
+    def get_total_by_month(self) -> Dict[str, float]:
+        self._ensure_loaded()
+        with self._lock.read():
+            return {month: cents / 100 for month, (cents, _) in sorted(self.aggregates.by_month.items())}
 
 
-    # Get the most recent expenses (sorted by date)
+    # Total spending per vendor
+    def get_total_by_vendor(self) -> Dict[str, float]:
+        self._ensure_loaded()
+        with self._lock.read():
+            return {vendor: cents / 100 for vendor, (cents, _) in self.aggregates.by_vendor.items()}
+
+
+    # Number of expenses per category, month or vendor (group = "category" / "month" / "vendor")
+    def get_counts(self, group: str = "category") -> Dict[str, int]:
+        self._ensure_loaded()
+        with self._lock.read():
+            groups = getattr(self.aggregates, f"by_{group}")
+            return {key: count for key, (_, count) in groups.items()}
+
+
+    # Recompute the aggregates from the ledger and compare them with the running ones.
+    # Returns the differences found (empty list when consistent); repair=True replaces the
+    # running aggregates with the recomputed ones.
+    def check_consistency(self, repair: bool = False) -> List[str]:
+        self._ensure_loaded()
+        with self._lock.write():
+            fresh = RunningAggregates.from_columns(self.columns)
+            problems = self.aggregates.differences(fresh)
+            if problems:
+                logger.warning("Ledger aggregates out of sync (%d differences)", len(problems))
+                if repair:
+                    self.aggregates = fresh
+        return problems
+
+
+    # Get the most recent expenses (newest date first, latest added first on the same date)
     def get_recent_expenses(self, limit: int = 10) -> List[Dict]:
-        if not self.expenses:
-            return []
-        
-        # Sort by date (most recent first)
-        sorted_expenses = sorted(self.expenses, 
-                               key=lambda x: datetime.strptime(x['date'], "%Y-%m-%d"), 
-                               reverse=True)
-        return sorted_expenses[:limit]
+        return self.query(limit=limit)
+
+
+    # Expenses with start <= date <= end (either bound optional), optionally for one category
+    # and/or vendor, newest first. Answered from the date indexes with binary search, so the
+    # cost depends on the number of matching rows rather than the size of the ledger.
+    # offset/limit select one page of the result.
+    @timed(LEDGER_SECONDS, LEDGER_ERRORS, op="query")
+    def query(self, start: DateLike = None, end: DateLike = None, category: Optional[str] = None,
+              vendor: Optional[str] = None, limit: Optional[int] = None,
+              newest_first: bool = True, offset: int = 0) -> List[Dict]:
+        self._ensure_loaded(start, end)
+        with self._lock.read():
+            rows = self._query_rows(start, end, category, vendor, limit, newest_first, offset)
+            return [self.columns.row(i) for i in rows]
+
+
+    # Same as query(), as rows of the expenses DataFrame (see get_expenses_df)
+    def query_df(self, start: DateLike = None, end: DateLike = None, category: Optional[str] = None,
+                 vendor: Optional[str] = None, limit: Optional[int] = None,
+                 newest_first: bool = True, offset: int = 0) -> pd.DataFrame:
+        self._ensure_loaded(start, end)
+        with self._lock.read():
+            rows = self._query_rows(start, end, category, vendor, limit, newest_first, offset)
+            return self._frame().take(rows)
+
+
+    # Matching expenses in DataFrames of at most chunk_size rows, in the CSV layout (ISO date
+    # strings). Row positions are taken once up front; each chunk is built under a short read
+    # lock, so writers are not blocked for the whole export and only one chunk is in memory.
+    def iter_chunks(self, start: DateLike = None, end: DateLike = None, category: Optional[str] = None,
+                    vendor: Optional[str] = None, chunk_size: int = 50_000, newest_first: bool = True):
+        self._ensure_loaded(start, end)
+        with self._lock.read():
+            # The columns are append-only, so these positions stay valid while we iterate
+            columns = self.columns
+            rows = self._query_rows(start, end, category, vendor, None, newest_first)
+        # An empty result still yields one (empty) chunk so writers can emit headers/schema
+        for first in range(0, max(1, len(rows)), chunk_size):
+            with self._lock.read():
+                chunk = columns.take_frame(rows[first:first + chunk_size])
+            chunk['date'] = chunk['date'].dt.strftime('%Y-%m-%d')
+            yield chunk
+
+
+    # Number of recorded expenses with the same vendor (ignoring case), date and amount, so a
+    # form can warn before saving a probable double entry. O(1) after a one-off key build.
+    def count_duplicates(self, amount: float, date_str: str, vendor: str) -> int:
+        try:
+            expense_date = datetime.strptime(date_str, "%Y-%m-%d").date()
+        except ValueError:
+            return 0
+        day = int(np.datetime64(expense_date, 'D').astype(np.int64))
+        self._ensure_loaded(expense_date, expense_date)
+        with self._lock.read():
+            return self._duplicate_index().count(duplicate_key(vendor, day, int(round(float(amount) * 100))))
+
+
+    # Which rows of a DataFrame (amount, date "YYYY-MM-DD", vendor) match a recorded expense's
+    # vendor, date and amount, e.g. a statement about to be imported again. Vectorized;
+    # rows with an invalid date or amount never match.
+    def find_duplicates(self, expenses: pd.DataFrame) -> np.ndarray:
+        days = pd.to_datetime(expenses['date'].astype(str).str.strip(), format="%Y-%m-%d", errors='coerce')
+        amounts = pd.to_numeric(expenses['amount'], errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+        valid = (days.notna().to_numpy() & np.isfinite(amounts))
+        found = np.zeros(len(expenses), dtype=bool)
+        if not valid.any():
+            return found
+        vendor_codes, vendor_names = pd.factorize(expenses['vendor'].fillna('').astype(str)[valid])
+        keys = duplicate_keys_of(vendor_names, days[valid].to_numpy().astype('datetime64[D]').astype(np.int64),
+                                 to_cents(amounts[valid]), codes=vendor_codes)
+        self._ensure_loaded(days[valid].min(), days[valid].max())
+        with self._lock.read():
+            found[valid] = self._duplicate_index().count_many(keys) > 0
+        return found
+
+
+    # Number of expenses query() would return without a limit
+    def count_matching(self, start: DateLike = None, end: DateLike = None, category: Optional[str] = None,
+                       vendor: Optional[str] = None) -> int:
+        self._ensure_loaded(start, end)
+        with self._lock.read():
+            return self.index.count(to_day(start), to_day(end), *self._codes(category, vendor))
+
+
+    # One page of matching expenses sorted by "date", "amount", "vendor" or "category"
+    # (ties newest first), plus the number of matching expenses. Date order comes straight
+    # from the index, so a page costs O(log n + page size); other orders only partially sort
+    # the k matching rows (argpartition), O(k) instead of a full sort.
+    @timed(LEDGER_SECONDS, LEDGER_ERRORS, op="query_page")
+    def query_page(self, start: DateLike = None, end: DateLike = None, category: Optional[str] = None,
+                   vendor: Optional[str] = None, sort_by: str = "date", descending: bool = True,
+                   offset: int = 0, limit: int = 50) -> Tuple[pd.DataFrame, int]:
+        self._ensure_loaded(start, end)
+        with self._lock.read():
+            total = self.index.count(to_day(start), to_day(end), *self._codes(category, vendor))
+            if sort_by == "date":
+                rows = self._query_rows(start, end, category, vendor, limit, descending, offset)
+                return self.columns.take_frame(rows), total
+
+            rows = self._query_rows(start, end, category, vendor, None, True, 0)
+            keys = self._sort_keys(sort_by, rows)
+            if descending:
+                keys = -keys
+            end_position = min(len(rows), offset + limit)
+            if end_position <= offset:
+                return self.columns.take_frame([]), total
+            if end_position < len(rows):
+                # Everything below the end_position-th key, then the earliest ties; rows are
+                # newest first, so a stable sort keeps newest first within ties
+                kth = np.partition(keys, end_position - 1)[end_position - 1]
+                below = np.flatnonzero(keys < kth)
+                ties = np.flatnonzero(keys == kth)[:end_position - len(below)]
+                candidates = np.sort(np.concatenate([below, ties]))
+            else:
+                candidates = np.arange(len(rows))
+            ordered = candidates[np.argsort(keys[candidates], kind='stable')]
+            return self.columns.take_frame(rows[ordered[offset:end_position]]), total
+
+
+    # Probable-duplicate keys of the ledger, built from the columns on first use and then kept
+    # up to date by every add and partial load; reset when the ledger is reloaded. Covers the
+    # loaded months of a partially loaded ledger, which is all a lookup for those days needs.
+    def _duplicate_index(self) -> DuplicateKeys:
+        duplicate_keys = self._duplicate_keys
+        if duplicate_keys is None:
+            duplicate_keys = DuplicateKeys.from_columns(self.columns)
+            self._duplicate_keys = duplicate_keys
+        return duplicate_keys
+
+
+    # Reserve `count` consecutive IDs and return the first
+    def _allocate_ids(self, count: int) -> int:
+        first_id = self.next_id
+        self.next_id += count
+        return first_id
+
+
+    # Fill empty categories from the vendor name, classifying each distinct vendor once
+    def _categorize_vendors(self, vendors: pd.Series, categories: pd.Series) -> pd.Series:
+        missing = categories == ''
+        if not missing.any():
+            return categories
+        if self._keyword_classifier is None:
+            from category_classifier import KeywordClassifier
+            self._keyword_classifier = KeywordClassifier()
+        classifier = self._keyword_classifier
+        codes, uniques = pd.factorize(vendors[missing])
+        labels = np.array([classifier.classify(vendor)[0] or '' for vendor in uniques], dtype=object)
+        categories = categories.copy()
+        categories[missing] = labels[codes] if len(labels) else ''
+        return categories
+
+
+    def _query_rows(self, start, end, category, vendor, limit, newest_first, offset=0) -> np.ndarray:
+        return self.index.rows(to_day(start), to_day(end), *self._codes(category, vendor),
+                               limit, newest_first, offset)
+
+
+    def _codes(self, category: Optional[str], vendor: Optional[str]) -> Tuple[Optional[int], Optional[int]]:
+        return (self.columns.category_code(category) if category is not None else None,
+                self.columns.vendor_code(vendor) if vendor is not None else None)
+
+
+    # Numeric sort keys for the given rows; vendor/category sort by name (rank of the name)
+    def _sort_keys(self, sort_by: str, rows: np.ndarray) -> np.ndarray:
+        if sort_by == "amount":
+            return self.columns.view('cents')[rows]
+        if sort_by in ("vendor", "category"):
+            names = self.columns.vendors if sort_by == "vendor" else self.columns.categories
+            ranks = np.empty(len(names), dtype=np.int64)
+            ranks[np.argsort(np.array(names, dtype=object), kind='stable')] = np.arange(len(names))
+            return ranks[self.columns.view(f'{sort_by}_codes')[rows]]
+        raise ValueError(f"Cannot sort expenses by {sort_by!r}")
     
 
     # Calculate the total amount of all expenses
     def get_total_spending(self) -> float:
-        return sum(expense['amount'] for expense in self.expenses)
+        self._ensure_loaded()
+        with self._lock.read():
+            return self.aggregates.total_cents / 100
     
 
     # Get a list of all unique categories used in expenses
     def get_categories(self) -> List[str]:
-        return list(set(expense['category'] for expense in self.expenses))
+        if self._months is not None:
+            return self.storage.categories()
+        with self._lock.read():
+            return list(self.aggregates.by_category)
     
 
 # Default categories for the application
@@ -0,0 +1,164 @@
+import re
+from datetime import datetime
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+from metrics import get_metrics
+
+# dateparser calls are timed separately: they can dominate the date stage
+DATEPARSER_SECONDS = get_metrics().histogram(
+    "receipt_stage_seconds", "Time spent per receipt processing stage", labels=["stage"])
+
+# ---------------- PRECOMPILED PATTERNS ----------------
+# Known date layouts: (pattern, strptime formats tried in order). Separators are normalized
+# to "/" before parsing. Month-first comes before day-first (dateparser's default), except
+# for dotted dates, which are written day first.
+DATE_PATTERNS = [
+    (re.compile(r"\b\d{4}[-/.]\d{1,2}[-/.]\d{1,2}\b"), ["%Y/%m/%d"]),                    # 2020-12-31
+    (re.compile(r"\b\d{1,2}\.\d{1,2}\.\d{2}(?:\d{2})?\b"), ["%d/%m/%Y", "%d/%m/%y"]),     # 31.12.2020 (dotted = day first)
+    (re.compile(r"\b\d{1,2}[-/]\d{1,2}[-/]\d{4}\b"), ["%m/%d/%Y", "%d/%m/%Y"]),          # 12/31/2020
+    (re.compile(r"\b\d{1,2}[-/]\d{1,2}[-/]\d{2}\b"), ["%m/%d/%y", "%d/%m/%y"]),          # 31-12-20
+    (re.compile(r"\b\d{1,2}[-/]\d{1,2}\s\d{4}\b"), ["%m/%d %Y", "%d/%m %Y"]),             # 11-30 2020 (with space)
+    (re.compile(r"\b[A-Za-z]{3,9}\.?\s\d{1,2},?\s\d{4}\b"), ["%b %d %Y", "%B %d %Y"]),    # Dec 31, 2020
+    (re.compile(r"\b\d{1,2}\s[A-Za-z]{3,9}\.?,?\s\d{4}\b"), ["%d %b %Y", "%d %B %Y"]),    # 31 Dec 2020
+]
+DATE_SEPARATORS = re.compile(r"[-.]")
+DATE_PUNCTUATION = re.compile(r"[.,]")
+
+# Money amounts with two decimals, US (1,234.56) or EU (1.234,56 / 1 234,56) grouping
+# (the look-arounds keep dates such as 31.12.2020 from being read as amounts)
+AMOUNT_RE = re.compile(r"(?<![\d.,])\d{1,3}(?:[ ,.]?\d{3})*[.,]\d{2}(?![.,]?\d)")
+
+# Keywords that label the amount paid, strongest first
+TOTAL_KEYWORDS = [
+    re.compile(r"\b(grand\s*total|amount\s*due|balance\s*due|total\s*due|total\s*to\s*pay)\b", re.I),
+    re.compile(r"\b(total|totaal|summe|montant|totale|importe)\b", re.I),
+    re.compile(r"\b(amount|due|balance)\b", re.I),
+]
+# Lines that mention a total but are not the final amount
+NOT_TOTAL_RE = re.compile(r"\b(sub\s*-?\s*total|subtotal|tax|vat|tip|change|savings|discount|items?)\b", re.I)
+
+# Lines in the header that are unlikely to be the merchant name
+NOT_MERCHANT_RE = re.compile(
+    r"(\b(receipt|invoice|welcome|thank|tel|phone|fax|www\.|http|street|st\.|road|rd\.|ave|avenue|"
+    r"suite|vat\s*no|tax\s*id|cashier|order|table|date|time)\b|@|\d{3}[-.\s]\d{3,4})", re.I)
+LETTER_RE = re.compile(r"[A-Za-z]")
+
+# Share of the receipt height, from the top, searched for the merchant name
+MERCHANT_REGION = 0.25
+
+
+# Parse a date string with dateparser (slow, imported on first use), memoized per string
+@lru_cache(maxsize=4096)
+def parse_date_fallback(text: str) -> Optional[str]:
+    try:
+        import dateparser
+    except ImportError:
+        return None
+    with DATEPARSER_SECONDS.time(stage="dateparser"):
+        parsed = dateparser.parse(text)
+    return parsed.strftime("%Y-%m-%d") if parsed else None
+
+
+# Parse a date found by one of DATE_PATTERNS with strptime; None if no format fits
+def parse_known_date(text: str, formats: List[str]) -> Optional[str]:
+    if LETTER_RE.search(text):
+        normalized = DATE_PUNCTUATION.sub("", text)      # "Dec. 31, 2020" -> "Dec 31 2020"
+    else:
+        normalized = DATE_SEPARATORS.sub("/", text)      # "31.12.2020" -> "31/12/2020"
+    for fmt in formats:
+        try:
+            return datetime.strptime(normalized, fmt).strftime("%Y-%m-%d")
+        except ValueError:
+            continue
+    return None
+
+
+# Normalize a matched amount to "1234.56": the last separator is the decimal point
+def normalize_amount(raw: str) -> str:
+    digits = raw.replace(" ", "")
+    integer, decimals = digits[:-3], digits[-2:]
+    return re.sub(r"[.,]", "", integer) + "." + decimals
+
+
+# Field extraction from EasyOCR readtext output, using the bounding boxes to find lines
+class FieldExtractor:
+
+    # Return {"Date", "Place", "Total", "Text"} for a list of (box, text, confidence)
+    def extract(self, results) -> Dict[str, str]:
+        text = " ".join(res[1] for res in results)
+        lines = self.group_lines(results)
+        return {
+            "Date": self.find_date(text),
+            "Place": self.find_merchant(lines, results),
+            "Total": self.find_total(lines, text),
+            "Text": text
+        }
+
+
+    # Group boxes into text lines: boxes whose vertical spans overlap by at least half of
+    # the smaller box belong to the same line. Returns [(y_center, line_text)] top to bottom.
+    def group_lines(self, results) -> List[Tuple[float, str]]:
+        boxes = []
+        for box, text, _ in results:
+            ys = [point[1] for point in box]
+            xs = [point[0] for point in box]
+            boxes.append((min(ys), max(ys), min(xs), text))
+        boxes.sort(key=lambda b: (b[0] + b[1]) / 2)
+
+        lines = []   # [top, bottom, [(x, text), ...]]
+        for top, bottom, left, text in boxes:
+            if lines:
+                line = lines[-1]
+                overlap = min(bottom, line[1]) - max(top, line[0])
+                if overlap >= 0.5 * min(bottom - top, line[1] - line[0]):
+                    line[0], line[1] = min(top, line[0]), max(bottom, line[1])
+                    line[2].append((left, text))
+                    continue
+            lines.append([top, bottom, [(left, text)]])
+
+        return [((top + bottom) / 2, " ".join(t for _, t in sorted(words)))
+                for top, bottom, words in lines]
+
+
+    # First date in the text: precompiled patterns + strptime, dateparser only as a fallback
+    def find_date(self, text: str) -> str:
+        for pattern, formats in DATE_PATTERNS:
+            match = pattern.search(text)
+            if match:
+                found = match.group()
+                return parse_known_date(found, formats) or parse_date_fallback(found) or found
+        return "Unknown"
+
+
+    # Amount on the line labelled TOTAL / AMOUNT DUE (strongest keyword wins, lowest line
+    # breaks ties); falls back to the line below the label, then to the last amount
+    def find_total(self, lines: List[Tuple[float, str]], text: str) -> str:
+        for keyword in TOTAL_KEYWORDS:
+            for i in range(len(lines) - 1, -1, -1):
+                line = lines[i][1]
+                if not keyword.search(line) or NOT_TOTAL_RE.search(line):
+                    continue
+                amounts = AMOUNT_RE.findall(line)
+                if not amounts and i + 1 < len(lines):
+                    amounts = AMOUNT_RE.findall(lines[i + 1][1])
+                if amounts:
+                    return normalize_amount(amounts[-1])
+
+        amounts = AMOUNT_RE.findall(text)
+        return normalize_amount(amounts[-1]) if amounts else "Unknown"
+
+
+    # Merchant name: first plausible line in the top region of the receipt
+    def find_merchant(self, lines: List[Tuple[float, str]], results) -> str:
+        if not lines:
+            return "Unknown"
+        top, bottom = lines[0][0], lines[-1][0]
+        limit = top + MERCHANT_REGION * (bottom - top)
+        for y, line in lines[:6]:
+            if y > limit and y != top:
+                break
+            letters = len(LETTER_RE.findall(line))
+            if letters >= 3 and letters >= 0.5 * len(line.replace(" ", "")) and not NOT_MERCHANT_RE.search(line):
+                return line.strip()
+        return results[0][1]
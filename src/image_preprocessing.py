@@ -0,0 +1,179 @@
+import io
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image, ImageOps
+
+# Order in which the preprocessing steps are applied
+PREPROCESS_STEPS = ("downscale", "grayscale", "binarize", "deskew")
+
+
+# Configurable in-memory preprocessing applied to receipt images before OCR.
+# Works on the uploaded bytes directly and returns a NumPy array for readtext.
+class ImagePreprocessor:
+
+    # Initialize preprocessing settings
+    #   target_dpi  - images with a higher recorded DPI are scaled down to this resolution
+    #   max_side    - longest side in pixels after scaling (phone photos rarely record DPI)
+    #   block_size  - neighbourhood size for adaptive thresholding (odd number of pixels)
+    #   offset      - constant subtracted from the local mean when thresholding
+    #   max_skew    - rotations larger than this many degrees are not corrected
+    def __init__(self, target_dpi: int = 200, max_side: int = 1600, grayscale: bool = True,
+                 binarize: bool = True, deskew: bool = True, block_size: int = 31,
+                 offset: int = 15, max_skew: float = 15.0):
+        self.target_dpi = target_dpi
+        self.max_side = max_side
+        self.grayscale = grayscale
+        self.binarize = binarize
+        self.deskew = deskew
+        self.block_size = block_size
+        self.offset = offset
+        self.max_skew = max_skew
+
+
+    # Settings that change the pixels handed to OCR (part of the OCR cache key)
+    def config_key(self) -> str:
+        return (f"dpi={self.target_dpi},side={self.max_side},gray={int(self.grayscale)},"
+                f"bin={int(self.binarize)}:{self.block_size}:{self.offset},"
+                f"deskew={int(self.deskew)}:{self.max_skew}")
+
+
+    # Preprocess image bytes with the configured steps
+    def __call__(self, image_bytes: bytes) -> np.ndarray:
+        return self.run(image_bytes)[0]
+
+
+    # Preprocess image bytes and return (array, seconds spent per step).
+    # steps overrides the configured set of steps (used when measuring their effect).
+    def run(self, image_bytes: bytes, steps: Optional[Sequence[str]] = None) -> Tuple[np.ndarray, Dict[str, float]]:
+        if steps is None:
+            steps = self.enabled_steps()
+        timings = {}
+
+        start = time.perf_counter()
+        image, dpi = self.decode(image_bytes)
+        timings["decode"] = time.perf_counter() - start
+
+        if "downscale" in steps:
+            start = time.perf_counter()
+            image = self.downscale(image, dpi)
+            timings["downscale"] = time.perf_counter() - start
+
+        # Thresholding and deskew need a single channel
+        if "grayscale" in steps or "binarize" in steps or "deskew" in steps:
+            start = time.perf_counter()
+            image = self.to_grayscale(image)
+            timings["grayscale"] = time.perf_counter() - start
+
+        if "binarize" in steps:
+            start = time.perf_counter()
+            image = self.threshold(image)
+            timings["binarize"] = time.perf_counter() - start
+
+        if "deskew" in steps:
+            start = time.perf_counter()
+            image = self.straighten(image)
+            timings["deskew"] = time.perf_counter() - start
+
+        return image, timings
+
+
+    # Names of the steps switched on in this configuration
+    def enabled_steps(self) -> List[str]:
+        flags = {"downscale": True, "grayscale": self.grayscale,
+                 "binarize": self.binarize, "deskew": self.deskew}
+        return [step for step in PREPROCESS_STEPS if flags[step]]
+
+
+    # ---------------- INDIVIDUAL STEPS ----------------
+    # Decode bytes into an RGB array, honouring the EXIF orientation of phone photos
+    def decode(self, image_bytes: bytes) -> Tuple[np.ndarray, Optional[float]]:
+        with Image.open(io.BytesIO(image_bytes)) as img:
+            dpi = img.info.get("dpi")
+            img = ImageOps.exif_transpose(img).convert("RGB")
+            return np.asarray(img), (float(dpi[0]) if dpi and dpi[0] else None)
+
+
+    # Scale down to target_dpi (when the DPI is known) and to at most max_side pixels
+    def downscale(self, image: np.ndarray, dpi: Optional[float] = None) -> np.ndarray:
+        height, width = image.shape[:2]
+        scale = 1.0
+        if dpi and dpi > self.target_dpi:
+            scale = self.target_dpi / dpi
+        if self.max_side and max(height, width) * scale > self.max_side:
+            scale = self.max_side / max(height, width)
+        if scale >= 1.0:
+            return image
+        size = (max(1, int(width * scale)), max(1, int(height * scale)))
+        return cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+
+
+    def to_grayscale(self, image: np.ndarray) -> np.ndarray:
+        if image.ndim == 2:
+            return image
+        return cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+
+
+    # Adaptive (local mean) threshold: copes with shadows and uneven lighting in photos
+    def threshold(self, gray: np.ndarray) -> np.ndarray:
+        block_size = self.block_size if self.block_size % 2 else self.block_size + 1
+        return cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_MEAN_C,
+                                     cv2.THRESH_BINARY, block_size, self.offset)
+
+
+    # Rotate the image so that text lines are horizontal
+    def straighten(self, gray: np.ndarray) -> np.ndarray:
+        angle = self.estimate_skew(gray)
+        if angle is None or abs(angle) < 0.5 or abs(angle) > self.max_skew:
+            return gray
+        height, width = gray.shape[:2]
+        matrix = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1.0)
+        return cv2.warpAffine(gray, matrix, (width, height), flags=cv2.INTER_LINEAR,
+                              borderMode=cv2.BORDER_CONSTANT, borderValue=255)
+
+
+    # Skew angle in degrees from the minimum-area rectangle around the dark (ink) pixels
+    def estimate_skew(self, gray: np.ndarray) -> Optional[float]:
+        _, ink = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+        coords = cv2.findNonZero(ink)
+        if coords is None or len(coords) < 50:
+            return None
+        (_, _), (rect_w, rect_h), angle = cv2.minAreaRect(coords)
+        # OpenCV reports the angle of the rectangle side nearest horizontal in (-90, 90];
+        # fold it into (-45, 45] so we rotate by the smallest correction
+        if angle > 45:
+            angle -= 90
+        elif angle < -45:
+            angle += 90
+        return angle
+
+
+# Measure how much each preprocessing step reduces OCR time on one image.
+# Steps are switched on cumulatively (raw, +downscale, +grayscale, ...) and readtext is timed
+# for every stage; "saved_seconds" is the OCR time saved relative to the previous stage.
+def measure_ocr_gains(readtext: Callable, image_bytes: bytes,
+                      preprocessor: Optional[ImagePreprocessor] = None, repeats: int = 1) -> List[Dict]:
+    preprocessor = preprocessor or ImagePreprocessor()
+    report = []
+    previous = None
+    steps = preprocessor.enabled_steps()
+    for count in range(len(steps) + 1):
+        active = steps[:count]
+        image, timings = preprocessor.run(image_bytes, steps=active)
+        ocr_times = []
+        for _ in range(max(1, repeats)):
+            start = time.perf_counter()
+            readtext(image)
+            ocr_times.append(time.perf_counter() - start)
+        ocr_seconds = min(ocr_times)
+        report.append({
+            "step": active[-1] if active else "raw",
+            "shape": tuple(image.shape),
+            "preprocess_seconds": sum(timings.values()),
+            "ocr_seconds": ocr_seconds,
+            "saved_seconds": (previous - ocr_seconds) if previous is not None else 0.0
+        })
+        previous = ocr_seconds
+    return report
@@ -0,0 +1,178 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import Dict, List, Optional
+
+# Job states
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+
+# One uploaded receipt waiting for, or finished with, OCR
+class ReceiptJob:
+
+    def __init__(self, session_id: str, name: str, image_bytes: bytes):
+        self.id = uuid.uuid4().hex
+        self.session_id = session_id
+        self.name = name
+        self.image_bytes = image_bytes
+        self.status = JOB_QUEUED
+        self.result = None          # one-row DataFrame from ReceiptOCR.process_receipt
+        self.error = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+
+    # Seconds spent waiting + processing so far
+    def elapsed(self) -> float:
+        return (self.finished_at or time.time()) - self.submitted_at
+
+
+# Background receipt processing owned by the server process.
+# Sessions submit uploads as jobs and poll their status; a small pool of worker threads runs
+# ReceiptOCR.process_receipt. Each session has its own FIFO and workers take turns between
+# sessions (round robin), so one user uploading fifty receipts does not starve the others.
+# Finished jobs are kept until the session discards them (after confirming the expense) or
+# until result_ttl seconds have passed.
+class ReceiptJobQueue:
+
+    def __init__(self, ocr, workers: int = 2, max_pending_per_session: int = 50,
+                 result_ttl: float = 24 * 3600):
+        self.ocr = ocr
+        self.max_pending_per_session = max_pending_per_session
+        self.result_ttl = result_ttl
+        self._jobs: Dict[str, ReceiptJob] = {}
+        self._waiting: "OrderedDict[str, deque]" = OrderedDict()   # session -> queued jobs
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._threads = [
+            threading.Thread(target=self._work, name=f"receipt-worker-{i}", daemon=True)
+            for i in range(max(1, workers))
+        ]
+        for thread in self._threads:
+            thread.start()
+
+
+    # Queue a receipt for processing and return its job ID
+    def submit(self, session_id: str, name: str, image_bytes: bytes) -> str:
+        job = ReceiptJob(session_id, name, image_bytes)
+        with self._cond:
+            self._expire()
+            waiting = self._waiting.setdefault(session_id, deque())
+            if len(waiting) >= self.max_pending_per_session:
+                raise RuntimeError(f"Too many receipts waiting ({len(waiting)}); please wait for some to finish")
+            waiting.append(job)
+            self._jobs[job.id] = job
+            self._cond.notify()
+        return job.id
+
+
+    def get(self, job_id: str) -> Optional[ReceiptJob]:
+        with self._cond:
+            return self._jobs.get(job_id)
+
+
+    # All jobs of a session, oldest first
+    def jobs_for(self, session_id: str) -> List[ReceiptJob]:
+        with self._cond:
+            jobs = [job for job in self._jobs.values() if job.session_id == session_id]
+        return sorted(jobs, key=lambda job: job.submitted_at)
+
+
+    # Forget a job (its expense was saved or the user dismissed it); queued jobs are cancelled
+    def discard(self, job_id: str):
+        with self._cond:
+            job = self._jobs.pop(job_id, None)
+            if job is not None and job.status == JOB_QUEUED:
+                waiting = self._waiting.get(job.session_id)
+                if waiting is not None and job in waiting:
+                    waiting.remove(job)
+
+
+    # Put a failed job back in its session's queue
+    def retry(self, job_id: str) -> bool:
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None or job.status != JOB_FAILED:
+                return False
+            job.status, job.error, job.result = JOB_QUEUED, None, None
+            job.started_at = job.finished_at = None
+            self._waiting.setdefault(job.session_id, deque()).append(job)
+            self._cond.notify()
+            return True
+
+
+    # Number of jobs per state across all sessions
+    def stats(self) -> Dict[str, int]:
+        with self._cond:
+            counts = {JOB_QUEUED: 0, JOB_RUNNING: 0, JOB_DONE: 0, JOB_FAILED: 0}
+            for job in self._jobs.values():
+                counts[job.status] += 1
+            return counts
+
+
+    # Stop the worker threads (queued jobs are left unprocessed)
+    def shutdown(self, wait: bool = True):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+
+    # ---------------- WORKERS ----------------
+    # Next job in round-robin order over sessions; caller holds the condition lock
+    def _next_job(self) -> Optional[ReceiptJob]:
+        while self._waiting:
+            session_id, waiting = next(iter(self._waiting.items()))
+            if not waiting:
+                del self._waiting[session_id]
+                continue
+            job = waiting.popleft()
+            # The session goes to the back of the line whether or not it has more work
+            self._waiting.move_to_end(session_id)
+            if not waiting:
+                del self._waiting[session_id]
+            return job
+        return None
+
+
+    def _work(self):
+        while True:
+            with self._cond:
+                # Check for shutdown before taking a job, so a stopped queue keeps its jobs queued
+                job = None
+                while not self._stopped:
+                    job = self._next_job()
+                    if job is not None:
+                        break
+                    self._cond.wait()
+                if job is None:
+                    return
+                job.status = JOB_RUNNING
+                job.started_at = time.time()
+
+            try:
+                result = self.ocr.process_receipt(job.image_bytes, source=job.name)
+                error = None if not result.empty else "No data could be extracted from this image"
+            except Exception as e:
+                result, error = None, str(e)
+
+            with self._cond:
+                job.result = result
+                job.error = error
+                job.status = JOB_FAILED if error else JOB_DONE
+                job.finished_at = time.time()
+
+
+    # Drop finished jobs nobody collected; caller holds the condition lock
+    def _expire(self):
+        cutoff = time.time() - self.result_ttl
+        for job_id, job in list(self._jobs.items()):
+            if job.finished_at is not None and job.finished_at < cutoff:
+                del self._jobs[job_id]
@@ -0,0 +1,102 @@
+from datetime import date
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from ledger_columns import ExpenseColumns
+
+
+# Running totals of the ledger, kept up to date on every change so the dashboard never has
+# to scan the expenses: grand total and count, plus (cents, count) per category, per month
+# ("YYYY-MM") and per vendor. add()/remove() are O(1); an edit is a remove plus an add.
+class RunningAggregates:
+
+    def __init__(self):
+        self.total_cents = 0
+        self.count = 0
+        self.by_category: Dict[str, List[int]] = {}
+        self.by_month: Dict[str, List[int]] = {}
+        self.by_vendor: Dict[str, List[int]] = {}
+
+
+    # Recompute everything from the ledger columns (vectorized; used on load and for checks)
+    @classmethod
+    def from_columns(cls, columns: ExpenseColumns) -> "RunningAggregates":
+        aggregates = cls()
+        if not len(columns):
+            return aggregates
+        cents = columns.view('cents')
+        aggregates.total_cents = int(cents.sum())
+        aggregates.count = len(columns)
+        aggregates.by_category = _group(columns.view('category_codes'), columns.categories, cents)
+        aggregates.by_vendor = _group(columns.view('vendor_codes'), columns.vendors, cents)
+        months, month_codes = np.unique(columns.view('days').astype('datetime64[M]'), return_inverse=True)
+        aggregates.by_month = _group(month_codes, [str(month) for month in months], cents)
+        return aggregates
+
+
+    # Account for the rows from first_row on (a bulk add): grouped with bincount, then merged
+    # into the existing totals, so the cost follows the number of new rows
+    def add_rows(self, columns: ExpenseColumns, first_row: int):
+        cents = columns.view('cents')[first_row:]
+        if not len(cents):
+            return
+        self.total_cents += int(cents.sum())
+        self.count += len(cents)
+        months, month_codes = np.unique(columns.view('days')[first_row:].astype('datetime64[M]'), return_inverse=True)
+        for groups, new in (
+            (self.by_category, _group(columns.view('category_codes')[first_row:], columns.categories, cents)),
+            (self.by_vendor, _group(columns.view('vendor_codes')[first_row:], columns.vendors, cents)),
+            (self.by_month, _group(month_codes, [str(month) for month in months], cents)),
+        ):
+            for key, (group_cents, group_count) in new.items():
+                entry = groups.setdefault(key, [0, 0])
+                entry[0] += group_cents
+                entry[1] += group_count
+
+
+    # Account for one new expense
+    def add(self, cents: int, day: date, vendor: str, category: str):
+        self.total_cents += cents
+        self.count += 1
+        for groups, key in self._keys(day, vendor, category):
+            entry = groups.setdefault(key, [0, 0])
+            entry[0] += cents
+            entry[1] += 1
+
+
+    # Account for a deleted expense (or the old side of an edit)
+    def remove(self, cents: int, day: date, vendor: str, category: str):
+        self.total_cents -= cents
+        self.count -= 1
+        for groups, key in self._keys(day, vendor, category):
+            entry = groups[key]
+            entry[0] -= cents
+            entry[1] -= 1
+            if entry[1] == 0:
+                del groups[key]
+
+
+    # Differences against another set of aggregates, as readable strings (empty when equal)
+    def differences(self, other: "RunningAggregates") -> List[str]:
+        problems = []
+        if (self.total_cents, self.count) != (other.total_cents, other.count):
+            problems.append(f"total/count {self.total_cents}/{self.count} != {other.total_cents}/{other.count}")
+        for name in ('by_category', 'by_month', 'by_vendor'):
+            mine, theirs = getattr(self, name), getattr(other, name)
+            for key in sorted(set(mine) | set(theirs)):
+                if mine.get(key) != theirs.get(key):
+                    problems.append(f"{name}[{key!r}] {mine.get(key)} != {theirs.get(key)}")
+        return problems
+
+
+    # The month comes from the parsed date, so it matches the "YYYY-MM" keys of from_columns
+    def _keys(self, day: date, vendor: str, category: str) -> Tuple:
+        return ((self.by_category, category), (self.by_month, day.strftime("%Y-%m")), (self.by_vendor, vendor))
+
+
+# {name: [cents, count]} for the codes that occur
+def _group(codes: np.ndarray, names: List[str], cents: np.ndarray) -> Dict[str, List[int]]:
+    sums = np.bincount(codes, weights=cents, minlength=len(names))
+    counts = np.bincount(codes, minlength=len(names))
+    return {names[i]: [int(sums[i]), int(counts[i])] for i in np.flatnonzero(counts)}
@@ -0,0 +1,190 @@
+import logging
+import sys
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+EXPENSE_FRAME_COLUMNS = ['id', 'amount', 'date', 'vendor', 'category']
+
+
+# Columnar, typed in-memory ledger used by ExpenseTracker.
+#   ids            int64
+#   cents          int64 amounts in integer cents (no float drift in sums)
+#   days           datetime64[D]
+#   vendor_codes   int32 codes into self.vendors
+#   category_codes int32 codes into self.categories
+# Arrays are over-allocated and doubled when full, so append() is amortized O(1) and
+# updates the columns in place.
+class ExpenseColumns:
+
+    def __init__(self, capacity: int = 1024):
+        capacity = max(1, capacity)
+        self.size = 0
+        self.ids = np.zeros(capacity, dtype=np.int64)
+        self.cents = np.zeros(capacity, dtype=np.int64)
+        self.days = np.zeros(capacity, dtype='datetime64[D]')
+        self.vendor_codes = np.zeros(capacity, dtype=np.int32)
+        self.category_codes = np.zeros(capacity, dtype=np.int32)
+        self.vendors: List[str] = []
+        self.categories: List[str] = []
+        self._vendor_index: Dict[str, int] = {}
+        self._category_index: Dict[str, int] = {}
+
+
+    def __len__(self) -> int:
+        return self.size
+
+
+    # Build columns from a ledger DataFrame (id, amount, date, vendor, category) in one pass
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame) -> "ExpenseColumns":
+        columns = cls(capacity=max(1024, 2 * len(df)))
+        columns.extend_frame(df)
+        return columns
+
+
+    # Append the rows of a ledger DataFrame (id, amount, date, vendor, category)
+    def extend_frame(self, df: pd.DataFrame):
+        if df.empty:
+            return
+        days = pd.to_datetime(df['date'], errors='coerce')
+        if days.isna().any():
+            logger.warning("%d expenses have an invalid date", int(days.isna().sum()))
+        self.extend(
+            ids=df['id'].to_numpy(dtype=np.int64),
+            cents=to_cents(df['amount'].to_numpy(dtype=np.float64)),
+            days=days.to_numpy().astype('datetime64[D]'),
+            vendors=df['vendor'].fillna('').astype(str).str.strip(),
+            categories=df['category'].fillna('').astype(str).str.strip()
+        )
+
+
+    # Append one expense; returns its row position
+    def append(self, expense_id: int, cents: int, day: np.datetime64, vendor: str, category: str) -> int:
+        if self.size == len(self.ids):
+            self._grow(2 * len(self.ids))
+        row = self.size
+        self.ids[row] = expense_id
+        self.cents[row] = cents
+        self.days[row] = day
+        self.vendor_codes[row] = self._code(vendor, self.vendors, self._vendor_index)
+        self.category_codes[row] = self._code(category, self.categories, self._category_index)
+        self.size += 1
+        return row
+
+
+    # Append many rows at once (vectorized); vendors/categories are encoded with factorize
+    def extend(self, ids, cents, days, vendors, categories):
+        count = len(ids)
+        if self.size + count > len(self.ids):
+            self._grow(max(2 * len(self.ids), self.size + count))
+        end = self.size + count
+        self.ids[self.size:end] = ids
+        self.cents[self.size:end] = cents
+        self.days[self.size:end] = days
+        self.vendor_codes[self.size:end] = self._codes(vendors, self.vendors, self._vendor_index)
+        self.category_codes[self.size:end] = self._codes(categories, self.categories, self._category_index)
+        self.size = end
+
+
+    # Code of a vendor / category name, -1 when it does not occur in the ledger
+    def vendor_code(self, vendor: str) -> int:
+        return self._vendor_index.get(vendor, -1)
+
+
+    def category_code(self, category: str) -> int:
+        return self._category_index.get(category, -1)
+
+
+    # Read-only view of a column (only the filled part)
+    def view(self, name: str) -> np.ndarray:
+        column = getattr(self, name)[:self.size]
+        column.flags.writeable = False
+        return column
+
+
+    # One row as the dict layout ExpenseTracker has always returned
+    def row(self, i: int) -> Dict:
+        return {
+            'id': int(self.ids[i]),
+            'amount': int(self.cents[i]) / 100,
+            'date': str(self.days[i]),
+            'vendor': self.vendors[self.vendor_codes[i]],
+            'category': self.categories[self.category_codes[i]]
+        }
+
+
+    # DataFrame over the columns: amount in dollars, date as datetime64, vendor/category categorical
+    def to_frame(self) -> pd.DataFrame:
+        n = self.size
+        return pd.DataFrame({
+            'id': self.ids[:n].copy(),
+            'amount': self.cents[:n] / 100,
+            'date': self.days[:n].astype('datetime64[ns]'),
+            'vendor': pd.Categorical.from_codes(self.vendor_codes[:n].copy(), categories=self.vendors),
+            'category': pd.Categorical.from_codes(self.category_codes[:n].copy(), categories=self.categories)
+        }, columns=EXPENSE_FRAME_COLUMNS)
+
+
+    # DataFrame of just the given rows (same columns as to_frame, plain string vendor/category);
+    # costs O(len(rows)) whatever the size of the ledger
+    def take_frame(self, rows) -> pd.DataFrame:
+        rows = np.asarray(rows, dtype=np.int64)
+        return pd.DataFrame({
+            'id': self.ids[rows],
+            'amount': self.cents[rows] / 100,
+            'date': self.days[rows].astype('datetime64[ns]'),
+            'vendor': np.array([self.vendors[code] for code in self.vendor_codes[rows]], dtype=object),
+            'category': np.array([self.categories[code] for code in self.category_codes[rows]], dtype=object)
+        }, columns=EXPENSE_FRAME_COLUMNS)
+
+
+    # Plain DataFrame in the CSV layout (ISO date strings, string vendor/category)
+    def to_records_frame(self) -> pd.DataFrame:
+        df = self.to_frame()
+        df['date'] = self.days[:self.size].astype(str)
+        df['vendor'] = df['vendor'].astype(object)
+        df['category'] = df['category'].astype(object)
+        return df
+
+
+    # Bytes held by the column arrays plus the vendor/category names and their lookup dicts
+    def nbytes(self) -> int:
+        arrays = sum(a.nbytes for a in (self.ids, self.cents, self.days, self.vendor_codes, self.category_codes))
+        names = sum(sys.getsizeof(name) for names in (self.vendors, self.categories) for name in names)
+        containers = sum(sys.getsizeof(c) for c in (self.vendors, self.categories, self._vendor_index, self._category_index))
+        return arrays + names + containers
+
+
+    # ---------------- INTERNAL HELPERS ----------------
+    def _grow(self, capacity: int):
+        for name in ('ids', 'cents', 'days', 'vendor_codes', 'category_codes'):
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+
+
+    @staticmethod
+    def _code(value: str, names: List[str], index: Dict[str, int]) -> int:
+        code = index.get(value)
+        if code is None:
+            code = len(names)
+            names.append(value)
+            index[value] = code
+        return code
+
+
+    # Encode many values: factorize once, then map only the distinct values to global codes
+    def _codes(self, values, names: List[str], index: Dict[str, int]) -> np.ndarray:
+        local_codes, uniques = pd.factorize(pd.Series(values, dtype=object))
+        mapping = np.array([self._code(str(value), names, index) for value in uniques], dtype=np.int32)
+        return mapping[local_codes] if len(mapping) else np.zeros(len(local_codes), dtype=np.int32)
+
+
+# Dollar amounts to integer cents, rounding to the nearest cent
+def to_cents(amounts) -> np.ndarray:
+    return np.rint(np.asarray(amounts, dtype=np.float64) * 100).astype(np.int64)
@@ -0,0 +1,179 @@
+import hashlib
+
+import numpy as np
+
+from ledger_columns import ExpenseColumns
+
+# The hash table doubles once more than this fraction of its slots is in use
+MAX_LOAD = 0.7
+
+
+# Multiset of probable-duplicate keys of a ledger (see duplicate_key), for warning about
+# double entries. An open-addressing hash table with linear probing kept in two numpy arrays
+# (uint64 key and int32 count per slot, count 0 = free), 12 bytes per slot. Keys are already
+# well mixed, so their low bits pick the slot. count and add take O(1) expected time;
+# count_many and add_many probe a whole batch together, one vectorized step per probe.
+# Growing re-inserts every key once per doubling, which is amortized O(1) per key.
+class DuplicateKeys:
+
+    def __init__(self, keys=None, capacity: int = 1024):
+        self._keys = np.zeros(capacity, dtype=np.uint64)
+        self._counts = np.zeros(capacity, dtype=np.int32)
+        self._used = 0
+        if keys is not None:
+            self.add_many(keys)
+
+
+    # Keys of every row of the ledger columns
+    @classmethod
+    def from_columns(cls, columns: ExpenseColumns) -> "DuplicateKeys":
+        return cls(_column_keys(columns, 0))
+
+
+    # Add the keys of the rows first_row.. of the columns (rows appended since the last call)
+    def add_rows(self, columns: ExpenseColumns, first_row: int):
+        self.add_many(_column_keys(columns, first_row))
+
+
+    # Number of expenses with this key
+    def count(self, key: int) -> int:
+        mask = len(self._keys) - 1
+        slot = key & mask
+        while self._counts[slot]:
+            if int(self._keys[slot]) == key:
+                return int(self._counts[slot])
+            slot = (slot + 1) & mask
+        return 0
+
+
+    # Number of expenses with each of the given keys (vectorized)
+    def count_many(self, keys: np.ndarray) -> np.ndarray:
+        keys = np.asarray(keys, dtype=np.uint64)
+        counts = np.zeros(len(keys), dtype=np.int64)
+        mask = len(self._keys) - 1
+        pending = np.arange(len(keys))
+        slots = (keys & np.uint64(mask)).astype(np.int64)
+        while len(pending):
+            slot_counts = self._counts[slots]
+            hit = (slot_counts > 0) & (self._keys[slots] == keys[pending])
+            counts[pending[hit]] = slot_counts[hit]
+            probe = (slot_counts > 0) & ~hit
+            pending, slots = pending[probe], (slots[probe] + 1) & mask
+        return counts
+
+
+    def add(self, key: int):
+        self._reserve(self._used + 1)
+        mask = len(self._keys) - 1
+        slot = key & mask
+        while self._counts[slot]:
+            if int(self._keys[slot]) == key:
+                self._counts[slot] += 1
+                return
+            slot = (slot + 1) & mask
+        self._keys[slot] = key
+        self._counts[slot] = 1
+        self._used += 1
+
+
+    # Many keys at once: each distinct key is inserted once with its count
+    def add_many(self, keys: np.ndarray):
+        keys = np.asarray(keys, dtype=np.uint64)
+        if not len(keys):
+            return
+        distinct, counts = np.unique(keys, return_counts=True)
+        self._reserve(self._used + len(distinct))
+        self._insert(distinct, counts)
+
+
+    # Bytes held by the table
+    def nbytes(self) -> int:
+        return self._keys.nbytes + self._counts.nbytes
+
+
+    # Grow to a power-of-two capacity that holds n keys within MAX_LOAD
+    def _reserve(self, n: int):
+        capacity = len(self._keys)
+        if n <= capacity * MAX_LOAD:
+            return
+        while n > capacity * MAX_LOAD:
+            capacity *= 2
+        used = self._counts > 0
+        keys, counts = self._keys[used], self._counts[used]
+        self._keys = np.zeros(capacity, dtype=np.uint64)
+        self._counts = np.zeros(capacity, dtype=np.int32)
+        self._used = 0
+        self._insert(keys, counts)
+
+
+    # Insert distinct keys with their counts. Each probe step adds to the slots already holding
+    # a key and claims free slots; when several keys reach the same free slot, the first claims
+    # it and the rest probe on.
+    def _insert(self, keys: np.ndarray, counts: np.ndarray):
+        mask = len(self._keys) - 1
+        pending = np.arange(len(keys))
+        slots = (keys & np.uint64(mask)).astype(np.int64)
+        while len(pending):
+            slot_counts = self._counts[slots]
+            hit = (slot_counts > 0) & (self._keys[slots] == keys[pending])
+            self._counts[slots[hit]] += counts[pending[hit]].astype(np.int32)
+            free = np.flatnonzero(slot_counts == 0)
+            _, first = np.unique(slots[free], return_index=True)
+            claim = free[first]
+            self._keys[slots[claim]] = keys[pending[claim]]
+            self._counts[slots[claim]] = counts[pending[claim]]
+            self._used += len(claim)
+            done = hit
+            done[claim] = True
+            pending, slots = pending[~done], (slots[~done] + 1) & mask
+
+
+# ---------------- KEYS ----------------
+# 64-bit key of (vendor ignoring case and surrounding spaces, day number, amount in cents).
+# The scalar and the vectorized version compute the same value (arithmetic modulo 2**64);
+# a hash collision can only cause a spurious warning.
+_MASK64 = (1 << 64) - 1
+
+
+def duplicate_key(vendor: str, day: int, cents: int) -> int:
+    return _mix64((_vendor_hash(vendor) + _mix64(((day << 40) + cents) & _MASK64)) & _MASK64)
+
+
+# Keys for many rows; vendors holds the distinct names and codes[i] selects the name of row i
+def duplicate_keys_of(vendors, days, cents, codes) -> np.ndarray:
+    vendor_hashes = np.array([_vendor_hash(vendor) for vendor in vendors], dtype=np.uint64)
+    if not len(vendor_hashes):
+        return np.zeros(0, dtype=np.uint64)
+    with np.errstate(over='ignore'):
+        amounts = (np.asarray(days, dtype=np.int64).astype(np.uint64) << np.uint64(40)) \
+            + np.asarray(cents, dtype=np.int64).astype(np.uint64)
+        return _mix64_array(vendor_hashes[np.asarray(codes)] + _mix64_array(amounts))
+
+
+def _column_keys(columns: ExpenseColumns, first_row: int) -> np.ndarray:
+    n = len(columns)
+    return duplicate_keys_of(columns.vendors, columns.days[first_row:n].astype(np.int64),
+                             columns.cents[first_row:n], codes=columns.vendor_codes[first_row:n])
+
+
+def _vendor_hash(vendor: str) -> int:
+    digest = hashlib.blake2b(str(vendor).strip().casefold().encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+# splitmix64 finalizer
+def _mix64(x: int) -> int:
+    x ^= x >> 30
+    x = (x * 0xBF58476D1CE4E5B9) & _MASK64
+    x ^= x >> 27
+    x = (x * 0x94D049BB133111EB) & _MASK64
+    return x ^ (x >> 31)
+
+
+def _mix64_array(x: np.ndarray) -> np.ndarray:
+    with np.errstate(over='ignore'):
+        x = x ^ (x >> np.uint64(30))
+        x = x * np.uint64(0xBF58476D1CE4E5B9)
+        x = x ^ (x >> np.uint64(27))
+        x = x * np.uint64(0x94D049BB133111EB)
+        return x ^ (x >> np.uint64(31))
@@ -0,0 +1,213 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import date
+from typing import Dict, Optional, Union
+
+import numpy as np
+
+from ledger_columns import ExpenseColumns
+
+DateLike = Union[str, date, np.datetime64, None]
+
+
+# Row positions of the ledger kept sorted by date (days since 1970-01-01), maintained with
+# bisect insertion. Both columns are compact int64 arrays; rows with the same date stay in
+# insertion order. Range lookups are two binary searches plus a slice: O(log n + k).
+class DateIndex:
+
+    def __init__(self):
+        self.days = array('q')
+        self.rows = array('q')
+
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+
+    def nbytes(self) -> int:
+        return (len(self.days) + len(self.rows)) * self.rows.itemsize
+
+
+    # Build from already sorted (day, row) arrays
+    @classmethod
+    def from_sorted(cls, days: np.ndarray, rows: np.ndarray) -> "DateIndex":
+        index = cls()
+        index.days.frombytes(np.ascontiguousarray(days, dtype=np.int64).tobytes())
+        index.rows.frombytes(np.ascontiguousarray(rows, dtype=np.int64).tobytes())
+        return index
+
+
+    # Insert one row; new expenses usually carry the latest date, which is an append
+    def add(self, day: int, row: int):
+        position = bisect_right(self.days, day)
+        self.days.insert(position, day)
+        self.rows.insert(position, row)
+
+
+    # Insert many rows given sorted by day (ties in insertion order); they go after existing
+    # rows of the same day. Rows dated after everything indexed (the usual case) are appended,
+    # others are merged in with one O(n + k) pass.
+    def add_many(self, days: np.ndarray, rows: np.ndarray):
+        days = np.ascontiguousarray(days, dtype=np.int64)
+        rows = np.ascontiguousarray(rows, dtype=np.int64)
+        if not len(days):
+            return
+        if not len(self.days) or days[0] >= self.days[-1]:
+            self.days.frombytes(days.tobytes())
+            self.rows.frombytes(rows.tobytes())
+            return
+        existing_days = np.array(self.days, dtype=np.int64)
+        positions = np.searchsorted(existing_days, days, side='right')
+        merged_days = np.insert(existing_days, positions, days)
+        merged_rows = np.insert(np.array(self.rows, dtype=np.int64), positions, rows)
+        self.days, self.rows = array('q'), array('q')
+        self.days.frombytes(merged_days.tobytes())
+        self.rows.frombytes(merged_rows.tobytes())
+
+
+    # Rows with start <= day <= end (None = open-ended), newest first unless told otherwise.
+    # offset skips that many rows in that order; with a limit at most `limit` rows are returned.
+    def range(self, start: Optional[int] = None, end: Optional[int] = None,
+              limit: Optional[int] = None, newest_first: bool = True, offset: int = 0) -> np.ndarray:
+        lo, hi = self._bounds(start, end)
+        if newest_first:
+            hi -= offset
+        else:
+            lo += offset
+        if hi <= lo:
+            return np.zeros(0, dtype=np.int64)
+        if limit is not None:
+            if newest_first:
+                lo = max(lo, hi - limit)
+            else:
+                hi = min(hi, lo + limit)
+        rows = np.frombuffer(self.rows[lo:hi], dtype=np.int64)
+        return rows[::-1] if newest_first else rows
+
+
+    # Number of rows with start <= day <= end
+    def count(self, start: Optional[int] = None, end: Optional[int] = None) -> int:
+        lo, hi = self._bounds(start, end)
+        return max(0, hi - lo)
+
+
+    def _bounds(self, start: Optional[int], end: Optional[int]):
+        lo = 0 if start is None else bisect_left(self.days, start)
+        hi = len(self.days) if end is None else bisect_right(self.days, end)
+        return lo, hi
+
+
+# Date index over the whole ledger plus one per category and per vendor (keyed by the
+# ExpenseColumns codes), so filtered range queries only touch matching rows
+class LedgerIndex:
+
+    def __init__(self):
+        self.by_date = DateIndex()
+        self.by_category: Dict[int, DateIndex] = {}
+        self.by_vendor: Dict[int, DateIndex] = {}
+
+
+    # Build all indexes from the columns with one sort
+    @classmethod
+    def from_columns(cls, columns: ExpenseColumns) -> "LedgerIndex":
+        index = cls()
+        if not len(columns):
+            return index
+        days = columns.view('days').astype(np.int64)
+        order = np.argsort(days, kind='stable')
+        index.by_date = DateIndex.from_sorted(days[order], order)
+        index.by_category = _partition(columns.view('category_codes'), days, order)
+        index.by_vendor = _partition(columns.view('vendor_codes'), days, order)
+        return index
+
+
+    # Bytes held by all date indexes
+    def nbytes(self) -> int:
+        secondary = list(self.by_category.values()) + list(self.by_vendor.values())
+        return self.by_date.nbytes() + sum(index.nbytes() for index in secondary)
+
+
+    # Index the rows from first_row on (a bulk add) with one sort of the new rows
+    def add_rows(self, columns: ExpenseColumns, first_row: int):
+        days = columns.view('days')[first_row:].astype(np.int64)
+        if not len(days):
+            return
+        order = np.argsort(days, kind='stable')
+        self.by_date.add_many(days[order], first_row + order)
+        for indexes, codes in ((self.by_category, columns.view('category_codes')[first_row:]),
+                               (self.by_vendor, columns.view('vendor_codes')[first_row:])):
+            for code, partition in _partition(codes, days, order).items():
+                indexes.setdefault(code, DateIndex()).add_many(partition.days, np.frombuffer(partition.rows, dtype=np.int64) + first_row)
+
+
+    def add(self, row: int, day: int, category_code: int, vendor_code: int):
+        self.by_date.add(day, row)
+        self.by_category.setdefault(category_code, DateIndex()).add(day, row)
+        self.by_vendor.setdefault(vendor_code, DateIndex()).add(day, row)
+
+
+    # Row positions matching the filters, newest first (oldest first with newest_first=False),
+    # skipping `offset` rows. A category/vendor code of -1 means the name is not in the ledger.
+    def rows(self, start: Optional[int] = None, end: Optional[int] = None,
+             category_code: Optional[int] = None, vendor_code: Optional[int] = None,
+             limit: Optional[int] = None, newest_first: bool = True, offset: int = 0) -> np.ndarray:
+        index = self._single_index(category_code, vendor_code)
+        if index is not None:
+            return index.range(start, end, limit, newest_first, offset)
+        if category_code is None or vendor_code is None or category_code == -1 or vendor_code == -1:
+            return np.zeros(0, dtype=np.int64)
+        rows = self._both(start, end, category_code, vendor_code, newest_first)[offset:]
+        return rows[:limit] if limit is not None else rows
+
+
+    # Number of rows matching the filters (O(log n) unless both category and vendor are given)
+    def count(self, start: Optional[int] = None, end: Optional[int] = None,
+              category_code: Optional[int] = None, vendor_code: Optional[int] = None) -> int:
+        index = self._single_index(category_code, vendor_code)
+        if index is not None:
+            return index.count(start, end)
+        if category_code is None or vendor_code is None or category_code == -1 or vendor_code == -1:
+            return 0
+        return len(self._both(start, end, category_code, vendor_code, True))
+
+
+    # The one DateIndex answering a query with at most one filter (None if it matches nothing
+    # or both filters are set)
+    def _single_index(self, category_code, vendor_code) -> Optional[DateIndex]:
+        if category_code is None and vendor_code is None:
+            return self.by_date
+        if vendor_code is None:
+            return self.by_category.get(category_code)
+        if category_code is None:
+            return self.by_vendor.get(vendor_code)
+        return None
+
+
+    # Both filters: scan the date range of the vendor index and keep the category's rows
+    def _both(self, start, end, category_code, vendor_code, newest_first) -> np.ndarray:
+        category_index = self.by_category.get(category_code)
+        vendor_index = self.by_vendor.get(vendor_code)
+        if category_index is None or vendor_index is None:
+            return np.zeros(0, dtype=np.int64)
+        rows = vendor_index.range(start, end, None, newest_first)
+        category_rows = category_index.range(start, end, None, newest_first)
+        return rows[np.isin(rows, category_rows, assume_unique=True)]
+
+
+# Convert a date / ISO string / datetime64 to days since 1970-01-01 (None stays None)
+def to_day(value: DateLike) -> Optional[int]:
+    if value is None:
+        return None
+    return int(np.datetime64(value, 'D').astype(np.int64))
+
+
+# One DateIndex per code, from rows already sorted by date
+def _partition(codes: np.ndarray, days: np.ndarray, order: np.ndarray) -> Dict[int, DateIndex]:
+    sorted_codes = codes[order]
+    by_code = np.argsort(sorted_codes, kind='stable')     # keeps date order within each code
+    bounds = np.flatnonzero(np.diff(sorted_codes[by_code])) + 1
+    partitions = {}
+    for chunk in np.split(by_code, bounds):
+        rows = order[chunk]
+        partitions[int(sorted_codes[chunk[0]])] = DateIndex.from_sorted(days[rows], rows)
+    return partitions
@@ -0,0 +1,106 @@
+import os
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:     # Windows: no advisory file locks, FileLock only guards this process
+    fcntl = None
+
+
+# Reader-writer lock for an in-process ledger shared by many sessions.
+# Any number of readers, or one writer. Writers are preferred (new readers wait while a
+# writer is waiting) so a steady stream of page renders cannot starve an add. Both sides are
+# reentrant for the same thread, and the writing thread may also read.
+class RWLock:
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer = None
+        self._write_depth = 0
+        self._waiting_writers = 0
+        self._local = threading.local()
+
+
+    @contextmanager
+    def read(self):
+        me = threading.get_ident()
+        depth = getattr(self._local, "read_depth", 0)
+        if self._writer == me or depth:
+            # Already inside a read or write section on this thread
+            self._local.read_depth = depth + 1
+            try:
+                yield
+            finally:
+                self._local.read_depth -= 1
+            return
+
+        with self._cond:
+            while self._writer is not None or self._waiting_writers:
+                self._cond.wait()
+            self._readers += 1
+        self._local.read_depth = 1
+        try:
+            yield
+        finally:
+            self._local.read_depth = 0
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+
+    @contextmanager
+    def write(self):
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer != me:
+                if getattr(self._local, "read_depth", 0):
+                    raise RuntimeError("Cannot upgrade a read lock to a write lock")
+                self._waiting_writers += 1
+                while self._writer is not None or self._readers:
+                    self._cond.wait()
+                self._waiting_writers -= 1
+                self._writer = me
+            self._write_depth += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._write_depth -= 1
+                if not self._write_depth:
+                    self._writer = None
+                    self._cond.notify_all()
+
+
+# Exclusive advisory lock on a file (fcntl.flock), for several server processes writing the
+# same ledger. Reentrant within the process; callers serialize threads themselves (the
+# tracker only takes it while holding its write lock).
+class FileLock:
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+        self._depth = 0
+
+
+    def __enter__(self):
+        if self._depth == 0 and fcntl is not None:
+            self._file = open(self.path, "a+")
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        self._depth += 1
+        return self
+
+
+    def __exit__(self, *exc):
+        self._depth -= 1
+        if self._depth == 0 and self._file is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+
+
+# Lock file next to a ledger (expenses.csv -> expenses.csv.lock)
+def lock_path(data_file: str) -> str:
+    return os.path.abspath(data_file.rstrip("/\\")) + ".lock"
@@ -0,0 +1,170 @@
+import logging
+import os
+import re
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from expense_tracker import ExpenseTracker
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_USER = "default"
+
+
+# Per-user ledgers for one deployment. Each user gets their own ExpenseTracker on its own
+# file (ledgers/<user>.csv by default), loaded on first access and kept in an LRU pool.
+# When the loaded ledgers exceed memory_budget bytes, or a ledger has not been used for
+# idle_seconds, it is saved and dropped from memory; the next access loads it again. So
+# memory grows with the number of active users, not with all users that ever existed.
+# Callers should not keep trackers beyond a request (keep the user id and call get()): an
+# evicted tracker that is still referenced somewhere is handed out again instead of a
+# second copy being loaded, so one ledger never has two in-memory states in a process.
+class LedgerPool:
+
+    def __init__(self, root_dir: str = "ledgers", extension: str = ".csv",
+                 memory_budget: int = 256 * 1024 * 1024, idle_seconds: float = 30 * 60,
+                 journal: bool = False, default_file: Optional[str] = None):
+        self.root_dir = root_dir
+        self.extension = extension
+        self.memory_budget = memory_budget
+        self.idle_seconds = idle_seconds
+        self.journal = journal
+        self.default_file = default_file    # the default user keeps the original single ledger
+        self._lock = threading.Lock()
+        self._loading: Dict[str, threading.Lock] = {}
+        self._ledgers: "OrderedDict[str, list]" = OrderedDict()   # user -> [tracker, last_used, nbytes, version]
+        self._evicted = weakref.WeakValueDictionary()              # user -> evicted tracker still in use
+        self._evictions = 0
+        self._stop = threading.Event()
+        self._sweeper = threading.Thread(target=self._sweep, name="ledger-pool-sweeper", daemon=True)
+        self._sweeper.start()
+        os.makedirs(root_dir, exist_ok=True)
+
+
+    # The tracker for a user, loading it on first access
+    def get(self, user_id: str = DEFAULT_USER) -> ExpenseTracker:
+        user_id = user_id.strip() or DEFAULT_USER
+        with self._lock:
+            entry = self._ledgers.get(user_id)
+            if entry is not None:
+                self._ledgers.move_to_end(user_id)
+                entry[1] = time.time()
+            else:
+                load_lock = self._loading.setdefault(user_id, threading.Lock())
+        if entry is not None:
+            # The size is only recomputed when the ledger changed since it was last measured
+            tracker = entry[0]
+            if tracker.version != entry[3]:
+                version = tracker.version
+                size = tracker.nbytes()
+                with self._lock:
+                    entry[2], entry[3] = size, version
+                    self._enforce_budget(keep=user_id)
+            return tracker
+
+        # Load outside the pool lock so other users are not blocked by a slow load;
+        # the per-user lock keeps two sessions from loading the same ledger twice
+        with load_lock:
+            with self._lock:
+                entry = self._ledgers.get(user_id)
+                tracker = self._evicted.pop(user_id, None) if entry is None else None
+            if entry is None:
+                if tracker is None:
+                    tracker = ExpenseTracker(self.path_for(user_id), journal=self.journal)
+                entry = [tracker, time.time(), tracker.nbytes(), tracker.version]
+            with self._lock:
+                self._ledgers[user_id] = entry
+                self._ledgers.move_to_end(user_id)
+                self._loading.pop(user_id, None)
+                self._enforce_budget(keep=user_id)
+        return entry[0]
+
+
+    # Ledger file of a user (user IDs are reduced to safe file name characters)
+    def path_for(self, user_id: str) -> str:
+        if user_id == DEFAULT_USER and self.default_file:
+            return self.default_file
+        safe = re.sub(r"[^A-Za-z0-9_.-]", "_", user_id).strip(".") or "_"
+        return os.path.join(self.root_dir, safe + self.extension)
+
+
+    # Save and drop a user's ledger from memory; returns False if it was not loaded
+    def evict(self, user_id: str) -> bool:
+        with self._lock:
+            entry = self._ledgers.pop(user_id, None)
+            if entry is not None:
+                self._evicted[user_id] = entry[0]
+        if entry is None:
+            return False
+        self._unload(entry[0])
+        return True
+
+
+    # Evict every ledger unused for idle_seconds; returns how many were evicted
+    def evict_idle(self) -> int:
+        cutoff = time.time() - self.idle_seconds
+        with self._lock:
+            idle = [user for user, entry in self._ledgers.items() if entry[1] < cutoff]
+        return sum(self.evict(user) for user in idle)
+
+
+    # Loaded users, their memory and the totals
+    def stats(self) -> Dict:
+        with self._lock:
+            ledgers = {user: entry[2] for user, entry in self._ledgers.items()}
+        return {
+            "loaded": len(ledgers),
+            "bytes": sum(ledgers.values()),
+            "memory_budget": self.memory_budget,
+            "evictions": self._evictions,
+            "ledgers": ledgers
+        }
+
+
+    # Save and unload everything and stop the idle sweeper
+    def close(self):
+        self._stop.set()
+        with self._lock:
+            entries = list(self._ledgers.values())
+            self._ledgers.clear()
+        for entry in entries:
+            self._unload(entry[0])
+
+
+    # ---------------- INTERNAL HELPERS ----------------
+    # Evict least recently used ledgers (never `keep`) until under budget; caller holds the lock
+    def _enforce_budget(self, keep: str):
+        total = sum(entry[2] for entry in self._ledgers.values())
+        for user in list(self._ledgers):
+            if total <= self.memory_budget:
+                break
+            if user == keep:
+                continue
+            entry = self._ledgers.pop(user)
+            self._evicted[user] = entry[0]
+            total -= entry[2]
+            # Saving can be slow; do it without holding the pool lock
+            threading.Thread(target=self._unload, args=(entry[0],), daemon=True).start()
+
+
+    # Non-incremental ledgers (plain CSV) may hold unsaved rows. The storage is not closed:
+    # a session may still hold the tracker, and its writes then go to disk as usual. Its
+    # cached views are dropped so the memory is released even then (evict() and
+    # _enforce_budget remember it weakly, so get() hands it out again while it is alive).
+    def _unload(self, tracker: ExpenseTracker):
+        tracker.save_expenses()
+        tracker.drop_caches()
+        with self._lock:
+            self._evictions += 1
+
+
+    def _sweep(self):
+        interval = max(1.0, self.idle_seconds / 4)
+        while not self._stop.wait(interval):
+            try:
+                self.evict_idle()
+            except Exception:
+                logger.exception("Error evicting idle ledgers")
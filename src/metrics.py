@@ -0,0 +1,308 @@
+import bisect
+import functools
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# Default histogram buckets for durations, in seconds (1 ms .. 2 min: fast extraction
+# steps up to EasyOCR and zero-shot classification on CPU)
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# Image sizes in bytes (10 KB .. 20 MB)
+SIZE_BUCKETS = (10e3, 50e3, 100e3, 250e3, 500e3, 1e6, 2.5e6, 5e6, 10e6, 20e6)
+
+# Content type of the Prometheus text exposition format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+# ---------------- METRIC TYPES ----------------
+# Monotonic counter, one value per combination of label values
+class Counter:
+
+    def __init__(self, registry: "MetricsRegistry", name: str, help_text: str, labels: Sequence[str] = ()):
+        self.registry = registry
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+
+    def inc(self, amount: float = 1.0, **labels):
+        if not self.registry.enabled:
+            return
+        key = _label_key(self.labels, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+
+    # {label values: value}
+    def values(self) -> Dict[Tuple[str, ...], float]:
+        with self._lock:
+            return dict(self._values)
+
+
+    def exposition(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self.values().items()):
+            lines.append(f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}")
+        return lines
+
+
+# Histogram with fixed cumulative buckets, plus the sum and count of the observations
+class Histogram:
+
+    def __init__(self, registry: "MetricsRegistry", name: str, help_text: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DURATION_BUCKETS):
+        self.registry = registry
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple[str, ...], List] = {}     # key -> [bucket counts, sum, count]
+        self._lock = threading.Lock()
+
+
+    def observe(self, value: float, **labels):
+        if not self.registry.enabled:
+            return
+        key = _label_key(self.labels, labels)
+        slot = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][slot] += 1
+            series[1] += value
+            series[2] += 1
+
+
+    # Time the body of a with-block (in seconds); errors are timed too
+    @contextmanager
+    def time(self, **labels):
+        if not self.registry.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+
+    # {label values: {"count", "sum", "mean", "p50", "p95", "p99"}}; quantiles are estimated
+    # from the buckets (upper bound of the bucket the quantile falls into)
+    def summary(self) -> Dict[Tuple[str, ...], Dict[str, float]]:
+        with self._lock:
+            snapshot = {key: (list(s[0]), s[1], s[2]) for key, s in self._series.items()}
+        result = {}
+        for key, (counts, total, count) in snapshot.items():
+            result[key] = {"count": count, "sum": total, "mean": total / count if count else 0.0}
+            for q in (0.5, 0.95, 0.99):
+                result[key][f"p{int(q * 100)}"] = self._quantile(counts, q * count)
+        return result
+
+
+    def exposition(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = sorted((key, list(s[0]), s[1], s[2]) for key, s in self._series.items())
+        for key, counts, total, count in snapshot:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labels + ("le",), key + (_format_value(bound),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+    def _quantile(self, counts: List[int], rank: float) -> float:
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += bucket_count
+            if cumulative >= rank and cumulative:
+                return bound
+        return 0.0
+
+
+# ---------------- REGISTRY ----------------
+# All metrics of the process. Disabled by default: then every inc/observe/timer returns after
+# one attribute check, so instrumented code pays (almost) nothing.
+class MetricsRegistry:
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self._metrics: Dict[str, object] = {}
+        self._lock = threading.Lock()
+        self._server = None
+        self._writer = None
+
+
+    # Create a metric once; later calls with the same name return the existing one
+    def counter(self, name: str, help_text: str, labels: Sequence[str] = ()) -> Counter:
+        return self._register(name, lambda: Counter(self, name, help_text, labels))
+
+
+    def histogram(self, name: str, help_text: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = DURATION_BUCKETS) -> Histogram:
+        return self._register(name, lambda: Histogram(self, name, help_text, labels, buckets))
+
+
+    def metrics(self) -> List[object]:
+        with self._lock:
+            return list(self._metrics.values())
+
+
+    # Everything in the Prometheus text exposition format
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics():
+            lines.extend(metric.exposition())
+        return "\n".join(lines) + "\n"
+
+
+    # Write render() atomically to a file (e.g. for the node_exporter textfile collector)
+    def write_textfile(self, path: str):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.render())
+        os.replace(tmp_path, path)
+
+
+    # Rewrite the metrics file every `interval` seconds from a daemon thread
+    def start_textfile_writer(self, path: str, interval: float = 15.0):
+        if self._writer is not None:
+            return
+
+        def loop():
+            while True:
+                try:
+                    self.write_textfile(path)
+                except OSError:
+                    pass
+                time.sleep(interval)
+
+        self._writer = threading.Thread(target=loop, name="metrics-textfile", daemon=True)
+        self._writer.start()
+
+
+    # Serve render() over HTTP (GET /metrics) from a daemon thread; returns the server
+    def start_http_server(self, port: int, host: str = "127.0.0.1"):
+        if self._server is not None:
+            return self._server
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self._server.serve_forever, name="metrics-http", daemon=True).start()
+        return self._server
+
+
+    # Forget all recorded values (the metrics themselves stay registered)
+    def reset(self):
+        for metric in self.metrics():
+            with metric._lock:
+                getattr(metric, "_values", getattr(metric, "_series", {})).clear()
+
+
+    def _register(self, name: str, create):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = create()
+            return metric
+
+
+# ---------------- PROCESS-WIDE REGISTRY ----------------
+_registry = MetricsRegistry()
+
+
+def get_metrics() -> MetricsRegistry:
+    return _registry
+
+
+# Turn metrics on or off for the process
+def enable(enabled: bool = True):
+    _registry.enabled = enabled
+
+
+# Configure from the environment:
+#   EXPENSES_METRICS=1           record metrics
+#   EXPENSES_METRICS_PORT=9108   also serve them at http://127.0.0.1:9108/metrics
+#   EXPENSES_METRICS_FILE=path   also write them to a file every 15 s
+# Returns whether metrics are enabled
+def configure_from_env() -> bool:
+    port = os.environ.get("EXPENSES_METRICS_PORT")
+    path = os.environ.get("EXPENSES_METRICS_FILE")
+    if os.environ.get("EXPENSES_METRICS", "0") == "1" or port or path:
+        enable()
+        if port:
+            try:
+                _registry.start_http_server(int(port), os.environ.get("EXPENSES_METRICS_HOST", "127.0.0.1"))
+            except OSError:
+                pass    # another server process already serves this port
+        if path:
+            _registry.start_textfile_writer(path)
+    return _registry.enabled
+
+
+# Decorator: time every call of a function into a histogram and count the calls that raise
+def timed(histogram: Histogram, errors: Optional[Counter] = None, **labels):
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not histogram.registry.enabled:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                if errors is not None:
+                    errors.inc(**labels)
+                raise
+            finally:
+                histogram.observe(time.perf_counter() - start, **labels)
+        return wrapper
+    return decorate
+
+
+# ---------------- INTERNAL HELPERS ----------------
+def _label_key(names: Tuple[str, ...], labels: Dict[str, str]) -> Tuple[str, ...]:
+    return tuple(str(labels.get(name, "")) for name in names)
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not float(value).is_integer() else str(int(value))
@@ -0,0 +1,95 @@
+import threading
+from typing import Callable, Dict, List
+
+
+# Wraps a loaded model so that concurrent sessions take turns at inference.
+# EasyOCR readers and transformers pipelines are not safe to call from several threads at once.
+class SharedModel:
+
+    def __init__(self, name: str, model):
+        self.name = name
+        self.model = model
+        self.lock = threading.Lock()
+
+
+    # EasyOCR entry point
+    def readtext(self, *args, **kwargs):
+        with self.lock:
+            return self.model.readtext(*args, **kwargs)
+
+
+    # transformers pipeline entry point
+    def __call__(self, *args, **kwargs):
+        with self.lock:
+            return self.model(*args, **kwargs)
+
+
+# Process-wide registry: each model is loaded once and shared by every ReceiptOCR instance
+class ModelRegistry:
+
+    def __init__(self):
+        self._models: Dict[str, SharedModel] = {}
+        self._failures: Dict[str, Exception] = {}
+        self._load_locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+
+    # Return the shared model for key, loading it on first use.
+    # A failed load is remembered so later sessions do not retry a multi-second download.
+    def get(self, key: str, loader: Callable[[], object]) -> SharedModel:
+        with self._lock:
+            if key in self._models:
+                return self._models[key]
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+
+        # Per-key lock: loading the classifier does not block sessions that need the reader
+        with load_lock:
+            with self._lock:
+                if key in self._models:
+                    return self._models[key]
+                if key in self._failures:
+                    raise self._failures[key]
+            try:
+                shared = SharedModel(key, loader())
+            except Exception as e:
+                with self._lock:
+                    self._failures[key] = e
+                raise
+            with self._lock:
+                self._models[key] = shared
+            return shared
+
+
+    # Shared EasyOCR reader for the given languages
+    def reader(self, languages: List[str]) -> SharedModel:
+        def load():
+            import easyocr
+            return easyocr.Reader(languages, gpu=False)
+        return self.get("easyocr:" + ",".join(languages), load)
+
+
+    # Shared transformers pipeline for the given task and model
+    def pipeline(self, task: str, model: str) -> SharedModel:
+        def load():
+            from transformers import pipeline
+            return pipeline(task, model=model)
+        return self.get(f"{task}:{model}", load)
+
+
+    # Names of the models currently held in memory
+    def loaded_models(self) -> List[str]:
+        with self._lock:
+            return sorted(self._models)
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+# Return the registry of the current process (created on first call)
+def get_registry() -> ModelRegistry:
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = ModelRegistry()
+        return _registry
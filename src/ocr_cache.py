@@ -0,0 +1,156 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+# On-disk OCR result cache keyed by SHA-256 of the image bytes and the model/config version.
+# Each entry is one JSON file holding the raw readtext output and the extracted fields;
+# entries are evicted least-recently-used first once the directory exceeds max_bytes.
+class OCRCache:
+
+    # Initialize cache directory and rebuild the LRU index from the files on disk
+    def __init__(self, cache_dir: str = ".ocr_cache", max_bytes: int = 256 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._index = OrderedDict()   # key -> file size, least recently used first
+        self._total_bytes = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load_index()
+
+
+    # Build a cache key from the image content and the model/config version string
+    @staticmethod
+    def make_key(image_bytes: bytes, version: str) -> str:
+        digest = hashlib.sha256()
+        digest.update(version.encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(image_bytes)
+        return digest.hexdigest()
+
+
+    # Return the cached entry ({"results": ..., "fields": ...}) or None on a miss
+    def get(self, key: str) -> Optional[Dict]:
+        path = self._path(key)
+        with self._lock:
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    entry = json.load(f)
+            except (OSError, ValueError):
+                # Missing or corrupt file: forget it and count a miss
+                self._forget(key)
+                self.misses += 1
+                return None
+
+            # Entries written by other sessions/processes join the index on first use
+            if key not in self._index:
+                self._remember(key, os.path.getsize(path))
+            self._index.move_to_end(key)
+            try:
+                os.utime(path, None)   # keep recency across restarts
+            except OSError:
+                pass
+            self.hits += 1
+            return entry
+
+
+    # Store OCR results and extracted fields, then evict old entries past the size bound
+    def put(self, key: str, results: list, fields: Dict) -> bool:
+        entry = {"results": results, "fields": fields, "created": time.time()}
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(entry, f)
+            os.replace(tmp_path, path)   # atomic, readers never see a partial file
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning("Error writing OCR cache entry: %s", e)
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            return False
+
+        with self._lock:
+            self._forget(key)
+            self._remember(key, os.path.getsize(path))
+            self._evict()
+        return True
+
+
+    # Hit/miss counters and current size
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._index),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes
+            }
+
+
+    # Remove every entry from disk and reset counters
+    def clear(self):
+        with self._lock:
+            for key in list(self._index):
+                self._delete(key)
+            self.hits = 0
+            self.misses = 0
+
+
+    # ---------------- INTERNAL HELPERS ----------------
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+
+    # Oldest files (by modification time) go to the front of the LRU order
+    def _load_index(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".json"):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.cache_dir, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, name[:-len(".json")], stat.st_size))
+        for _, key, size in sorted(entries):
+            self._remember(key, size)
+        self._evict()
+
+
+    def _remember(self, key: str, size: int):
+        self._index[key] = size
+        self._total_bytes += size
+
+
+    def _forget(self, key: str):
+        size = self._index.pop(key, None)
+        if size is not None:
+            self._total_bytes -= size
+
+
+    def _delete(self, key: str):
+        self._forget(key)
+        try:
+            os.unlink(self._path(key))
+        except OSError:
+            pass
+
+
+    def _evict(self):
+        while self._total_bytes > self.max_bytes and len(self._index) > 1:
+            oldest = next(iter(self._index))
+            self._delete(oldest)
@@ -0,0 +1,277 @@
+import io
+import json
+import logging
+import os
+import threading
+from collections import deque
+from typing import Dict, List, Optional, Tuple, Union
+
+import cv2
+import numpy as np
+from PIL import Image, ImageOps
+
+from image_preprocessing import ImagePreprocessor
+
+logger = logging.getLogger(__name__)
+
+
+# ---------------- PERCEPTUAL HASHES ----------------
+# Hashes are Python ints of hash_size * hash_size bits; similar images differ in few bits.
+# Receipts are mostly white paper with thin text lines, so a few degrees of rotation or a
+# different crop moves more bits than a different receipt does. Images are therefore
+# normalized first: grayscale, deskewed (as for OCR) and cropped to the ink.
+
+_deskewer = ImagePreprocessor()
+
+# Images are shrunk to at most this many pixels on the longer side before normalizing; the
+# hash itself only looks at a 64x64 thumbnail, so this keeps a 12 MP photo cheap to hash
+HASH_MAX_SIDE = 1024
+
+
+# Grayscale, straightened array of image bytes, cropped to the bounding box of the ink
+def normalize(image_bytes: bytes) -> np.ndarray:
+    with Image.open(io.BytesIO(image_bytes)) as img:
+        img.draft("L", (HASH_MAX_SIDE, HASH_MAX_SIDE))     # JPEG: decode at a reduced scale
+        img = ImageOps.exif_transpose(img).convert("L")
+        img.thumbnail((HASH_MAX_SIDE, HASH_MAX_SIDE), Image.BILINEAR)
+        gray = np.asarray(img)
+    gray = _deskewer.straighten(gray)
+    blurred = cv2.GaussianBlur(gray, (3, 3), 0)
+    _, ink = cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    ys, xs = np.nonzero(ink)
+    if len(xs):
+        gray = gray[ys.min():ys.max() + 1, xs.min():xs.max() + 1]
+    return gray
+
+
+# Difference hash: is each pixel brighter than its right neighbour (on a shrunk image)
+def dhash(gray: np.ndarray, hash_size: int = 16) -> int:
+    pixels = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA).astype(np.float64)
+    return _bits_to_int(pixels[:, 1:] > pixels[:, :-1])
+
+
+# Perceptual hash: signs of the low-frequency DCT coefficients of a 4x larger shrunk image
+# relative to their median. More robust than dHash to lighting, blur and JPEG artefacts.
+def phash(gray: np.ndarray, hash_size: int = 16) -> int:
+    size = hash_size * 4
+    pixels = cv2.resize(gray, (size, size), interpolation=cv2.INTER_AREA).astype(np.float64)
+    dct = _dct_matrix(size)
+    low = (dct @ pixels @ dct.T)[:hash_size, :hash_size]
+    return _bits_to_int(low > np.median(low.ravel()[1:]))     # median without the DC term
+
+
+HASH_FUNCTIONS = {"phash": phash, "dhash": dhash}
+
+
+# Perceptual hash of an image file or image bytes (None when it cannot be read or decoded).
+# A plain function, so process pool workers can hash receipts without the index.
+def hash_image(image: Union[str, bytes], method: str = "phash", hash_size: int = 16) -> Optional[int]:
+    try:
+        if isinstance(image, str):
+            with open(image, "rb") as f:
+                image = f.read()
+        return HASH_FUNCTIONS[method](normalize(image), hash_size)
+    except Exception as e:
+        logger.warning("Could not hash receipt image: %s", e)
+        return None
+
+
+# Number of differing bits (int.bit_count needs Python 3.10)
+if hasattr(int, "bit_count"):
+    def hamming(a: int, b: int) -> int:
+        return (a ^ b).bit_count()
+else:
+    def hamming(a: int, b: int) -> int:
+        return bin(a ^ b).count("1")
+
+
+def _bits_to_int(bits: np.ndarray) -> int:
+    return int("".join("1" if bit else "0" for bit in bits.ravel()), 2)
+
+
+_dct_cache: Dict[int, np.ndarray] = {}
+
+
+# Orthonormal DCT-II matrix (rows are the cosine basis vectors)
+def _dct_matrix(n: int) -> np.ndarray:
+    matrix = _dct_cache.get(n)
+    if matrix is None:
+        k = np.arange(n)[:, None]
+        x = np.arange(n)[None, :]
+        matrix = np.cos(np.pi * (2 * x + 1) * k / (2 * n)) * np.sqrt(2 / n)
+        matrix[0] /= np.sqrt(2)
+        _dct_cache[n] = matrix
+    return matrix
+
+
+# ---------------- BK-TREE ----------------
+# Burkhard-Keller tree over Hamming distance: a search for everything within d of a hash only
+# descends into children whose edge distance is within d of the query's distance to the node
+# (triangle inequality), so lookups touch a small part of the tree instead of every hash.
+class BKTree:
+
+    def __init__(self):
+        self.root = None        # [hash, value, {distance: child}]
+        self.size = 0
+
+
+    def __len__(self) -> int:
+        return self.size
+
+
+    def add(self, item_hash: int, value):
+        self.size += 1
+        if self.root is None:
+            self.root = [item_hash, value, {}]
+            return
+        node = self.root
+        while True:
+            distance = hamming(item_hash, node[0])
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [item_hash, value, {}]
+                return
+            node = child
+
+
+    # [(distance, hash, value)] for every entry within max_distance, nearest first
+    def search(self, item_hash: int, max_distance: int) -> List[Tuple[int, int, object]]:
+        if self.root is None:
+            return []
+        found = []
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            distance = hamming(item_hash, node[0])
+            if distance <= max_distance:
+                found.append((distance, node[0], node[1]))
+            for edge, child in node[2].items():
+                if distance - max_distance <= edge <= distance + max_distance:
+                    stack.append(child)
+        found.sort(key=lambda match: match[0])
+        return found
+
+
+# ---------------- DUPLICATE RECEIPT INDEX ----------------
+# Fraction of max_entries kept when the index is trimmed
+TRIM_TO = 0.9
+
+# Perceptual-hash index of processed receipt images and their extracted fields, so a second
+# photo of the same receipt (another angle, lighting, resolution) reuses the first extraction
+# instead of running OCR and classification again. A match is only probable: a receipt that
+# differs in a single line (same order on another day) hashes as close as a re-shot copy, so
+# callers flag reused fields as a duplicate for review instead of trusting them. Entries carry the ReceiptOCR config
+# version and are ignored after it changes. With a path, entries are appended to a JSON
+# Lines file and reloaded on start. When there are more than max_entries, the oldest are
+# dropped down to 90% of it, so the tree rebuild and file rewrite happen once per 10% of
+# max_entries added receipts, not on every add.
+class DuplicateImageIndex:
+
+    # max_distance is in bits of the hash_size**2-bit hash. The default (12 of 256 bits) was
+    # tuned on rendered receipts: re-shot copies (rotated, rescaled, JPEG, darker) were at most
+    # 12 bits apart and distinct receipts from the same merchant 28+ bits. A false match
+    # returns another receipt's fields, so lower it rather than raise it when in doubt.
+    def __init__(self, path: Optional[str] = None, method: str = "phash", hash_size: int = 16,
+                 max_distance: int = 12, max_entries: int = 50_000):
+        if method not in HASH_FUNCTIONS:
+            raise ValueError(f"Unknown perceptual hash: {method}")
+        self.path = path
+        self.method = method
+        self.hash_size = hash_size
+        self.max_distance = max_distance
+        self.max_entries = max_entries
+        self._hash_name = f"{method}{hash_size}"
+        self._entries = deque()     # (hash, entry) oldest first
+        self._tree = BKTree()
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            self._load()
+        elif path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+    # Perceptual hash of an image file or image bytes with this index's settings
+    def hash_image(self, image: Union[str, bytes]) -> Optional[int]:
+        return hash_image(image, self.method, self.hash_size)
+
+
+    # Closest earlier receipt within max_distance, as (distance, fields, source), or None;
+    # source is the name it was added with (None if unknown)
+    def lookup(self, image_hash: Optional[int], version: str = "") -> Optional[Tuple[int, Dict, Optional[str]]]:
+        if image_hash is None:
+            return None
+        with self._lock:
+            for distance, _, entry in self._tree.search(image_hash, self.max_distance):
+                if entry["version"] == version and entry.get("method") == self._hash_name:
+                    return distance, dict(entry["fields"]), entry.get("source")
+        return None
+
+
+    # Remember the fields extracted for an image; source names it (file or upload name)
+    def add(self, image_hash: Optional[int], fields: Dict, version: str = "", source: Optional[str] = None):
+        if image_hash is None:
+            return
+        entry = {"hash": format(image_hash, "x"), "method": self._hash_name, "version": version,
+                 "fields": fields, "source": source}
+        with self._lock:
+            self._insert(image_hash, entry)
+            if len(self._entries) > self.max_entries:
+                self._trim()
+            elif self.path:
+                self._append(entry)
+
+
+    # ---------------- INTERNAL HELPERS ----------------
+    def _insert(self, image_hash: int, entry: Dict):
+        self._entries.append((image_hash, entry))
+        self._tree.add(image_hash, entry)
+
+
+    # Keep the newest 90% of max_entries (BK-trees cannot delete, so the tree is rebuilt)
+    def _trim(self):
+        keep = max(1, int(self.max_entries * TRIM_TO))
+        while len(self._entries) > keep:
+            self._entries.popleft()
+        self._tree = BKTree()
+        for image_hash, entry in self._entries:
+            self._tree.add(image_hash, entry)
+        if self.path:
+            self._rewrite()
+
+
+    def _load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                        self._insert(int(entry["hash"], 16), entry)
+                    except (ValueError, KeyError):
+                        continue        # torn or foreign line
+        except OSError as e:
+            logger.warning("Could not read receipt hash index: %s", e)
+        if len(self._entries) > self.max_entries:
+            self._trim()
+
+
+    def _append(self, entry: Dict):
+        try:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry) + "\n")
+        except OSError as e:
+            logger.warning("Could not write receipt hash index: %s", e)
+
+
+    def _rewrite(self):
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                for _, entry in self._entries:
+                    f.write(json.dumps(entry) + "\n")
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning("Could not write receipt hash index: %s", e)
@@ -1,111 +1,511 @@
 # ---------------- IMPORTS AND DEPENDENCIES ----------------
-import easyocr
-import re
+import logging
+import os
+import time
+import multiprocessing
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, FIRST_COMPLETED, wait
+from typing import Iterable, Iterator, List, Dict, Optional, Union
 import pandas as pd
-import dateparser
-from transformers import pipeline
+from ocr_cache import OCRCache
+from model_registry import ModelRegistry, get_registry
+from image_preprocessing import ImagePreprocessor
+from field_extraction import FieldExtractor
+from category_classifier import KeywordClassifier, TieredClassifier, ZeroShotModel, EmbeddingModel, TextEmbedder
+from metrics import get_metrics, SIZE_BUCKETS
+from receipt_dedup import DuplicateImageIndex, hash_image
+
+logger = logging.getLogger(__name__)
+
+# Columns of a processed receipt; Tier says which classifier tier chose the category
+RESULT_COLUMNS = ["Date", "Place", "Total", "Category", "Confidence", "Tier"]
+
+# Added to every result: Duplicate is True when the fields were reused from a near-duplicate
+# image processed before (DuplicateOf names it), so they describe that receipt and need a check
+DUPLICATE_COLUMNS = ["Duplicate", "DuplicateOf"]
+
+# Columns returned by the batch API (one row per receipt)
+BATCH_COLUMNS = ["File"] + RESULT_COLUMNS + DUPLICATE_COLUMNS + ["Error"]
+
+# Model used by each classifier mode ("zero-shot": one NLI pass per label,
+# "embedding": one embedding per receipt compared with precomputed label prototypes)
+CLASSIFIER_MODELS = {
+    "zero-shot": ("zero-shot-classification", "facebook/bart-large-mnli"),
+    "embedding": ("feature-extraction", "sentence-transformers/all-MiniLM-L6-v2")
+}
+
+# Bump whenever field extraction changes so cached results from older code are not reused
+EXTRACTION_VERSION = "2"
+
+# Instrumentation (recorded only when metrics are enabled, see metrics.py). Stages:
+# cache_lookup, dedup, preprocess, ocr, lines, date (dateparser is also timed on its own), total,
+# place, classify (classifier_model for the model tier alone) and process (the whole call).
+_metrics = get_metrics()
+RECEIPT_STAGE_SECONDS = _metrics.histogram(
+    "receipt_stage_seconds", "Time spent per receipt processing stage", labels=["stage"])
+RECEIPT_IMAGE_BYTES = _metrics.histogram(
+    "receipt_image_bytes", "Size of processed receipt images", buckets=SIZE_BUCKETS)
+RECEIPTS_PROCESSED = _metrics.counter(
+    "receipts_processed_total", "Receipts processed, by outcome (ok, cached, duplicate, error)", labels=["outcome"])
+RECEIPT_ERRORS = _metrics.counter(
+    "receipt_errors_total", "Receipt processing errors, by stage", labels=["stage"])
+OCR_CACHE_REQUESTS = _metrics.counter(
+    "ocr_cache_requests_total", "OCR result cache lookups, by result (hit, miss)", labels=["result"])
+CATEGORY_TIERS = _metrics.counter(
+    "receipt_category_tier_total", "Receipts categorized, by the classifier tier that decided", labels=["tier"])
+
+
+# ---------------- PROCESS POOL WORKERS ----------------
+# Each worker process loads its own EasyOCR reader once (via that process's registry),
+# then OCRs many receipts
+_worker_reader = None
+_worker_preprocessor = None
+
+def _init_ocr_worker(languages: List[str], preprocessor: Optional[ImagePreprocessor] = None):
+    global _worker_reader, _worker_preprocessor
+    try:
+        # One torch thread per worker: the pool provides the parallelism
+        import torch
+        torch.set_num_threads(1)
+    except ImportError:
+        pass
+    _worker_reader = get_registry().reader(languages)
+    _worker_preprocessor = preprocessor
+
+
+def _ocr_worker(receipt_path: str):
+    try:
+        return receipt_path, _read_text(_worker_reader, _worker_preprocessor, receipt_path), None
+    except Exception as e:
+        return receipt_path, None, str(e)
+
+
+# Perceptual hash for the near-duplicate lookup (the lookup itself happens in the parent)
+def _hash_worker(receipt_path: str, method: str, hash_size: int) -> Optional[int]:
+    return hash_image(receipt_path, method, hash_size)
+
+
+# Process pool of the batch API, started on the first job, so a run of cache hits never
+# spawns workers (which each load the OCR model). With one worker, jobs run in this process.
+class _LazyPool:
+
+    def __init__(self, workers: int, languages: List[str], preprocessor: Optional[ImagePreprocessor]):
+        self.workers = workers
+        self.languages = languages
+        self.preprocessor = preprocessor
+        self._executor = None
+
+
+    # Submit func(*args) to the pool, or run local(*args) right away without one
+    def submit(self, func, local, *args) -> Future:
+        if self.workers <= 1:
+            future = Future()
+            future.set_result(local(*args))
+            return future
+        if self._executor is None:
+            # "spawn" avoids forking a parent that already holds torch threads and models
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_ocr_worker,
+                initargs=(self.languages, self.preprocessor)
+            )
+        return self._executor.submit(func, *args)
+
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+
+
+# Run OCR on a path or raw image bytes, preprocessing in memory when configured
+def _read_text(reader, preprocessor: Optional[ImagePreprocessor], receipt: Union[str, bytes]) -> list:
+    if preprocessor is not None:
+        if isinstance(receipt, str):
+            with open(receipt, "rb") as f:
+                receipt = f.read()
+        with RECEIPT_STAGE_SECONDS.time(stage="preprocess"):
+            receipt = preprocessor(receipt)
+    with RECEIPT_STAGE_SECONDS.time(stage="ocr"):
+        return _plain_results(reader.readtext(receipt))
+
+
+# One-row result of process_receipt; duplicate_of is set when the fields were reused
+def _result_frame(fields: Dict, duplicate_of: Optional[str] = None) -> pd.DataFrame:
+    row = {**fields, "Duplicate": duplicate_of is not None, "DuplicateOf": duplicate_of}
+    return pd.DataFrame([row], columns=RESULT_COLUMNS + DUPLICATE_COLUMNS)
+
+
+# Name of the earlier receipt of a near-duplicate match: its source, else what it said
+def _duplicate_name(match) -> str:
+    distance, fields, source = match
+    return source or f"{fields.get('Place')} on {fields.get('Date')} ({fields.get('Total')})"
+
+
+# Convert readtext output (numpy ints in boxes) to plain picklable Python values
+def _plain_results(results) -> list:
+    return [
+        ([[float(x), float(y)] for x, y in box], str(text), float(conf))
+        for box, text, conf in results
+    ]
+
 
 class ReceiptOCR:
 
     # ---------------- CLASS INITIALIZATION ----------------
-    def __init__(self):
+    def __init__(self, cache: Optional[OCRCache] = None, registry: Optional[ModelRegistry] = None,
+                 preprocessor: Optional[ImagePreprocessor] = None, classifier_mode: str = "zero-shot",
+                 dedup: Optional[DuplicateImageIndex] = None):
+        if classifier_mode not in CLASSIFIER_MODELS:
+            raise ValueError(f"Unknown classifier mode: {classifier_mode}")
+
+        # Optional content-addressed cache of OCR results (shared across sessions via disk)
+        self.cache = cache
+
+        # Optional in-memory preprocessing (downscale, grayscale, binarize, deskew) before OCR
+        self.preprocessor = preprocessor
+
+        # Optional perceptual-hash index: another photo of a receipt processed before (new
+        # angle, lighting, resolution) reuses that extraction instead of running OCR again
+        self.dedup = dedup
+
+        # Models come from the process-wide registry, so every instance shares one copy
+        # and inference is serialized by the registry's per-model lock
+        registry = registry or get_registry()
+
+        # Layout-aware extraction of date, merchant and total from the OCR boxes
+        self.field_extractor = FieldExtractor()
+
         # Initialize EasyOCR reader for English
-        self.reader = easyocr.Reader(['en'], gpu=False)
-        
+        self.languages = ['en']
+        self.reader = registry.reader(self.languages)
+
         # Initialize category classifier
+        self.classifier_mode = classifier_mode
+        task, self.classifier_model = CLASSIFIER_MODELS[classifier_mode]
         try:
-            self.classifier = pipeline("zero-shot-classification", model="facebook/bart-large-mnli")
+            self.classifier = registry.pipeline(task, self.classifier_model)
         except:
             self.classifier = None
-            print("Warning: Could not load classification model. Category prediction will use keyword matching.")
-        
+            logger.warning("Could not load classification model. Category prediction will use keyword matching.")
+
         # Categories for classification
         self.categories = [
-            "Food & Dining", "Transportation", "Shopping", "Entertainment", 
-            "Bills & Utilities", "Healthcare", "Education", "Travel", 
+            "Food & Dining", "Transportation", "Shopping", "Entertainment",
+            "Bills & Utilities", "Healthcare", "Education", "Travel",
             "Groceries", "Gas", "Other"
-        ]  
-    
-    
+        ]
+
+        # Category cascade: keyword/vendor lexicon first, the model tier (zero-shot or
+        # embedding) only when the lexicon's confidence is below the threshold
+        self.category_threshold = 0.6
+        model = None
+        if self.classifier and classifier_mode == "embedding":
+            try:
+                model = EmbeddingModel(TextEmbedder(self.classifier), self.categories,
+                                       model_name=self.classifier_model)
+            except Exception as e:
+                logger.warning("Could not compute category embeddings: %s", e)
+        elif self.classifier:
+            model = ZeroShotModel(self.classifier, self.categories)
+        self.category_classifier = TieredClassifier(KeywordClassifier(), model=model,
+                                                    threshold=self.category_threshold)
+
+
+    # Version string for cache keys: changes whenever models or extraction settings change
+    def config_version(self) -> str:
+        classifier = self.classifier_model if self.classifier else "none"
+        if isinstance(self.category_classifier.model, EmbeddingModel):
+            classifier += "#" + self.category_classifier.model.fingerprint
+        return "|".join([
+            f"extraction={EXTRACTION_VERSION}",
+            "ocr=easyocr:" + ",".join(self.languages),
+            f"classifier=keyword>{classifier}@{self.category_threshold}",
+            "categories=" + ",".join(self.categories),
+            "preprocess=" + (self.preprocessor.config_key() if self.preprocessor else "none")
+        ])
+
+
     # ---------------- MAIN PROCESSING ----------------
-    def process_receipt(self, receipt_path: str) -> pd.DataFrame:
+    # Process one receipt given as a file path or as the raw image bytes of an upload
+    # (source names it for later near-duplicate reports; defaults to the path).
+    # Errors are logged and counted, and an empty DataFrame is returned.
+    def process_receipt(self, receipt: Union[str, bytes], source: Optional[str] = None) -> pd.DataFrame:
+        if source is None and isinstance(receipt, str):
+            source = receipt
+        start = time.perf_counter()
+        stage = "read"
         try:
+            if _metrics.enabled:
+                RECEIPT_IMAGE_BYTES.observe(len(receipt) if isinstance(receipt, bytes) else os.path.getsize(receipt))
+
+            # Cache lookup: identical image bytes return the stored result without OCR
+            cache_key = None
+            if self.cache is not None:
+                stage = "cache_lookup"
+                with RECEIPT_STAGE_SECONDS.time(stage="cache_lookup"):
+                    if isinstance(receipt, str):
+                        with open(receipt, "rb") as f:
+                            receipt = f.read()
+                    cache_key = self.cache.make_key(receipt, self.config_version())
+                    entry = self.cache.get(cache_key)
+                OCR_CACHE_REQUESTS.inc(result="hit" if entry is not None else "miss")
+                if entry is not None:
+                    RECEIPTS_PROCESSED.inc(outcome="cached")
+                    return _result_frame(entry["fields"])
+
+            # Near-duplicate of a receipt image processed before: return its extraction
+            image_hash = None
+            if self.dedup is not None:
+                stage = "dedup"
+                with RECEIPT_STAGE_SECONDS.time(stage="dedup"):
+                    if isinstance(receipt, str):
+                        with open(receipt, "rb") as f:
+                            receipt = f.read()
+                    image_hash = self.dedup.hash_image(receipt)
+                    match = self.dedup.lookup(image_hash, self.config_version())
+                if match is not None:
+                    logger.info("Receipt is a near-duplicate (%d bits apart) of an earlier one; skipping OCR", match[0])
+                    RECEIPTS_PROCESSED.inc(outcome="duplicate")
+                    return _result_frame(match[1], duplicate_of=_duplicate_name(match))
+
             # OCR: Extract text from image
-            results = self.reader.readtext(receipt_path)
-            extracted_text = " ".join([res[1] for res in results])
-            print("Extracted Text:\n", extracted_text)
-
-            # ----- Extract date ----- 
-            date_patterns = [
-                r"\b\d{4}[-/]\d{2}[-/]\d{2}\b",     # 2020-12-31
-                r"\b\d{2}[-/]\d{2}[-/]\d{4}\b",     # 31/12/2020
-                r"\b\d{2}[-/]\d{2}[-/]\d{2}\b",     # 31-12-20
-                r"\b\d{1,2}[-/]\d{1,2}\s\d{4}\b",   # 11-31 2020 (with space)
-                r"\b\w+\s\d{1,2},\s\d{4}\b"         # Dec 31, 2020
-            ]
-
-            date_found = None
-            for pattern in date_patterns:
-                match = re.search(pattern, extracted_text)
-                if match:
-                    date_found = match.group()
-                    break
-
-            # Parse into standard format YYYY-MM-DD
-            if date_found:
-                if dateparser:
-                    parsed_date = dateparser.parse(date_found)
-                    if parsed_date:
-                        date = parsed_date.strftime("%Y-%m-%d")
-                    else:
-                        date = date_found   # fallback keep raw string
-                else:
-                    date = date_found
+            stage = "ocr"
+            results = _read_text(self.reader, self.preprocessor, receipt)
+            stage = "extract"
+            fields = self._extract_fields(results)
+            logger.debug("Extracted text: %s", fields["Text"])
+
+            # ----- Predict category -----
+            stage = "classify"
+            fields["Category"], fields["Confidence"], fields["Tier"] = \
+                self._predict_categories([fields.pop("Text")])[0]
+
+            if cache_key is not None:
+                self.cache.put(cache_key, results, fields)
+            if self.dedup is not None:
+                self.dedup.add(image_hash, dict(fields), self.config_version(), source=source)
+
+            logger.info("Extracted receipt: date=%s place=%s total=%s category=%s (%s tier)",
+                        fields["Date"], fields["Place"], fields["Total"], fields["Category"], fields["Tier"])
+            RECEIPTS_PROCESSED.inc(outcome="ok")
+
+            # Create DataFrame for return (don't auto-save to CSV)
+            return _result_frame(fields)
+
+        except Exception:
+            logger.exception("Error processing receipt (stage %s)", stage)
+            RECEIPT_ERRORS.inc(stage=stage)
+            RECEIPTS_PROCESSED.inc(outcome="error")
+            # Return empty DataFrame on error
+            return pd.DataFrame(columns=RESULT_COLUMNS + DUPLICATE_COLUMNS)
+
+        finally:
+            if _metrics.enabled:
+                RECEIPT_STAGE_SECONDS.observe(time.perf_counter() - start, stage="process")
+
+
+    # ---------------- BATCH PROCESSING ----------------
+    # Process many receipts and return one combined DataFrame (one row per input path)
+    def process_receipts(self, receipt_paths: Iterable[str], max_workers: Optional[int] = None,
+                         batch_size: int = 8) -> pd.DataFrame:
+        rows = list(self.iter_receipts(receipt_paths, max_workers=max_workers, batch_size=batch_size))
+        return pd.DataFrame(rows, columns=BATCH_COLUMNS)
+
+
+    # Stream one result dict per receipt, in input order.
+    # OCR runs in a bounded process pool; classification is batched across receipts.
+    # Failed receipts produce a row with the "Error" column set instead of being dropped.
+    # Receipts move through a pipeline that keeps at most `lookahead` of them in flight:
+    # exact cache lookup (in this process), perceptual hash (in the pool), near-duplicate
+    # lookup (here) and OCR (in the pool) for the rest. So results start streaming right away
+    # and hashing overlaps OCR instead of running for every file before the first OCR job.
+    # Two copies of a receipt that are in flight at the same time are both OCR'd.
+    def iter_receipts(self, receipt_paths: Iterable[str], max_workers: Optional[int] = None,
+                      batch_size: int = 8, lookahead: Optional[int] = None) -> Iterator[Dict]:
+        paths = list(receipt_paths)
+        if not paths:
+            return
+
+        workers = min(max_workers or os.cpu_count() or 1, len(paths))
+        lookahead = max(lookahead or 4 * workers, batch_size, 1)
+        pool = _LazyPool(workers, self.languages, self.preprocessor)
+        in_flight = deque()
+        try:
+            batch = []
+            for path in paths:
+                item = self._batch_item(path)
+                self._start_item(item, pool)
+                in_flight.append(item)
+                self._advance(in_flight, pool)
+                while len(in_flight) > lookahead:
+                    batch.append(self._wait_item(in_flight, pool))
+                    if len(batch) >= batch_size:
+                        yield from self._finish_batch(batch)
+                        batch = []
+            while in_flight:
+                batch.append(self._wait_item(in_flight, pool))
+                if len(batch) >= batch_size:
+                    yield from self._finish_batch(batch)
+                    batch = []
+            if batch:
+                yield from self._finish_batch(batch)
+        finally:
+            pool.shutdown()
+
+
+    # Read a receipt for the batch API and look it up in the cache
+    def _batch_item(self, receipt_path: str) -> Dict:
+        item = {"File": receipt_path, "Key": None, "Hash": None, "Results": None, "Fields": None,
+                "Duplicate": False, "DuplicateOf": None, "Error": None, "Stage": None, "Future": None}
+        if self.cache is None:
+            return item
+        try:
+            with open(receipt_path, "rb") as f:
+                item["Key"] = self.cache.make_key(f.read(), self.config_version())
+        except OSError as e:
+            item["Error"] = str(e)
+            return item
+        entry = self.cache.get(item["Key"])
+        OCR_CACHE_REQUESTS.inc(result="hit" if entry is not None else "miss")
+        if entry is not None:
+            item["Fields"] = entry["fields"]
+        return item
+
+
+    # Submit the first pool job of a cache miss: its hash with a near-duplicate index, else OCR
+    def _start_item(self, item: Dict, pool: "_LazyPool"):
+        if item["Fields"] is not None or item["Error"] is not None:
+            return
+        if self.dedup is not None:
+            item["Stage"] = "hash"
+            item["Future"] = pool.submit(_hash_worker, _hash_worker, item["File"],
+                                         self.dedup.method, self.dedup.hash_size)
+        else:
+            item["Stage"] = "ocr"
+            item["Future"] = pool.submit(_ocr_worker, self._ocr_in_process, item["File"])
+
+
+    # Move every in-flight receipt whose hash is ready on to the near-duplicate lookup, and
+    # to OCR when there is no match
+    def _advance(self, in_flight: deque, pool: "_LazyPool"):
+        for item in in_flight:
+            if item["Stage"] != "hash" or not item["Future"].done():
+                continue
+            item["Hash"] = item["Future"].result()
+            match = self.dedup.lookup(item["Hash"], self.config_version())
+            if match is not None:
+                item["Fields"], item["Duplicate"], item["DuplicateOf"] = match[1], True, _duplicate_name(match)
+                item["Stage"], item["Future"] = None, None
             else:
-                date = "Unknown"
+                item["Stage"] = "ocr"
+                item["Future"] = pool.submit(_ocr_worker, self._ocr_in_process, item["File"])
 
 
-            # ----- Extract total/amount -----
-            total_match = re.findall(r"\d{1,3}(?:[ ,]?\d{3})*(?:[.,]\d{2})", extracted_text)   
-            total_normalized = [val.replace(" ", "").replace(",", ".") for val in total_match]          # Normalize numbers for EU money(remove spaces, replace ',' with '.')
-            total = total_normalized[-1] if total_normalized else "Unknown"                             # Get last number as total
+    # Wait until the oldest in-flight receipt is done and remove it; later receipts keep
+    # moving through the pipeline meanwhile
+    def _wait_item(self, in_flight: deque, pool: "_LazyPool") -> Dict:
+        item = in_flight[0]
+        while item["Stage"] == "hash":
+            # Only hash results move the pipeline on (every finished one was just advanced)
+            wait([other["Future"] for other in in_flight if other["Stage"] == "hash"],
+                 return_when=FIRST_COMPLETED)
+            self._advance(in_flight, pool)
+        if item["Stage"] == "ocr":
+            _, item["Results"], item["Error"] = item["Future"].result()
+        item["Stage"], item["Future"] = None, None
+        return in_flight.popleft()
 
-            print("\nTotal match:", total_match)
-            print("Normalized totals:", total_normalized)
-            print("Total extracted:", total)
-    
 
-            # ----- Extract place (take first line as guess) -----
-            place = results[0][1] if results else "Unknown"
+    # OCR a single receipt with this instance's reader (used when the pool has one worker)
+    def _ocr_in_process(self, receipt_path: str):
+        try:
+            return receipt_path, _read_text(self.reader, self.preprocessor, receipt_path), None
+        except Exception as e:
+            return receipt_path, None, str(e)
 
 
-            # ----- Predict category -----
-            if self.classifier:
+    # Extract fields for a batch of OCR results and classify all of them in one call
+    def _finish_batch(self, batch) -> Iterator[Dict]:
+        rows = []
+        for item in batch:
+            row = {"File": item["File"], "Date": "Unknown", "Place": "Unknown", "Total": "Unknown",
+                   "Category": "Unknown", "Confidence": 0.0, "Tier": None, "Duplicate": item["Duplicate"],
+                   "DuplicateOf": item["DuplicateOf"], "Error": item["Error"]}
+            if item["Fields"] is not None:
+                row.update(item["Fields"])
+            elif item["Error"] is None:
                 try:
-                    category_result = self.classifier(extracted_text, candidate_labels=self.categories)
-                    category = category_result["labels"][0]
-                except:
-                    category = "Other"
+                    row.update(self._extract_fields(item["Results"]))
+                except Exception as e:
+                    logger.exception("Field extraction failed for %s", item["File"])
+                    RECEIPT_ERRORS.inc(stage="extract")
+                    row["Error"] = f"Field extraction failed: {e}"
             else:
-                category = "Other"
+                RECEIPT_ERRORS.inc(stage="ocr")
+            rows.append((item, row))
 
+        # Classify every freshly OCR'd receipt of the batch in a single call
+        fresh = [(item, row) for item, row in rows if item["Fields"] is None and row["Error"] is None]
+        try:
+            predictions = self._predict_categories([row["Text"] for _, row in fresh])
+        except Exception as e:
+            predictions = [("Other", 0.0, "default")] * len(fresh)
+            logger.exception("Error classifying receipts")
+            RECEIPT_ERRORS.inc(len(fresh), stage="classify")
+        for (item, row), (category, confidence, tier) in zip(fresh, predictions):
+            row["Category"], row["Confidence"], row["Tier"] = category, confidence, tier
+            row.pop("Text")
+            fields = {k: row[k] for k in RESULT_COLUMNS}
+            if item["Key"] is not None:
+                self.cache.put(item["Key"], item["Results"], fields)
+            if self.dedup is not None:
+                self.dedup.add(item["Hash"], fields, self.config_version(), source=item["File"])
 
-            # Print results
-            print("\n--- Extracted Information ---")
-            print("Date:", date)
-            print("Place:", place)
-            print("Total:", total)
-            print("Category:", category)
+        for item, row in rows:
+            row.pop("Text", None)
+            outcome = "error" if row["Error"] else "duplicate" if item["Duplicate"] \
+                else "cached" if item["Fields"] is not None else "ok"
+            RECEIPTS_PROCESSED.inc(outcome=outcome)
+            yield row
+
+
+    # ---------------- FIELD EXTRACTION ----------------
+    # Turn readtext output into Date / Place / Total fields (plus the joined text).
+    # With metrics enabled the extractor's steps are called one by one to time each of them.
+    def _extract_fields(self, results) -> Dict[str, str]:
+        extractor = self.field_extractor
+        if not _metrics.enabled:
+            return extractor.extract(results)
+        with RECEIPT_STAGE_SECONDS.time(stage="lines"):
+            text = " ".join(res[1] for res in results)
+            lines = extractor.group_lines(results)
+        with RECEIPT_STAGE_SECONDS.time(stage="date"):
+            found_date = extractor.find_date(text)
+        with RECEIPT_STAGE_SECONDS.time(stage="place"):
+            place = extractor.find_merchant(lines, results)
+        with RECEIPT_STAGE_SECONDS.time(stage="total"):
+            total = extractor.find_total(lines, text)
+        return {"Date": found_date, "Place": place, "Total": total, "Text": text}
+
+
+    # ---------------- CATEGORY PREDICTION ----------------
+    # Embedding mode only: adapt category prototypes to the categories the user confirmed
+    # for their vendors in an ExpenseTracker
+    def refine_categories(self, tracker, weight: float = 0.5) -> bool:
+        model = self.category_classifier.model
+        if not isinstance(model, EmbeddingModel):
+            return False
+        model.refine_from_tracker(tracker, weight=weight)
+        return True
 
-            # Create DataFrame for return (don't auto-save to CSV)
-            data = {"Date": [date], "Place": [place], "Total": [total], "Category": [category]}
-            df = pd.DataFrame(data)
-            
-            return df
-            
-        except Exception as e:
-            print(f"Error processing receipt: {str(e)}")
-            # Return empty DataFrame on error
-            return pd.DataFrame(columns=["Date", "Place", "Total", "Category"])
-    
 
+    # Predict (category, confidence, tier) per text. Texts the keyword tier settles never
+    # reach the model; the rest go to the zero-shot pipeline in a single batched call.
+    def _predict_categories(self, texts: List[str]) -> List[tuple]:
+        with RECEIPT_STAGE_SECONDS.time(stage="classify"):
+            predictions = self.category_classifier.classify(texts)
+        if _metrics.enabled:
+            for _, _, tier in predictions:
+                CATEGORY_TIERS.inc(tier=tier)
+        return predictions
@@ -0,0 +1,146 @@
+import io
+import re
+from typing import Optional, Union
+
+import numpy as np
+import pandas as pd
+
+# Header names used by common bank / card CSV exports (compared lower-cased and stripped)
+DATE_HEADERS = ["date", "transaction date", "trans date", "posted date", "posting date", "booking date",
+                "value date", "dtposted"]
+AMOUNT_HEADERS = ["amount", "transaction amount", "amount (usd)", "value", "trnamt"]
+DEBIT_HEADERS = ["debit", "withdrawal", "withdrawals", "money out", "paid out", "charge"]
+CREDIT_HEADERS = ["credit", "deposit", "deposits", "money in", "paid in", "payment"]
+VENDOR_HEADERS = ["description", "payee", "merchant", "name", "vendor", "details", "memo", "narrative"]
+CATEGORY_HEADERS = ["category", "type of expense", "expense category"]
+
+# OFX / QFX: one <STMTTRN> block per transaction; SGML (unclosed tags) or XML
+OFX_TRANSACTION_RE = re.compile(r"<STMTTRN>(.*?)(?:</STMTTRN>|(?=<STMTTRN>)|(?=</BANKTRANLIST>))", re.S | re.I)
+OFX_FIELD_RE = re.compile(r"<(DTPOSTED|TRNAMT|NAME|MEMO|PAYEE)>([^<\r\n]*)", re.I)
+
+# Date formats tried on a CSV date column; the whole column is read with one of them
+ISO_DATE_FORMATS = ["%Y-%m-%d", "%Y/%m/%d", "%Y%m%d"]
+DAY_FIRST_FORMATS = ["%d/%m/%Y", "%d-%m-%Y", "%d.%m.%Y", "%d/%m/%y", "%d %b %Y", "%d %B %Y"]
+MONTH_FIRST_FORMATS = ["%m/%d/%Y", "%m-%d-%Y", "%m/%d/%y", "%b %d, %Y", "%B %d, %Y"]
+# Time of day after the date ("2024-05-03 14:20", "2024-05-03T14:20:00Z")
+TIME_SUFFIX_RE = r"[ T]\d{1,2}:\d{2}.*$"
+
+# Characters stripped from amounts before parsing: currency symbols, thousands separators, spaces
+AMOUNT_JUNK_RE = r"[^\d.\-]"
+# "1.234,56" / "15,00": comma as the decimal separator
+DECIMAL_COMMA_RE = r",\d{1,2}\)?-?$"
+
+
+# Parse a bank/card statement (CSV or OFX/QFX bytes) into the layout expected by
+# ExpenseTracker.add_expenses_bulk: amount, date ("YYYY-MM-DD"), vendor, category.
+# Statements list spending as negative amounts (or in a debit column); with expenses_only the
+# spending rows are kept as positive amounts and incoming money is dropped. Rows whose date or
+# amount cannot be read are kept with empty values so the tracker reports them as rejected.
+# CSV dates are read with one format for the whole file (see parse_dates); dayfirst only
+# decides when every date fits both day-first and month-first.
+def read_statement(data: Union[bytes, str], name: str = "", dayfirst: bool = False,
+                   expenses_only: bool = True) -> pd.DataFrame:
+    if isinstance(data, bytes):
+        data = data.decode("utf-8-sig", errors="replace")
+    if name.lower().endswith((".ofx", ".qfx")) or "<OFX>" in data[:4096].upper():
+        raw = read_ofx(data)
+        dates = pd.to_datetime(raw['date'], format="%Y-%m-%d", errors='coerce')
+    else:
+        raw = read_csv_statement(data)
+        dates = parse_dates(raw['date'], dayfirst=dayfirst)
+
+    statement = pd.DataFrame({
+        'amount': raw['amount'],
+        'date': dates.dt.strftime('%Y-%m-%d'),
+        'vendor': raw['vendor'].fillna('').astype(str).str.strip(),
+        'category': raw['category'].fillna('').astype(str).str.strip()
+    })
+    if expenses_only:
+        # Spending is the sign most rows carry (negative on most bank exports)
+        spending_sign = -1.0 if (statement['amount'] < 0).sum() >= (statement['amount'] > 0).sum() else 1.0
+        statement = statement[~(statement['amount'] * spending_sign < 0)]
+        statement['amount'] = statement['amount'].abs()
+    return statement.reset_index(drop=True)
+
+
+# CSV export -> date, amount (signed, spending negative), vendor, category columns (raw values)
+def read_csv_statement(text: str) -> pd.DataFrame:
+    df = pd.read_csv(io.StringIO(text), sep=None, engine="python", dtype=str)
+    headers = {column.strip().lower(): column for column in df.columns}
+
+    date_column = _find_column(headers, DATE_HEADERS)
+    vendor_column = _find_column(headers, VENDOR_HEADERS)
+    if date_column is None or vendor_column is None:
+        raise ValueError(f"Could not find date and description columns in: {', '.join(df.columns)}")
+
+    amount_column = _find_column(headers, AMOUNT_HEADERS)
+    if amount_column is not None:
+        amounts = parse_amounts(df[amount_column])
+    else:
+        debit_column = _find_column(headers, DEBIT_HEADERS)
+        credit_column = _find_column(headers, CREDIT_HEADERS)
+        if debit_column is None:
+            raise ValueError(f"Could not find an amount or debit column in: {', '.join(df.columns)}")
+        debits = parse_amounts(df[debit_column]).abs()
+        credits = parse_amounts(df[credit_column]).abs() if credit_column else pd.Series(np.nan, index=df.index)
+        amounts = (-debits).fillna(credits)
+
+    category_column = _find_column(headers, CATEGORY_HEADERS)
+    return pd.DataFrame({
+        'date': df[date_column],
+        'amount': amounts,
+        'vendor': df[vendor_column],
+        'category': df[category_column] if category_column else ''
+    })
+
+
+# OFX/QFX (SGML or XML) -> date, amount, vendor, category columns
+def read_ofx(text: str) -> pd.DataFrame:
+    records = []
+    for block in OFX_TRANSACTION_RE.findall(text):
+        fields = {tag.upper(): value.strip() for tag, value in OFX_FIELD_RE.findall(block)}
+        records.append({
+            'date': fields.get('DTPOSTED', '')[:8],         # YYYYMMDD[HHMMSS[.XXX]][TZ]
+            'amount': fields.get('TRNAMT'),
+            'vendor': fields.get('NAME') or fields.get('PAYEE') or fields.get('MEMO', ''),
+            'category': ''
+        })
+    df = pd.DataFrame(records, columns=['date', 'amount', 'vendor', 'category'])
+    df['date'] = pd.to_datetime(df['date'], format="%Y%m%d", errors='coerce').dt.strftime('%Y-%m-%d')
+    df['amount'] = parse_amounts(df['amount'])
+    return df
+
+
+# Read a date column with the single format that parses the most of its values, so every
+# row of a file is read the same way ("03/05/2024" and "13/05/2024" are both day first).
+# When day-first and month-first formats parse equally many (all days <= 12), dayfirst
+# decides. Values in another format come back as NaT.
+def parse_dates(values: pd.Series, dayfirst: bool = False) -> pd.Series:
+    text = values.fillna('').astype(str).str.strip().str.replace(TIME_SUFFIX_RE, '', regex=True)
+    preferred = DAY_FIRST_FORMATS if dayfirst else MONTH_FIRST_FORMATS
+    best, best_rank = pd.Series(pd.NaT, index=values.index, dtype='datetime64[ns]'), None
+    for date_format in ISO_DATE_FORMATS + DAY_FIRST_FORMATS + MONTH_FIRST_FORMATS:
+        parsed = pd.to_datetime(text, format=date_format, errors='coerce')
+        rank = (int(parsed.notna().sum()), date_format in ISO_DATE_FORMATS or date_format in preferred)
+        if rank[0] and (best_rank is None or rank > best_rank):
+            best, best_rank = parsed, rank
+    return best
+
+
+# Vectorized amount parsing: "$1,234.50" -> 1234.5, "1.234,50" -> 1234.5,
+# "(12.00)" and "12.00-" -> -12.0, junk -> NaN
+def parse_amounts(values: pd.Series) -> pd.Series:
+    text = values.fillna('').astype(str).str.strip()
+    negative = text.str.startswith('(') & text.str.endswith(')') | text.str.endswith('-')
+    decimal_comma = text.str.contains(DECIMAL_COMMA_RE, regex=True)
+    text = text.where(~decimal_comma, text.str.replace('.', '', regex=False).str.replace(',', '.', regex=False))
+    cleaned = text.str.replace(AMOUNT_JUNK_RE, '', regex=True).str.rstrip('-')
+    amounts = pd.to_numeric(cleaned, errors='coerce')
+    return amounts.where(~negative, -amounts.abs())
+
+
+def _find_column(headers, candidates) -> Optional[str]:
+    for candidate in candidates:
+        if candidate in headers:
+            return headers[candidate]
+    return None
@@ -0,0 +1,650 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from ledger_lock import FileLock, lock_path
+
+logger = logging.getLogger(__name__)
+
+# Column layout shared by every backend (and by the CSV file)
+EXPENSE_COLUMNS = ['id', 'amount', 'date', 'vendor', 'category']
+
+
+# Base class for ExpenseTracker storage backends.
+# Backends with incremental = True persist each append() immediately, so the tracker never
+# needs to rewrite the whole ledger; the others are written with save_all().
+class ExpenseStorage:
+
+    incremental = False
+    # Partitioned backends (partitioned = True) also provide months(), load_months(months),
+    # count(), max_id() and categories(), so the tracker can load a ledger month by month
+    partitioned = False
+
+    # Load the whole ledger as a DataFrame with EXPENSE_COLUMNS
+    def load(self) -> pd.DataFrame:
+        raise NotImplementedError
+
+
+    # Persist one new expense (only called on incremental backends)
+    def append(self, expense: Dict):
+        raise NotImplementedError
+
+
+    # Persist many new expenses (DataFrame with EXPENSE_COLUMNS); backends override this to
+    # do it in a single write
+    def append_many(self, expenses: pd.DataFrame):
+        for expense in expenses[EXPENSE_COLUMNS].to_dict('records'):
+            self.append(expense)
+
+
+    # Replace the stored ledger with the given expenses (DataFrame with EXPENSE_COLUMNS)
+    def save_all(self, expenses: pd.DataFrame):
+        raise NotImplementedError
+
+
+    # Value that changes whenever another writer (thread or process) changed the stored
+    # ledger; None when the backend cannot tell
+    def change_token(self):
+        return None
+
+
+    def close(self):
+        pass
+
+
+# Original layout: the whole ledger in one CSV file, rewritten on every save
+class CSVStorage(ExpenseStorage):
+
+    def __init__(self, path: str):
+        self.path = path
+
+
+    def load(self) -> pd.DataFrame:
+        if not os.path.exists(self.path):
+            return pd.DataFrame(columns=EXPENSE_COLUMNS)
+        return pd.read_csv(self.path)
+
+
+    def save_all(self, expenses: pd.DataFrame):
+        write_csv_atomic(expenses[EXPENSE_COLUMNS], self.path)
+
+
+    def change_token(self):
+        return _file_stamps([self.path])
+
+
+# CSV ledger in journal mode: expenses.csv stays the source of truth as a snapshot, and each
+# new expense is appended as one fsync'd JSON line to expenses.csv.journal (O(1) per write,
+# no full-file rewrite). Loading replays the journal on top of the snapshot. Once the journal
+# reaches compact_bytes it is merged into a new snapshot in a background thread:
+#   1. expenses.csv.journal is renamed to expenses.csv.journal.compacting
+#   2. snapshot + compacting journal are written to a temp file that atomically replaces the CSV
+#   3. the compacting journal is deleted
+# All three steps run under the ledger's lock file (the one ExpenseTracker writes under), so
+# appends and compactions from other processes (and other trackers) wait for them; the add that
+# triggered the compaction returns without waiting. A crash at any point leaves snapshot + journals that replay to the same
+# ledger; rows seen twice (crash between 2 and 3) are de-duplicated by id, and a torn last line
+# is ignored.
+class JournalCSVStorage(ExpenseStorage):
+
+    incremental = True
+
+    def __init__(self, path: str, compact_bytes: int = 1024 * 1024):
+        self.path = path
+        self.journal_path = path + ".journal"
+        self.compacting_path = path + ".journal.compacting"
+        self.compact_bytes = compact_bytes
+        self._write_lock = threading.Lock()     # serializes journal appends
+        self._compact_lock = threading.Lock()   # held for a whole compaction (and by load)
+        # Cross-process lock for compactions; always taken before _compact_lock, as the
+        # tracker holds its own FileLock on the same file when it calls load/save_all
+        self._file_lock = FileLock(lock_path(path))
+        self._compactor: Optional[threading.Thread] = None
+
+
+    def load(self) -> pd.DataFrame:
+        with self._compact_lock:
+            snapshot = CSVStorage(self.path).load()
+            entries = self._read_journal(self.compacting_path) + self._read_journal(self.journal_path)
+        return self._replay(snapshot, entries)
+
+
+    def append(self, expense: Dict):
+        self._append_lines(json.dumps({"op": "add", **{col: expense[col] for col in EXPENSE_COLUMNS}}) + "\n")
+
+
+    # All rows in one write and one fsync
+    def append_many(self, expenses: pd.DataFrame):
+        records = expenses[EXPENSE_COLUMNS].to_dict('records')
+        self._append_lines("".join(json.dumps({"op": "add", **record}) + "\n" for record in records))
+
+
+    # Write a fresh snapshot and drop both journals
+    def save_all(self, expenses: pd.DataFrame):
+        with self._compact_lock, self._write_lock:
+            write_csv_atomic(expenses[EXPENSE_COLUMNS], self.path)
+            for path in (self.compacting_path, self.journal_path):
+                if os.path.exists(path):
+                    os.remove(path)
+
+
+    # Merge the journal into the snapshot; in the background unless wait is True
+    def compact(self, wait: bool = True):
+        with self._write_lock:
+            if self._compactor is not None and self._compactor.is_alive():
+                compactor = self._compactor
+            else:
+                compactor = threading.Thread(target=self._compact, name="journal-compaction", daemon=True)
+                self._compactor = compactor
+                compactor.start()
+        if wait:
+            compactor.join()
+
+
+    def change_token(self):
+        return _file_stamps([self.path, self.compacting_path, self.journal_path])
+
+
+    def close(self):
+        if self._compactor is not None:
+            self._compactor.join()
+
+
+    # ---------------- INTERNAL HELPERS ----------------
+    def _append_lines(self, lines: str):
+        with self._write_lock:
+            with open(self.journal_path, "a", encoding="utf-8") as f:
+                f.write(lines)
+                f.flush()
+                os.fsync(f.fileno())
+                size = f.tell()
+        if size >= self.compact_bytes:
+            self.compact(wait=False)
+
+
+    def _compact(self):
+        try:
+            with self._file_lock, self._compact_lock:
+                # A compacting journal left by a crash is finished first; otherwise rotate
+                with self._write_lock:
+                    if not os.path.exists(self.compacting_path):
+                        if not os.path.exists(self.journal_path):
+                            return
+                        os.replace(self.journal_path, self.compacting_path)
+                snapshot = CSVStorage(self.path).load()
+                merged = self._replay(snapshot, self._read_journal(self.compacting_path))
+                write_csv_atomic(merged, self.path)
+                os.remove(self.compacting_path)
+        except Exception:
+            logger.exception("Error compacting expense journal")
+
+
+    # Journal entries in file order; a torn or corrupt line (crash mid-write) is skipped
+    def _read_journal(self, path: str) -> List[Dict]:
+        if not os.path.exists(path):
+            return []
+        entries = []
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if entry.get("op") == "add":
+                    entries.append({col: entry.get(col) for col in EXPENSE_COLUMNS})
+        return entries
+
+
+    def _replay(self, snapshot: pd.DataFrame, entries: List[Dict]) -> pd.DataFrame:
+        if not entries:
+            return snapshot
+        journal = pd.DataFrame(entries, columns=EXPENSE_COLUMNS)
+        merged = journal if snapshot.empty else pd.concat([snapshot, journal], ignore_index=True)
+        return merged.drop_duplicates(subset='id', keep='last').reset_index(drop=True)
+
+
+# (mtime, size) of each file, None for missing ones
+def _file_stamps(paths: List[str]):
+    stamps = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            stamps.append((stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            stamps.append(None)
+    return tuple(stamps)
+
+
+# Write a DataFrame as CSV via a temp file + rename, so a crash never leaves a truncated file
+def write_csv_atomic(df: pd.DataFrame, path: str):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8", newline="") as f:
+        df.to_csv(f, index=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    try:
+        # Make the rename itself durable (POSIX only)
+        dir_fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+    except (OSError, AttributeError):
+        pass
+
+
+# SQLite ledger: one transactional INSERT per expense, indexed date/category/vendor columns
+# and aggregates computed by the database instead of in Python
+class SQLiteStorage(ExpenseStorage):
+
+    incremental = True
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS expenses (
+            id       INTEGER PRIMARY KEY,
+            amount   REAL    NOT NULL,
+            date     TEXT    NOT NULL,
+            vendor   TEXT    NOT NULL,
+            category TEXT    NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_expenses_date ON expenses(date);
+        CREATE INDEX IF NOT EXISTS idx_expenses_category ON expenses(category, date);
+        CREATE INDEX IF NOT EXISTS idx_expenses_vendor ON expenses(vendor);
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        # Streamlit runs each session in its own thread; access is serialized by self._lock
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            # WAL: readers don't block the writer and each commit appends instead of rewriting
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(self.SCHEMA)
+
+
+    def load(self) -> pd.DataFrame:
+        with self._lock:
+            return pd.read_sql_query(
+                "SELECT id, amount, date, vendor, category FROM expenses ORDER BY id", self._conn
+            )
+
+
+    def append(self, expense: Dict):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO expenses (id, amount, date, vendor, category) VALUES (?, ?, ?, ?, ?)",
+                (expense['id'], expense['amount'], expense['date'], expense['vendor'], expense['category'])
+            )
+
+
+    # All rows in one transaction
+    def append_many(self, expenses: pd.DataFrame):
+        rows = expenses[EXPENSE_COLUMNS].itertuples(index=False, name=None)
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT INTO expenses (id, amount, date, vendor, category) VALUES (?, ?, ?, ?, ?)", rows
+            )
+
+
+    def save_all(self, expenses: pd.DataFrame):
+        rows = expenses[EXPENSE_COLUMNS].itertuples(index=False, name=None)
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM expenses")
+            self._conn.executemany(
+                "INSERT INTO expenses (id, amount, date, vendor, category) VALUES (?, ?, ?, ?, ?)", rows
+            )
+
+
+    # ---------------- AGGREGATE QUERIES ----------------
+    def total_spending(self) -> float:
+        return self._scalar("SELECT COALESCE(SUM(amount), 0) FROM expenses")
+
+
+    def count(self) -> int:
+        return self._scalar("SELECT COUNT(*) FROM expenses")
+
+
+    def total_by_category(self) -> Dict[str, float]:
+        with self._lock:
+            rows = self._conn.execute("SELECT category, SUM(amount) FROM expenses GROUP BY category").fetchall()
+        return dict(rows)
+
+
+    def categories(self) -> List[str]:
+        with self._lock:
+            rows = self._conn.execute("SELECT DISTINCT category FROM expenses").fetchall()
+        return [row[0] for row in rows]
+
+
+    # Expenses with start <= date <= end (ISO date strings), newest first
+    def query_range(self, start: str, end: str, category: Optional[str] = None) -> pd.DataFrame:
+        sql = "SELECT id, amount, date, vendor, category FROM expenses WHERE date BETWEEN ? AND ?"
+        params = [start, end]
+        if category is not None:
+            sql += " AND category = ?"
+            params.append(category)
+        with self._lock:
+            return pd.read_sql_query(sql + " ORDER BY date DESC, id DESC", self._conn, params=params)
+
+
+    # One-shot import of an existing expenses.csv; skipped when the database already has rows.
+    # Returns the number of rows migrated.
+    def migrate_from_csv(self, csv_path: str) -> int:
+        if self.count() > 0 or not os.path.exists(csv_path):
+            return 0
+        df = pd.read_csv(csv_path)
+        if df.empty:
+            return 0
+        if 'id' not in df.columns:
+            df['id'] = range(1, len(df) + 1)
+        self.save_all(df)
+        return len(df)
+
+
+    # data_version changes when another connection commits
+    def change_token(self):
+        return self._scalar("PRAGMA data_version")
+
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+    def _scalar(self, sql: str):
+        with self._lock:
+            return self._conn.execute(sql).fetchone()[0]
+
+
+# Month-partitioned Arrow ledger: a directory with one uncompressed Arrow IPC file per month
+# (expenses.arrow/2024-05.arrow, undated rows in undated.arrow). Partitions are memory-mapped,
+# so the OS only pages in what is read: load_months() and load(start, end) open just the
+# months asked for, and count()/max_id()/categories() touch a single column. append() adds
+# one line to the month's delta file (2024-05.delta.jsonl) instead of rewriting the month;
+# the delta is merged into the partition once it reaches delta_bytes. append_many and
+# save_all rewrite each touched month once, delta included (temp file + rename). A row found
+# in both a partition and its delta (crash during a merge) is read once, and a torn last
+# delta line is ignored. Needs pyarrow (pip install pyarrow).
+class ArrowStorage(ExpenseStorage):
+
+    incremental = True
+    partitioned = True
+    UNDATED = "undated"
+    DELTA_SUFFIX = ".delta.jsonl"
+
+    def __init__(self, path: str, delta_bytes: int = 256 * 1024):
+        self.pa = _import_pyarrow()
+        self.path = path
+        self.delta_bytes = delta_bytes
+        self.schema = self.pa.schema([
+            ("id", self.pa.int64()), ("amount", self.pa.float64()), ("date", self.pa.date32()),
+            ("vendor", self.pa.string()), ("category", self.pa.string())
+        ])
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+
+    # Stored months ("YYYY-MM"), oldest first
+    def months(self) -> List[str]:
+        return [month for month in self._partitions() if month != self.UNDATED]
+
+
+    # The ledger (ordered by id), or only start <= date <= end (ISO strings, either optional).
+    # Dates come back as datetime64.
+    def load(self, start: Optional[str] = None, end: Optional[str] = None) -> pd.DataFrame:
+        months = [month for month in self.months()
+                  if (start is None or month >= start[:7]) and (end is None or month <= end[:7])]
+        if start is None and end is None:
+            months.append(self.UNDATED)
+        df = self.load_months(months)
+        if start is not None:
+            df = df[df['date'] >= pd.Timestamp(start)]
+        if end is not None:
+            df = df[df['date'] <= pd.Timestamp(end)]
+        return df.reset_index(drop=True)
+
+
+    # Rows of the given months (UNDATED for the undated rows), ordered by id
+    def load_months(self, months: List[str]) -> pd.DataFrame:
+        with self._lock:
+            tables = [table for table in map(self._read, months) if table is not None]
+        if not tables:
+            return pd.DataFrame(columns=EXPENSE_COLUMNS)
+        df = self.pa.concat_tables(tables).to_pandas(date_as_object=False)
+        return df.sort_values('id', kind='stable').reset_index(drop=True)
+
+
+    # Number of stored expenses (from the partition metadata and the delta files)
+    def count(self) -> int:
+        return sum(len(table) for table in self._tables())
+
+
+    # Highest stored id, 0 when empty (reads only the id column)
+    def max_id(self) -> int:
+        return max((int(table.column("id").to_numpy().max()) for table in self._tables() if len(table)), default=0)
+
+
+    # Distinct categories (reads only the category column)
+    def categories(self) -> List[str]:
+        names = {}
+        for table in self._tables():
+            names.update(dict.fromkeys(table.column("category").unique().to_pylist()))
+        return list(names)
+
+
+    # One line appended to the month's delta; the month is rewritten only when the delta is full
+    def append(self, expense: Dict):
+        month = pd.Timestamp(expense['date']).strftime("%Y-%m")
+        with self._lock:
+            with open(self._delta_path(month), "a", encoding="utf-8") as f:
+                f.write(json.dumps({col: expense[col] for col in EXPENSE_COLUMNS}) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+                size = f.tell()
+            if size >= self.delta_bytes:
+                self._merge(month)
+
+
+    # Each touched month is rewritten once, with its delta merged in
+    def append_many(self, expenses: pd.DataFrame):
+        table = self._table(expenses[EXPENSE_COLUMNS])
+        months = self._month_keys(table)
+        with self._lock:
+            for month in sorted(set(months)):
+                rows = table.filter(self.pa.array(months == month))
+                existing = self._read(month)
+                self._write(month, rows if existing is None else self.pa.concat_tables([existing, rows]))
+                self._remove(self._delta_path(month))
+
+
+    def save_all(self, expenses: pd.DataFrame):
+        table = self._table(expenses[EXPENSE_COLUMNS])
+        months = self._month_keys(table)
+        with self._lock:
+            for month in set(self._partitions()) - set(months):
+                self._remove(self._partition_path(month))
+                self._remove(self._delta_path(month))
+            for month in sorted(set(months)):
+                self._write(month, table.filter(self.pa.array(months == month)))
+                self._remove(self._delta_path(month))
+
+
+    # One-shot import of an existing expenses.csv; skipped when the store already has data.
+    # Returns the number of rows imported.
+    def migrate_from_csv(self, csv_path: str) -> int:
+        if self._partitions() or not os.path.exists(csv_path):
+            return 0
+        df = pd.read_csv(csv_path)
+        if df.empty:
+            return 0
+        if 'id' not in df.columns:
+            df['id'] = range(1, len(df) + 1)
+        self.save_all(df)
+        return len(df)
+
+
+    def change_token(self):
+        with self._lock:
+            names = sorted(name for name in os.listdir(self.path)
+                           if name.endswith(".arrow") or name.endswith(self.DELTA_SUFFIX))
+        return _file_stamps([os.path.join(self.path, name) for name in names]) + tuple(names)
+
+
+    # Write the ledger back out in the CSV layout (ISO date strings)
+    def export_csv(self, csv_path: str) -> int:
+        df = self.load()
+        df['date'] = df['date'].dt.strftime('%Y-%m-%d')
+        write_csv_atomic(df[EXPENSE_COLUMNS], csv_path)
+        return len(df)
+
+
+    # ---------------- INTERNAL HELPERS ----------------
+    def _partition_path(self, month: str) -> str:
+        return os.path.join(self.path, f"{month}.arrow")
+
+
+    def _delta_path(self, month: str) -> str:
+        return os.path.join(self.path, month + self.DELTA_SUFFIX)
+
+
+    # Months (and UNDATED) that have a partition or a delta file, sorted
+    def _partitions(self) -> List[str]:
+        months = set()
+        for name in os.listdir(self.path):
+            if name.endswith(self.DELTA_SUFFIX):
+                months.add(name[:-len(self.DELTA_SUFFIX)])
+            elif name.endswith(".arrow"):
+                months.add(name[:-len(".arrow")])
+        return sorted(months)
+
+
+    # Every stored month as a table (memory-mapped, so only the columns used are paged in)
+    def _tables(self) -> list:
+        with self._lock:
+            return [table for table in map(self._read, self._partitions()) if table is not None]
+
+
+    # One month: the memory-mapped partition plus the rows of its delta that the partition
+    # does not hold yet (None if neither exists); caller holds the lock
+    def _read(self, month: str):
+        partition = self._partition_path(month)
+        table = None
+        if os.path.exists(partition):
+            table = self.pa.ipc.open_file(self.pa.memory_map(partition, "r")).read_all()
+        delta = self._read_delta(month)
+        if delta is None:
+            return table
+        if table is None:
+            return delta
+        new_rows = ~np.isin(delta.column("id").to_numpy(), table.column("id").to_numpy())
+        return self.pa.concat_tables([table, delta.filter(self.pa.array(new_rows))])
+
+
+    # Rows of a month's delta file as a table (None if there are none); a torn or corrupt
+    # line (crash mid-write) is skipped
+    def _read_delta(self, month: str):
+        path = self._delta_path(month)
+        if not os.path.exists(path):
+            return None
+        records = []
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+        if not records:
+            return None
+        return self._table(pd.DataFrame(records, columns=EXPENSE_COLUMNS))
+
+
+    # Fold a month's delta into its partition; caller holds the lock
+    def _merge(self, month: str):
+        merged = self._read(month)
+        if merged is not None:
+            self._write(month, merged)
+        self._remove(self._delta_path(month))
+
+
+    # Atomically replace one partition; caller holds the lock
+    def _write(self, month: str, table):
+        partition = self._partition_path(month)
+        tmp_path = f"{partition}.{os.getpid()}.tmp"
+        with self.pa.OSFile(tmp_path, "wb") as sink:
+            with self.pa.ipc.new_file(sink, self.schema) as writer:
+                writer.write_table(table)
+        os.replace(tmp_path, partition)
+
+
+    @staticmethod
+    def _remove(path: str):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+    # DataFrame in the CSV layout -> Arrow table with self.schema
+    def _table(self, df: pd.DataFrame):
+        dates = pd.to_datetime(df['date'], errors='coerce').to_numpy().astype('datetime64[D]')
+        return self.pa.table({
+            "id": self.pa.array(df['id'].to_numpy(dtype='int64')),
+            "amount": self.pa.array(df['amount'].to_numpy(dtype='float64')),
+            "date": self.pa.array(dates, type=self.pa.date32(), from_pandas=True),
+            "vendor": self.pa.array(df['vendor'].astype(str).to_numpy(dtype=object)),
+            "category": self.pa.array(df['category'].astype(str).to_numpy(dtype=object)),
+        }, schema=self.schema)
+
+
+    # "YYYY-MM" (or UNDATED) for every row of an Arrow table
+    def _month_keys(self, table):
+        months = table.column("date").to_numpy(zero_copy_only=False).astype('datetime64[M]').astype(str)
+        months[months == 'NaT'] = self.UNDATED
+        return months
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc  # noqa: F401
+    except ImportError:
+        raise ImportError("The Arrow ledger needs pyarrow: pip install pyarrow")
+    return pyarrow
+
+
+# Pick the backend from the data file name: .db / .sqlite / .sqlite3 use SQLite, .arrow the
+# month-partitioned Arrow directory, anything else CSV (in journal mode when journal is True)
+def open_storage(data_file: str, journal: bool = False) -> ExpenseStorage:
+    extension = os.path.splitext(data_file.rstrip("/\\"))[1].lower()
+    if extension in ('.db', '.sqlite', '.sqlite3'):
+        return SQLiteStorage(data_file)
+    if extension == '.arrow':
+        return ArrowStorage(data_file)
+    if journal:
+        return JournalCSVStorage(data_file)
+    return CSVStorage(data_file)
+
+
+# Command line migration:  python storage.py expenses.csv expenses.db   (or expenses.arrow)
+# and back to CSV:         python storage.py expenses.arrow expenses.csv
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) != 3:
+        print("Usage: python storage.py <expenses.csv> <expenses.db|expenses.arrow>")
+        print("       python storage.py <expenses.arrow> <expenses.csv>")
+        sys.exit(1)
+    source, target = sys.argv[1], sys.argv[2]
+    if target.lower().endswith(".csv"):
+        storage = ArrowStorage(source)
+        print(f"Exported {storage.export_csv(target)} expenses to {target}")
+    else:
+        storage = open_storage(target)
+        print(f"Migrated {storage.migrate_from_csv(source)} expenses into {target}")
+    storage.close()